@@ -0,0 +1,179 @@
+'''Moves past-date slots and their queued parties into slots_archive / queued_parties_archive.
+
+Works in batches: each one is a single statement (select a chunk FOR UPDATE SKIP LOCKED, delete it, insert what
+was deleted into the archive) committed on its own, with a pause in between. No lock is held for longer than one
+batch and rows a booking request has locked are skipped, not waited on. A crash loses at most the batch in flight
+(rolled back, still in the hot table), so rerunning picks up where it stopped; rerunning when there's nothing left is
+a no-op. Parties go first, slots are only moved once no party references them.
+
+Before that, the occupancy deltas written by bookings, enqueues and cancels are compacted into the occupancy
+summary the same way (a batch of deltas deleted and added onto the summary rows in one statement), so the
+stats endpoint keeps reading a few rows per bucket and the history it describes can leave the hot tables.
+
+Bookings listings cached before the run can still show archived parties until BOOKINGS_TTL runs out.
+
+Usage:
+    python archive_expired.py                               # everything dated yesterday or earlier
+    python archive_expired.py --through 2025-12-31 --batch-size 2000 --pause-ms 250
+    python archive_expired.py --max-batches 10              # bounded run, the next one continues
+'''
+import psycopg2 as pg
+from psycopg2 import errors
+import os
+import argparse
+from time import sleep, perf_counter
+from traceback import format_exc
+from dotenv import load_dotenv
+from datetime import datetime, date, timedelta
+
+CWD = os.path.dirname(__file__)
+
+
+output = load_dotenv(dotenv_path=os.path.join(os.path.dirname(CWD), '.env'),
+                verbose=True)
+
+if not output:
+    raise FileNotFoundError(f".env file at {os.path.join(os.path.dirname(CWD), '.env')} not found. Script execution aborted. Time: {datetime.now()}")
+
+DB_CONFIG_KWARGS = {
+    "database" : os.environ["DB_NAME"],
+    "user" : os.environ["DB_USERNAME"],
+    "password" : os.environ["DB_PASSWORD"],
+    "host" : os.environ["DB_URI"]
+}
+
+DEFAULT_BATCH = int(os.environ.get("LIB_ARCHIVE_BATCH", 5000))
+DEFAULT_PAUSE = float(os.environ.get("LIB_ARCHIVE_PAUSE_MS", 100)) / 1000
+LOCK_TIMEOUT = "2s"             # Table level locks (a migration, say) make a batch give up instead of queueing everyone behind it
+MAX_LOCK_FAILURES = 3           # Consecutive batches that ran into LOCK_TIMEOUT before the run stops
+
+PARTY_COLUMNS = "id, holder_name, holder_phone, holder_email, time_booked, queue_position, room_id, slot_id, slot_time, slot_date, passkey"
+SLOT_COLUMNS = "id, time_slot, date, room, booked, queue_length, holder, version"
+
+OCCUPANCY_COUNTS = "slots, booked, parties, peak_queue, cancellations"
+
+# Every statement ends in the number of rows it took out of its hot table, a short batch ends that table's loop
+COMPACT_OCCUPANCY = f"""WITH batch AS (
+                            SELECT id FROM occupancy_deltas
+                            LIMIT %(batch)s FOR UPDATE SKIP LOCKED
+                        ), moved AS (
+                            DELETE FROM occupancy_deltas USING batch WHERE occupancy_deltas.id = batch.id
+                            RETURNING room, weekday, hour, {OCCUPANCY_COUNTS}
+                        ), folded AS (
+                            INSERT INTO occupancy (room, weekday, hour, {OCCUPANCY_COUNTS})
+                            SELECT room, weekday, hour, sum(slots), sum(booked), sum(parties), max(peak_queue), sum(cancellations)
+                            FROM moved GROUP BY room, weekday, hour
+                            ON CONFLICT (room, weekday, hour) DO UPDATE SET
+                                slots = occupancy.slots + EXCLUDED.slots,
+                                booked = occupancy.booked + EXCLUDED.booked,
+                                parties = occupancy.parties + EXCLUDED.parties,
+                                peak_queue = greatest(occupancy.peak_queue, EXCLUDED.peak_queue),
+                                cancellations = occupancy.cancellations + EXCLUDED.cancellations
+                        )
+                        SELECT count(*) FROM moved"""
+
+# ON CONFLICT can only trigger if an id was archived before and then reused (sequence reset), the hot row wins
+# (DO NOTHING would drop it, it's already deleted from the hot table)
+ARCHIVE_PARTIES = f"""WITH batch AS (
+                          SELECT id FROM queued_parties WHERE slot_date <= %(cutoff)s
+                          LIMIT %(batch)s FOR UPDATE SKIP LOCKED
+                      ), moved AS (
+                          DELETE FROM queued_parties USING batch WHERE queued_parties.id = batch.id
+                          RETURNING {", ".join("queued_parties." + column for column in PARTY_COLUMNS.split(", "))}
+                      ), archived AS (
+                          INSERT INTO queued_parties_archive ({PARTY_COLUMNS})
+                          SELECT {PARTY_COLUMNS} FROM moved
+                          ON CONFLICT (id) DO UPDATE SET {", ".join(f"{column} = EXCLUDED.{column}" for column in PARTY_COLUMNS.split(", ")[1:])}, archived_at = now()
+                      )
+                      SELECT count(*) FROM moved"""
+
+# NOT EXISTS: a party we skipped (locked) still points at its slot, that slot waits for a later run
+ARCHIVE_SLOTS = f"""WITH batch AS (
+                        SELECT id FROM slots WHERE date <= %(cutoff)s
+                        AND NOT EXISTS (SELECT 1 FROM queued_parties WHERE queued_parties.slot_id = slots.id)
+                        LIMIT %(batch)s FOR UPDATE SKIP LOCKED
+                    ), moved AS (
+                        DELETE FROM slots USING batch WHERE slots.id = batch.id
+                        RETURNING {", ".join("slots." + column for column in SLOT_COLUMNS.split(", "))}
+                    ), archived AS (
+                        INSERT INTO slots_archive ({SLOT_COLUMNS})
+                        SELECT {SLOT_COLUMNS} FROM moved
+                        ON CONFLICT (id) DO UPDATE SET {", ".join(f"{column} = EXCLUDED.{column}" for column in SLOT_COLUMNS.split(", ")[1:])}, archived_at = now()
+                    )
+                    SELECT count(*) FROM moved"""
+
+def archive(conn, cutoff : date, batch_size : int = DEFAULT_BATCH, pause : float = DEFAULT_PAUSE, max_batches : int | None = None) -> dict:
+    '''Compact the occupancy deltas, then move everything dated `cutoff` or earlier, committing per batch. Returns rows
+    taken out of each table, batches, seconds taken, the longest batch (how long its row locks were held) and whether
+    it ran to the end.'''
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1")
+
+    report = {"occupancy_deltas" : 0, "queued_parties" : 0, "slots" : 0, "batches" : 0, "seconds" : 0.0, "longest_batch_ms" : 0.0, "complete" : False}
+    started = perf_counter()
+    with conn.cursor() as db_cursor:
+        db_cursor.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+        conn.commit()
+        for table, statement in (("occupancy_deltas", COMPACT_OCCUPANCY), ("queued_parties", ARCHIVE_PARTIES), ("slots", ARCHIVE_SLOTS)):
+            failures = 0
+            while True:
+                if report["batches"] == max_batches:
+                    report["seconds"] = perf_counter() - started
+                    return report
+
+                batchStart = perf_counter()
+                try:
+                    db_cursor.execute(statement, {"cutoff" : cutoff, "batch" : batch_size})
+                    moved = db_cursor.fetchone()[0]
+                    conn.commit()
+                except errors.LockNotAvailable:
+                    conn.rollback()
+                    failures += 1
+                    if failures == MAX_LOCK_FAILURES:
+                        print(f"WARNING: {table} stayed locked for {MAX_LOCK_FAILURES} batches in a row, stopping. Rerun to continue.")
+                        report["seconds"] = perf_counter() - started
+                        return report
+                    sleep(pause)
+                    continue
+
+                failures = 0
+                report["batches"] += 1
+                report["longest_batch_ms"] = max(report["longest_batch_ms"], (perf_counter() - batchStart) * 1000)
+                report[table] += moved
+                if moved < batch_size:
+                    break           # Done, anything left is locked by a request right now and the next run gets it
+                sleep(pause)
+
+    report["seconds"] = perf_counter() - started
+    report["complete"] = True
+    return report
+
+def main(argv : list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--through", type=date.fromisoformat, default=datetime.today().date() - timedelta(days=1), help="Last date archived, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH, help="Rows per batch (default: LIB_ARCHIVE_BATCH or 5000)")
+    parser.add_argument("--pause-ms", type=float, default=DEFAULT_PAUSE * 1000, help="Sleep between batches (default: LIB_ARCHIVE_PAUSE_MS or 100)")
+    parser.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches")
+    args = parser.parse_args(argv)
+
+    if args.through >= datetime.today().date():
+        raise ValueError("Refusing to archive today's or future slots, --through has to be in the past")
+
+    conn = None
+    try:
+        conn = pg.connect(**DB_CONFIG_KWARGS)
+        report = archive(conn, args.through, args.batch_size, args.pause_ms / 1000, args.max_batches)
+        print(f"Compacted {report['occupancy_deltas']} occupancy deltas, archived {report['queued_parties']} parties and {report['slots']} slots through {args.through} in {report['batches']} batches, {report['seconds']:.2f}s "
+              f"(longest batch {report['longest_batch_ms']:.0f}ms)" + ("" if report["complete"] else ", stopped early, rerun to continue"))
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print("ERROR: SCRIPT FAILED")
+        print(format_exc())
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    main()
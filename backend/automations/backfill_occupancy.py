@@ -0,0 +1,95 @@
+'''Rebuilds the occupancy summary from every slot there is, hot and archived, in one streaming pass.
+
+For databases that had slots before the summary existed, or to true it up. Slots are read through a server side
+cursor and folded into one bucket per (room, weekday, hour), so memory doesn't grow with history, then the summary
+is replaced in the same transaction. All of it runs in one REPEATABLE READ snapshot: deltas from writes that commit
+while it runs are outside the snapshot and stay pending, so they are neither lost nor counted twice. If it collides
+with archive_expired.py compacting at the same moment it fails with a serialization error and can simply be rerun.
+
+The slots don't record cancellations, those already counted (summary and pending deltas) carry over. Peak queue
+lengths start over from the queue lengths the slots have now.
+
+Usage:
+    python backfill_occupancy.py
+    python backfill_occupancy.py --fetch-size 50000
+'''
+import psycopg2 as pg
+from psycopg2.extras import execute_values
+import argparse
+from time import perf_counter
+from traceback import format_exc
+
+from shift_window import DB_CONFIG_KWARGS
+
+READ_SLOTS = """SELECT room, date, time_slot, booked, queue_length FROM slots
+                UNION ALL
+                SELECT room, date, time_slot, booked, queue_length FROM slots_archive"""
+
+CARRIED_CANCELLATIONS = """SELECT room, weekday, hour, sum(cancellations) FROM (
+                               SELECT room, weekday, hour, cancellations FROM occupancy
+                               UNION ALL
+                               SELECT room, weekday, hour, cancellations FROM occupancy_deltas
+                           ) AS counted
+                           GROUP BY room, weekday, hour HAVING sum(cancellations) <> 0"""
+
+INSERT_OCCUPANCY = """INSERT INTO occupancy (room, weekday, hour, slots, booked, parties, peak_queue, cancellations) VALUES %s"""
+
+def backfill(conn, fetch_size : int = 10000) -> dict:
+    '''Replace the summary, committed as one transaction. Returns slots read, buckets written and seconds taken.'''
+    started = perf_counter()
+    conn.set_session(isolation_level="REPEATABLE READ")
+    try:
+        buckets : dict[tuple[int, int, int], list[int]] = {}       # -> [slots, booked, parties, peak_queue, cancellations]
+        read = 0
+        with conn.cursor(name="occupancy_backfill") as slots_cursor:
+            slots_cursor.itersize = fetch_size
+            slots_cursor.execute(READ_SLOTS)
+            for room_id, slot_date, slot_time, booked, queue_length in slots_cursor:
+                bucket = buckets.get((room_id, slot_date.weekday(), slot_time.hour))
+                if bucket is None:
+                    bucket = buckets[(room_id, slot_date.weekday(), slot_time.hour)] = [0, 0, 0, 0, 0]
+                bucket[0] += 1
+                bucket[1] += booked
+                bucket[2] += queue_length
+                if queue_length > bucket[3]:
+                    bucket[3] = queue_length
+                read += 1
+
+        with conn.cursor() as db_cursor:
+            db_cursor.execute(CARRIED_CANCELLATIONS)
+            for room_id, weekday, hour, cancellations in db_cursor.fetchall():
+                buckets.setdefault((room_id, weekday, hour), [0, 0, 0, 0, 0])[4] = cancellations
+
+            # Only deltas this snapshot can see go, they're the ones already reflected in the slots just read
+            db_cursor.execute("DELETE FROM occupancy_deltas")
+            db_cursor.execute("DELETE FROM occupancy")
+            execute_values(db_cursor, INSERT_OCCUPANCY, [(*key, *counts) for key, counts in buckets.items()], page_size=fetch_size)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.set_session(isolation_level="DEFAULT")
+
+    return {"slots" : read, "buckets" : len(buckets), "seconds" : perf_counter() - started}
+
+def main(argv : list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fetch-size", type=int, default=10000, help="Rows per round trip of the server side cursor")
+    args = parser.parse_args(argv)
+
+    conn = None
+    try:
+        conn = pg.connect(**DB_CONFIG_KWARGS)
+        report = backfill(conn, args.fetch_size)
+        print(f"Rebuilt {report['buckets']} occupancy buckets from {report['slots']} slots in {report['seconds']:.2f}s")
+
+    except Exception as e:
+        print("ERROR: SCRIPT FAILED")
+        print(format_exc())
+    finally:
+        if conn:
+            conn.close()
+
+if __name__ == "__main__":
+    main()
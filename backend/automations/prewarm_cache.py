@@ -0,0 +1,78 @@
+'''Fills Redis with the slot listings getRoomDetails serves, so the first users after a window shift hit a warm cache.
+
+Writes every per-(room, date) listing, and the per-room window listing (no filters) when LIB_AVAILABILITY_INDEX is
+off, in one pipelined batch under the same keys and versions routes.py reads. With the index on, the workers answer
+the no-filter listing from it and never read that key. Runs at the end of shift_window.py, or on its own:
+
+Usage:
+    python prewarm_cache.py                     # every room with slots in the window
+    python prewarm_cache.py --rooms 1-50
+'''
+import os
+import sys
+import argparse
+from itertools import groupby
+from datetime import datetime, date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)         # Run as a script from automations/, the service package lives one level up
+
+from sqlalchemy import select
+
+from service import app, db, redisManager
+from service.models import Slot
+from service.routes import _SLOT_COLUMNS, _slotListing
+from service.auxillary_modules.responses import dumpJSON
+from service.auxillary_modules.cachekeys import SLOTS_TTL, slotsKey, slotsVersionKey, parseVersion
+
+def prewarm(rooms : list[int] | None = None, today : date | None = None) -> int:
+    '''Compute and cache the listings for `rooms` (default: all of them), returns how many keys were written'''
+    if not redisManager:
+        print("Redis is not configured, nothing to prewarm")
+        return 0
+
+    today = today or datetime.date(datetime.now())
+    windowEnd = today + timedelta(days=app.config["FUTURE_WINDOW_SIZE"])     # Unfiltered listings stop before this
+    lastBookable = windowEnd                                                # ?date= accepts up to and including it
+
+    with app.app_context():
+        query = select(Slot.room, *_SLOT_COLUMNS).where(Slot.date >= today, Slot.date <= lastBookable)
+        if rooms:
+            query = query.where(Slot.room.in_(rooms))
+
+        # Versions go first, same as getRoomDetails: anything committed after this point bumps them past our keys
+        rooms = rooms or db.session.execute(select(Slot.room).where(Slot.date >= today, Slot.date <= lastBookable).distinct()).scalars().all()
+        dates = [today + timedelta(days=offset) for offset in range((lastBookable - today).days + 1)]
+        warmWindow = not app.config["AVAILABILITY_INDEX"]
+        versionKeys = [slotsVersionKey(room_id, slotDate) for room_id in rooms for slotDate in ([None] if warmWindow else []) + dates]
+        versions = {key : parseVersion(version) for key, version in zip(versionKeys, redisManager.safe_mget(*versionKeys))}
+
+        slots = db.session.execute(query.order_by(Slot.room, Slot.date, Slot.time_slot)).all()
+        items = []
+        for room_id, roomSlots in groupby(slots, key=lambda slot: slot.room):
+            roomSlots = [slot[1:] for slot in roomSlots]       # Without the room, as _slotListing takes them
+            window = _slotListing(slot for slot in roomSlots if slot[1] < windowEnd) if warmWindow else None
+            if window:
+                items.append((slotsKey(room_id, versions[slotsVersionKey(room_id)], None, None), SLOTS_TTL, dumpJSON(window)))
+
+            for slotDate, daySlots in groupby(roomSlots, key=lambda slot: slot[1]):
+                items.append((slotsKey(room_id, versions[slotsVersionKey(room_id, slotDate)], slotDate, None),
+                              SLOTS_TTL,
+                              dumpJSON(_slotListing(daySlots))))
+        db.session.remove()
+
+    return redisManager.safe_setex_many(items)
+
+def main(argv : list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", default=None, help="Room IDs, e.g. '1,2,3' or '1-50' (default: every room with slots in the window)")
+    args = parser.parse_args(argv)
+
+    from shift_window import parse_rooms
+    started = datetime.now()
+    written = prewarm(parse_rooms(args.rooms) if args.rooms else None)
+    print(f"Prewarmed {written} slot listings in {(datetime.now() - started).total_seconds():.2f}s")
+
+if __name__ == "__main__":
+    main()
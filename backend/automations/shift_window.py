@@ -1,8 +1,20 @@
+'''Creates the slots for the booking window. Safe to rerun, existing (room, date, time_slot) rows are left alone.
+
+Usage:
+    python shift_window.py                                  # today + LIB_FUTURE_WINDOW_SIZE days, rooms from LIB_ROOMS
+    python shift_window.py --rooms 1-50 --start 2025-01-01 --days 90   # backfill
+    python shift_window.py --no-prewarm                     # skip warming the slot listing cache afterwards
+    python shift_window.py --no-archive                     # leave yesterday's and older slots in place (see archive_expired.py)
+'''
 import psycopg2 as pg
+from psycopg2.extras import execute_values
 import os
+import argparse
+from collections import Counter
 from traceback import format_exc
 from dotenv import load_dotenv
-from datetime import datetime, time, timedelta
+from datetime import datetime, date, time, timedelta
+from archive_expired import archive, DEFAULT_BATCH, DEFAULT_PAUSE
 
 CWD = os.path.dirname(__file__)
 
@@ -20,51 +32,121 @@ DB_CONFIG_KWARGS = {
     "host" : os.environ["DB_URI"]
 }
 
-ROOMS = [1,2,3]
+DEFAULT_ROOMS = os.environ.get("LIB_ROOMS", "1-3")
+DEFAULT_WINDOW = int(os.environ.get("LIB_FUTURE_WINDOW_SIZE", 3))
 
-op_time = os.environ["LIB_OPENING_TIME"]
-cl_time = os.environ["LIB_CLOSING_TIME"]
+# Conflict target is uq_slots_room_date_time_slot (migration 7c3e5a1f9d42)
+INSERT_SLOTS = """INSERT INTO slots (room, date, time_slot, booked, queue_length)
+                  VALUES %s
+                  ON CONFLICT (room, date, time_slot) DO NOTHING
+                  RETURNING room, date, time_slot"""
 
-#NOTE: Not importing any modules here for the sake of simplicity.
-try:
-    open_hour = int(op_time[:2])
-    close_hour = int(cl_time[:2])
-except Exception as e:
-    raise ValueError(f"Invalid time format. Ensure times are in HHMM format like '0700' and '1900'. Original Exception: {format_exc}")
+# Slots are the denominator of every utilisation figure, see Occupancy in service/models.py
+INSERT_OCCUPANCY = """INSERT INTO occupancy_deltas (room, weekday, hour, slots) VALUES %s"""
 
-# Validate the extracted hours
-if not (0 <= open_hour <= 23) or not (0 <= close_hour <= 23):
-    raise ValueError("Hours must be between 00 and 23.")
+#NOTE: Not importing any modules here for the sake of simplicity.
+def parse_hour(hhmm : str) -> int:
+    '''HHMM string like "0700" to an hour'''
+    try:
+        hour = int(hhmm[:2])
+    except Exception as e:
+        raise ValueError(f"Invalid time format. Ensure times are in HHMM format like '0700' and '1900'. Original Exception: {format_exc()}")
 
-if open_hour >= close_hour:
-    raise ValueError("Opening time must be earlier than closing time.")
+    if not (0 <= hour <= 23):
+        raise ValueError("Hours must be between 00 and 23.")
+    return hour
 
-new_date = (datetime.today() + timedelta(days=3)).date()
+def parse_rooms(spec : str) -> list[int]:
+    '''Comma separated room IDs and/or inclusive ranges, e.g. "1,2,5-9"'''
+    rooms = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            low, high = part.split("-", 1)
+            rooms.update(range(int(low), int(high) + 1))
+        else:
+            rooms.add(int(part))
 
-opening_time = datetime.combine(new_date, time(open_hour, 0))
-closing_time = datetime.combine(new_date, time(close_hour, 0))
+    if not rooms:
+        raise ValueError(f"No rooms found in room spec '{spec}'")
+    return sorted(rooms)
 
-purge_date = (datetime.today() - timedelta(days=1)).date()
+def build_slots(rooms : list[int], start_date : date, days : int, open_hour : int, close_hour : int) -> list[tuple]:
+    '''Every (room, date, time_slot, booked, queue_length) row in the window, opening and closing hour inclusive'''
+    hours = [time(hour, 0) for hour in range(open_hour, close_hour + 1)]
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    return [(room_id, slot_date, slot_time, False, 0) for slot_date in dates for room_id in rooms for slot_time in hours]
 
-try:
-    conn =  pg.connect(**DB_CONFIG_KWARGS)
+def insert_slots(conn, rows : list[tuple], page_size : int = 10000) -> int:
+    '''Write rows in multi-row INSERTs of `page_size`, returns how many were actually new. Those are counted into
+    occupancy_deltas per (room, weekday, hour) in the same transaction.'''
     with conn.cursor() as db_cursor:
-        current_date = datetime.today().date()
-        while current_date < new_date:
-            for room_id in ROOMS:
-                current_time = opening_time
-                while current_time <= closing_time:         # Oh lord forgive me for nesting three loops like this
-                    db_cursor.execute("INSERT INTO SLOTS (room, date, time_slot, booked, queue_length) VALUES (%s, %s, %s, %s, %s)", (room_id, current_date, current_time, False, 0,))
-                    current_time += timedelta(hours=1)
-            current_date += timedelta(days=1)
-        conn.commit()     
-    conn.close()
-
-except Exception as e:
-    if conn:
-        conn.rollback()
-    print("ERROR: SCRIPT FAILED")
-    print(format_exc())
-finally:
-    if conn:
-        conn.close()
\ No newline at end of file
+        inserted = execute_values(db_cursor, INSERT_SLOTS, rows, page_size=page_size, fetch=True)
+        created = Counter((room_id, slot_date.weekday(), slot_time.hour) for room_id, slot_date, slot_time in inserted)
+        if created:
+            execute_values(db_cursor, INSERT_OCCUPANCY, [(*bucket, count) for bucket, count in created.items()], page_size=page_size)
+    return len(inserted)
+
+def main(argv : list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", default=DEFAULT_ROOMS, help="Room IDs, e.g. '1,2,3' or '1-50' (default: LIB_ROOMS or 1-3)")
+    parser.add_argument("--start", type=date.fromisoformat, default=datetime.today().date(), help="First date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--days", type=int, default=DEFAULT_WINDOW, help="Number of days from --start (default: LIB_FUTURE_WINDOW_SIZE)")
+    parser.add_argument("--page-size", type=int, default=10000, help="Rows per INSERT statement")
+    parser.add_argument("--no-prewarm", action="store_true", help="Don't fill the slot listing cache after inserting (see prewarm_cache.py)")
+    parser.add_argument("--no-archive", action="store_true", help="Don't move slots and parties up to yesterday into the archive tables")
+    args = parser.parse_args(argv)
+
+    open_hour = parse_hour(os.environ["LIB_OPENING_TIME"])
+    close_hour = parse_hour(os.environ["LIB_CLOSING_TIME"])
+    if open_hour >= close_hour:
+        raise ValueError("Opening time must be earlier than closing time.")
+
+    rooms = parse_rooms(args.rooms)
+    purge_date = min((datetime.today() - timedelta(days=1)).date(), args.start - timedelta(days=1))     # A backfill never archives what it just created
+
+    started = datetime.now()
+    rows = build_slots(rooms, args.start, args.days, open_hour, close_hour)
+
+    conn = None
+    shifted = False
+    try:
+        conn =  pg.connect(**DB_CONFIG_KWARGS)
+        inserted = insert_slots(conn, rows, args.page_size)
+        conn.commit()
+        shifted = True
+        print(f"Created {inserted} of {len(rows)} slots ({len(rooms)} rooms, {args.start} + {args.days} days) in {(datetime.now() - started).total_seconds():.2f}s")
+
+        if not args.no_archive:
+            # New slots are already committed, an archive failure doesn't undo the shift
+            try:
+                report = archive(conn, purge_date, DEFAULT_BATCH, DEFAULT_PAUSE)
+                print(f"Compacted {report['occupancy_deltas']} occupancy deltas, archived {report['queued_parties']} parties and {report['slots']} slots through {purge_date} in {report['batches']} batches, {report['seconds']:.2f}s")
+            except Exception as e:
+                conn.rollback()
+                print("WARNING: Slots created but archiving failed, rerun archive_expired.py")
+                print(format_exc())
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print("ERROR: SCRIPT FAILED")
+        print(format_exc())
+    finally:
+        if conn:
+            conn.close()
+
+    if shifted and not args.no_prewarm:
+        # Imported here, it pulls in the whole service
+        try:
+            from prewarm_cache import prewarm
+            started = datetime.now()
+            print(f"Prewarmed {prewarm(rooms)} slot listings in {(datetime.now() - started).total_seconds():.2f}s")
+        except Exception as e:
+            print("WARNING: Slots created but cache prewarm failed, listings will be cached on first request instead")
+            print(format_exc())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+'''Benchmarks for the booking service. Run from backend/, e.g. `python -m benchmarks.bench_slot_indexes`'''
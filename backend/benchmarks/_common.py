@@ -0,0 +1,113 @@
+'''Shared helpers for the benchmark scripts. Nothing in here is imported by the service itself.'''
+import os
+import sys
+import time
+import tempfile
+import statistics
+from typing import Callable, Any
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_env() -> None:
+    '''Load backend/.env if there is one, benchmarks can also be driven purely by environment variables'''
+    load_dotenv(dotenv_path=os.path.join(BACKEND_DIR, '.env'))
+
+
+def database_url() -> str:
+    '''BENCH_DB_URL wins, otherwise the same DB_* variables the app uses'''
+    load_env()
+    if os.environ.get("BENCH_DB_URL"):
+        return os.environ["BENCH_DB_URL"]
+
+    return "postgresql://{user}:{password}@{url}/{db}".format(user=os.environ["DB_USERNAME"],
+                                                             password=os.environ["DB_PASSWORD"],
+                                                             url=os.environ["DB_URI"],
+                                                             db=os.environ["DB_NAME"])
+
+
+def measure(fn : Callable[[], Any], iterations : int) -> list[float]:
+    '''Call fn `iterations` times, return per-call latencies in milliseconds'''
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(samples : list[float], pct : float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples : list[float]) -> dict:
+    '''Latency summary in ms, rounded so the output stays readable'''
+    return {"n" : len(samples),
+            "mean" : round(statistics.fmean(samples), 4) if samples else 0.0,
+            "p50" : round(percentile(samples, 50), 4),
+            "p95" : round(percentile(samples, 95), 4),
+            "p99" : round(percentile(samples, 99), 4)}
+
+
+def bench_url(db_url : str | None = None) -> str:
+    '''db_url, else BENCH_DB_URL, else a throwaway SQLite file'''
+    load_env()
+    return db_url or os.environ.get("BENCH_DB_URL") or "sqlite:///" + os.path.join(tempfile.gettempdir(), "library_bench.db")
+
+
+def require_postgres(url : str, reason : str) -> None:
+    '''Stop with a message up front instead of failing halfway through on SQLite'''
+    if not url.startswith("postgresql"):
+        sys.exit(f"Needs Postgres ({reason}), got {url.split(':')[0]}. Set BENCH_DB_URL or pass --db-url.")
+
+
+def load_app(db_url : str | None = None, **env : str):
+    '''Build the service's app against bench_url(db_url) and create its tables.
+
+    Extra keyword arguments are environment variables for the config, e.g. LIB_AVAILABILITY_INDEX="0". They win over
+    backend/.env: that is loaded first, then they're exported and LIB_ENV_FILE is emptied, so neither this app nor a
+    child process building its own reads .env again.
+    '''
+    from service.config import loadEnv
+
+    url = bench_url(db_url)
+    loadEnv()
+    os.environ["DB_URL"] = url
+    os.environ.update(env)
+    os.environ["LIB_ENV_FILE"] = ""
+
+    from service import create_app, db
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app, db
+
+
+def seed_slots(db, rooms : int, days : int, open_hour : int = 8, close_hour : int = 20, booked_ratio : float = 0.3, seed : int = 42) -> int:
+    '''Fill `slots` with rooms x days x hours starting today, a fraction of them booked. Call inside an app context.'''
+    import random
+    from datetime import date, time, timedelta
+    from sqlalchemy import insert
+    from service.models import Slot
+
+    rng = random.Random(seed)
+    today = date.today()
+    rows = []
+    for day in range(days):
+        for room in range(1, rooms + 1):
+            for hour in range(open_hour, close_hour + 1):
+                booked = rng.random() < booked_ratio
+                rows.append({"room" : room, "date" : today + timedelta(days=day), "time_slot" : time(hour, 0),
+                             "booked" : booked, "queue_length" : 1 if booked else 0,
+                             "holder" : f"holder{room}_{day}_{hour}@bench.in" if booked else None})
+
+    db.session.execute(insert(Slot), rows)
+    db.session.commit()
+    return len(rows)
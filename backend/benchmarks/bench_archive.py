@@ -0,0 +1,137 @@
+'''automations/archive_expired.py against a table that has grown for a while: what moving the past out buys, and whether it's safe.
+
+Seeds rooms x (past + future) days of slots with parties on the booked ones, then checks:
+  - a bounded run (--max-batches) and a batch rolled back mid-statement (a crash) lose and duplicate nothing,
+  - a rerun finishes the job and every past row ends up in the archive exactly as it was, future rows untouched,
+  - a slot locked by a request is skipped without waiting, and picked up once the lock is gone,
+  - running once more moves nothing.
+Reports rows/s, the longest batch (the longest any lock is held), table sizes and a few hot reads before and after.
+
+Usage (from backend/):
+    python -m benchmarks.bench_archive --rooms 20 --past-days 365 --future-days 7 --batch-size 5000
+Postgres only (the archiver uses psycopg2 and SKIP LOCKED), BENCH_DB_URL or --db-url.
+'''
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import psycopg2 as pg
+from sqlalchemy import insert, select, update
+
+from benchmarks._common import BACKEND_DIR, load_app, database_url, require_postgres, seed_slots, measure, summarize
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, "automations"))
+
+# Whole row fingerprints, so "moved" can be checked as "moved unchanged"
+SLOT_ROWS = "SELECT md5(string_agg(concat_ws('|', id, time_slot, date, room, booked, queue_length, holder, version), ',' ORDER BY id)), count(*) FROM {table} WHERE date <= %s"
+PARTY_ROWS = "SELECT md5(string_agg(concat_ws('|', id, holder_name, holder_phone, holder_email, time_booked, queue_position, room_id, slot_id, slot_time, slot_date, passkey), ',' ORDER BY id)), count(*) FROM {table} WHERE slot_date <= %s"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--past-days", type=int, default=365)
+    parser.add_argument("--future-days", type=int, default=7)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    url = args.db_url or database_url()
+    require_postgres(url, "archive_expired.py uses psycopg2 and SKIP LOCKED")
+    app, db = load_app(url, LIB_AVAILABILITY_INDEX="0", LIB_FUTURE_WINDOW_SIZE=str(args.future_days))
+    from service import redisManager
+    from service.models import Slot, QueuedParty
+    from service.auxillary_modules.cachekeys import SLOTS_GENERATION_KEY
+    from archive_expired import archive, ARCHIVE_PARTIES
+
+    today = date.today()
+    cutoff = today - timedelta(days=1)
+    with app.app_context():
+        seeded = seed_slots(db, args.rooms, args.past_days + args.future_days, booked_ratio=0.3)
+        db.session.execute(update(Slot).values(date=Slot.date - args.past_days))
+        booked = db.session.execute(select(Slot.id, Slot.room, Slot.date, Slot.time_slot, Slot.holder).where(Slot.booked == True)).all()
+        db.session.execute(insert(QueuedParty.__table__),
+                           [{"holder_name" : "Bench", "holder_phone" : f"9{slotId % 1000:09d}", "holder_email" : holder, "time_booked" : datetime.now(),
+                             "queue_position" : 1, "room_id" : room, "slot_id" : slotId, "slot_time" : slotTime, "slot_date" : slotDate, "passkey" : "1234"}
+                            for slotId, room, slotDate, slotTime, holder in booked])
+        db.session.commit()
+        db.session.remove()
+    redisManager.safe_execute_command("INCR", True, SLOTS_GENERATION_KEY)
+
+    conn = pg.connect(url)
+    def scalar(query : str, *params):
+        with conn.cursor() as db_cursor:
+            db_cursor.execute(query, params)
+            row = db_cursor.fetchone()
+        conn.commit()
+        return row if len(row) > 1 else row[0]
+
+    expected = {"slots" : scalar(SLOT_ROWS.format(table="slots"), cutoff), "queued_parties" : scalar(PARTY_ROWS.format(table="queued_parties"), cutoff)}
+    future = {"slots" : scalar(SLOT_ROWS.replace("<=", ">").format(table="slots"), cutoff),
+              "queued_parties" : scalar(PARTY_ROWS.replace("<=", ">").format(table="queued_parties"), cutoff)}
+    totals = lambda: {"slots" : scalar("SELECT (SELECT count(*) FROM slots WHERE date <= %s) + (SELECT count(*) FROM slots_archive)", cutoff),
+                      "queued_parties" : scalar("SELECT (SELECT count(*) FROM queued_parties WHERE slot_date <= %s) + (SELECT count(*) FROM queued_parties_archive)", cutoff)}
+
+    client = app.test_client()
+    identity = booked[-1].holder
+    def reads() -> dict:
+        bump = lambda: redisManager.safe_execute_command("INCR", True, SLOTS_GENERATION_KEY)
+        return {"room_window_cold" : summarize(measure(lambda: (bump(), client.get(f"/rooms/{args.rooms}/slots?limit=500")), args.iterations)),
+                "grid_cold" : summarize(measure(lambda: (bump(), client.get("/rooms/availability")), args.iterations // 4 or 1)),
+                "bookings_uncached" : summarize(measure(lambda: client.get(f"/bookings/{identity}?limit=50"), args.iterations)),
+                "count_slots_ms" : summarize(measure(lambda: scalar("SELECT count(*) FROM slots"), 20))["p50"]}
+    sizes = lambda: {table : {"rows" : scalar(f"SELECT count(*) FROM {table}"), "bytes" : scalar("SELECT pg_total_relation_size(%s)", table)}
+                     for table in ("slots", "queued_parties", "slots_archive", "queued_parties_archive")}
+
+    report = {"slots" : seeded, "parties" : len(booked), "past_slots" : expected["slots"][1], "past_parties" : expected["queued_parties"][1],
+              "before" : {"reads" : reads(), "tables" : sizes()}}
+
+    # Bounded run, then a batch that dies before its commit: neither loses nor doubles anything
+    partial = archive(conn, cutoff, args.batch_size, 0, max_batches=3)
+    assert partial["batches"] == 3 and not partial["complete"], partial
+    crashed = pg.connect(url)
+    with crashed.cursor() as db_cursor:
+        db_cursor.execute(ARCHIVE_PARTIES, {"cutoff" : cutoff, "batch" : args.batch_size})
+        assert db_cursor.fetchone()[0] > 0
+    crashed.close()                         # Never committed, same as the process dying here
+    assert totals() == {table : count for table, (_, count) in expected.items()}, (totals(), expected)
+
+    # A request holding a past slot's row lock: skipped, not waited on
+    holder = pg.connect(url)
+    with holder.cursor() as db_cursor:
+        db_cursor.execute("SELECT id FROM slots WHERE date <= %s AND NOT EXISTS (SELECT 1 FROM queued_parties WHERE slot_id = slots.id) LIMIT 1 FOR UPDATE", (cutoff,))
+        lockedId = db_cursor.fetchone()[0]
+    run = archive(conn, cutoff, args.batch_size, 0)
+    assert run["complete"] and run["longest_batch_ms"] < 2000, run     # Under LOCK_TIMEOUT, no batch waited on the lock
+    assert scalar("SELECT count(*) FROM slots WHERE date <= %s", cutoff) == 1 and scalar("SELECT count(*) FROM slots WHERE id = %s", lockedId) == 1
+    holder.rollback()
+    holder.close()
+    assert archive(conn, cutoff, args.batch_size, 0)["slots"] == 1
+
+    # Everything past is in the archive, unchanged, and nothing else moved
+    for table, query in (("slots", SLOT_ROWS), ("queued_parties", PARTY_ROWS)):
+        assert scalar(query.format(table=table + "_archive"), cutoff) == expected[table], f"{table}: archive doesn't match what was moved"
+        assert scalar(query.format(table=table), cutoff)[1] == 0, f"{table}: past rows left behind"
+        assert scalar(query.replace("<=", ">").format(table=table), cutoff) == future[table], f"{table}: future rows were touched"
+    again = archive(conn, cutoff, args.batch_size, 0)
+    assert again["queued_parties"] == again["slots"] == 0, again
+
+    # What autovacuum gets to eventually, the freed pages are reused by new rows either way
+    conn.autocommit = True
+    with conn.cursor() as db_cursor:
+        db_cursor.execute("VACUUM ANALYZE slots")
+        db_cursor.execute("VACUUM ANALYZE queued_parties")
+    conn.autocommit = False
+    report["archive"] = {"batch_size" : args.batch_size, "batches" : run["batches"], "rows_per_s" : round((run["slots"] + run["queued_parties"]) / run["seconds"]),
+                         "longest_batch_ms" : round(run["longest_batch_ms"], 1)}
+    report["after"] = {"reads" : reads(), "tables" : sizes()}
+    conn.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+'''Requests per second and tail latency of the Flask app (threaded WSGI server) vs service/asgi.py (uvicorn).
+
+Both servers run as subprocesses against the same freshly seeded database and get the same workload from the
+same asyncio load generator: `--concurrency` connections in flight, a mix of slot listings and bookings.
+Every request opens its own connection so neither server gets a keep-alive advantage.
+
+Usage (from backend/):
+    python -m benchmarks.bench_asgi --requests 3000 --concurrency 64
+Point BENCH_DB_URL (or --db-url) at Postgres for meaningful numbers. SQLite runs too (aiosqlite, from requirements.txt),
+but the async server writes one at a time there, see service/asgi.py.
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time as clock
+from collections import Counter
+from datetime import date, timedelta
+
+from benchmarks._common import BACKEND_DIR, load_app, seed_slots, summarize
+
+SERVERS = {
+    "sync" : "from werkzeug.serving import run_simple\n"
+             "from service import app\n"
+             "run_simple('127.0.0.1', {port}, app, threaded=True)",
+    "async" : "import uvicorn\n"
+              "uvicorn.run('service.asgi:application', host='127.0.0.1', port={port}, log_level='warning')",
+}
+
+
+async def request(port : int, method : str, path : str, body : bytes = b"") -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b" ", 2)[1])
+
+
+async def drive(port : int, workload : list[tuple[str, str, bytes]], concurrency : int) -> dict:
+    statuses : Counter = Counter()
+    latencies : list[float] = []
+    pending = iter(workload)
+
+    async def connection() -> None:
+        for method, path, body in pending:
+            start = clock.perf_counter()
+            try:
+                statuses[await request(port, method, path, body)] += 1
+            except (ConnectionError, IndexError, ValueError):
+                statuses["failed"] += 1
+            latencies.append((clock.perf_counter() - start) * 1000)
+
+    started = clock.perf_counter()
+    await asyncio.gather(*[connection() for _ in range(concurrency)])
+    elapsed = clock.perf_counter() - started
+    return {"requests_per_second" : round(len(workload) / elapsed, 1),
+            "statuses" : {str(status) : count for status, count in statuses.items()},
+            "latency_ms" : summarize(latencies)}
+
+
+async def waitForPort(port : int, timeout : float = 30) -> None:
+    deadline = clock.monotonic() + timeout
+    while clock.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"Server on port {port} didn't come up")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--book-ratio", type=float, default=0.2, help="Share of the workload that is POST /book")
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    days = 3
+    app, db = load_app(args.db_url, LIB_FUTURE_WINDOW_SIZE=str(days))
+    from service import redisManager
+    from service.auxillary_modules.cachekeys import slotsBumpCommands
+
+    rng = random.Random(5)
+    dates = [(date.today() + timedelta(days=day)) for day in range(days)]
+    workload = []
+    for n in range(args.requests):
+        room, slotDate, hour = rng.randint(1, args.rooms), rng.choice(dates), rng.randint(8, 20)
+        if rng.random() < args.book_ratio:
+            workload.append(("POST", f"/book/{room}", json.dumps({"date" : slotDate.strftime("%d%m%y"), "time" : f"{hour:02d}00",
+                                                                  "number" : f"9{n:09d}", "email" : f"user{n}@bench.in",
+                                                                  "name" : "Bench", "passkey" : "1234"}).encode()))
+        elif rng.random() < 0.5:
+            workload.append(("GET", f"/rooms/{room}/slots?date={slotDate.strftime('%d%m%y')}", b""))
+        else:
+            workload.append(("GET", f"/rooms/{room}/slots", b""))
+
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR,
+               LIB_FUTURE_WINDOW_SIZE=str(days))
+    report = {"requests" : args.requests, "concurrency" : args.concurrency}
+    for name, script in SERVERS.items():
+        # Same starting point for both: fresh slots, and cached listings from the previous run moved out of reach
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seed_slots(db, args.rooms, days, booked_ratio=0.3)
+            db.session.remove()
+        redisManager.safe_pipeline([command for room in range(1, args.rooms + 1) for slotDate in dates for command in slotsBumpCommands(room, slotDate)])
+
+        server = subprocess.Popen([sys.executable, "-c", script.format(port=args.port)], cwd=BACKEND_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            asyncio.run(waitForPort(args.port))
+            report[name] = asyncio.run(drive(args.port, workload, args.concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=2))
+    for name in SERVERS:
+        assert "500" not in report[name]["statuses"] and "failed" not in report[name]["statuses"], f"{name} server errored"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+'''GET /rooms/<room_id>/slots (no filters) through availabilityIndex vs the Redis/DB path.
+
+Checked first: both paths return the same rows, and a booking made by another worker (a second app) shows up
+on this one's very next read, through the room's slotver counter.
+
+Usage (from backend/):
+    python -m benchmarks.bench_availability_index --rooms 50 --days 7 --iterations 2000
+Uses BENCH_DB_URL if set, a scratch SQLite file otherwise. Redis is whatever REDIS_HOST points at.
+'''
+import argparse
+import json
+import random
+from datetime import date, datetime, timedelta
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_FUTURE_WINDOW_SIZE=str(args.days), LIB_AVAILABILITY_INDEX="1")
+    from service import routes, availabilityIndex, redisManager
+    from service.auxillary_modules.cachekeys import slotsBumpCommands
+
+    with app.app_context():
+        slot_count = seed_slots(db, args.rooms, args.days)
+    # Whatever an earlier run left in Redis was cached under the current versions, move them all on
+    redisManager.safe_pipeline([command for day in range(args.days) for room in range(1, args.rooms + 1)
+                                for command in slotsBumpCommands(room, date.today() + timedelta(days=day))])
+
+    client = app.test_client()
+    rng = random.Random(7)
+
+    def fetch():
+        response = client.get(f"/rooms/{rng.randint(1, args.rooms)}/slots")
+        assert response.status_code == 200, response.status_code
+
+    # Both paths have to agree before their timings mean anything
+    with app.app_context():
+        availabilityIndex.ensureFresh(date.today(), routes._availabilityRows)
+    indexed = client.get("/rooms/1/slots").get_json()
+    routes.availabilityIndex = None
+    fromDb = client.get("/rooms/1/slots").get_json()
+    key = lambda row: (row["date"], row["time"])
+    assert sorted(indexed, key=key) == sorted(fromDb, key=key), "availabilityIndex disagrees with the database"
+    routes.availabilityIndex = availabilityIndex
+
+    from service import create_app
+    if redisManager.ping():
+        free = next(row for row in indexed if not row["booked"])
+        booking = {"date" : datetime.strptime(free["date"], "%d%m%Y").strftime("%d%m%y"), "time" : free["time"].replace(":", ""),
+                   "name" : "Bench", "number" : "9000000001", "email" : "index@bench.in", "passkey" : "1234"}
+        assert create_app().test_client().post("/book/1", json=booking).status_code == 201
+        seen = next(row for row in client.get("/rooms/1/slots").get_json() if key(row) == key(free))
+        assert seen["booked"] and seen["holder"] == booking["email"], "a booking by another worker isn't on the next read"
+    routes.availabilityIndex = None
+
+    report = {"slots" : slot_count, "rooms" : args.rooms, "days" : args.days}
+
+    report["current_path"] = summarize(measure(fetch, args.iterations))
+    routes.availabilityIndex = availabilityIndex
+    report["availability_index"] = summarize(measure(fetch, args.iterations))
+    report["index_bytes"] = (availabilityIndex._exists.itemsize * len(availabilityIndex._exists) * 2
+                             + len(availabilityIndex._queue))
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
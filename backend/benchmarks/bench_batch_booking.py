@@ -0,0 +1,126 @@
+'''POST /book/batch vs one POST /book per hour, then overlapping batches racing each other.
+
+Part one books k consecutive hours both ways and counts SQL statements and transactions (engine events) per user.
+Part two forks clients that grab the same slots in batches, each client submitting its items in a different order.
+Canonical lock ordering means none of them may deadlock (no 500s), and every batch must be all-or-nothing.
+
+Usage (from backend/):
+    python -m benchmarks.bench_batch_booking --hours 1 2 3 4 --users 50 --clients 8
+Runs anywhere, BENCH_DB_URL (or --db-url) picks the database. On Postgres the row locks decide the race; SQLite has
+none, there the guarded UPDATE is what keeps a batch from booking a slot another one took in the meantime.
+'''
+import argparse
+import json
+import multiprocessing
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import event, select
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--hours", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--users", type=int, default=50, help="Users booking k hours each, per k")
+    parser.add_argument("--clients", type=int, default=8, help="Racing processes in part two")
+    parser.add_argument("--rounds", type=int, default=40, help="Batches per racing client")
+    args = parser.parse_args()
+
+    rooms = 2 * args.users * len(args.hours)
+    app, db = load_app(args.db_url, LIB_MAX_BATCH_SIZE=str(max(args.hours + [3])), LIB_FUTURE_WINDOW_SIZE="3")
+    from service.models import QueuedParty
+
+    with app.app_context():
+        seed_slots(db, rooms, 3, booked_ratio=0)
+        engine = db.engine
+        db.session.remove()
+
+    client = app.test_client()
+    counts = Counter()
+    event.listen(engine, "before_cursor_execute", lambda *_: counts.update(["statements"]))
+    event.listen(engine, "commit", lambda *_: counts.update(["transactions"]))
+    identity = iter(range(10 ** 6))
+
+    def holder() -> dict:
+        n = next(identity)
+        return {"number" : f"9{n:09d}", "email" : f"user{n}@bench.in", "name" : "Bench", "passkey" : "1234"}
+
+    # Part one: k hours for `users` people, every user in their own room so all bookings succeed
+    report = {"round_trips" : {}}
+    bookingDate = (date.today() + timedelta(days=1)).strftime("%d%m%y")
+    people = iter(range(rooms))
+    for k in args.hours:
+        def single():
+            room, who = next(people) + 1, holder()
+            for hour in range(8, 8 + k):
+                assert client.post(f"/book/{room}", json=dict(who, date=bookingDate, time=f"{hour:02d}00")).status_code == 201
+        def batch():
+            room, who = next(people) + 1, holder()
+            items = [{"room" : room, "date" : bookingDate, "time" : f"{hour:02d}00"} for hour in range(8, 8 + k)]
+            assert client.post("/book/batch", json=dict(who, items=items)).status_code == 201
+
+        outcome = {}
+        for name, fn in (("single", single), ("batch", batch)):
+            counts.clear()
+            latencies = measure(fn, args.users)
+            outcome[name] = {"requests_per_user" : k if name == "single" else 1,
+                             "statements_per_user" : round(counts["statements"] / args.users, 2),
+                             "transactions_per_user" : round(counts["transactions"] / args.users, 2),
+                             "latency_ms" : summarize(latencies)}
+            with app.app_context():
+                db.session.remove()
+        report["round_trips"][k] = outcome
+
+    # Part two: everyone wants hours 8-10 of the same few rooms on day 2, in their own order
+    raceDate = (date.today() + timedelta(days=2)).strftime("%d%m%y")
+    contested = [(room, hour) for room in range(1, 4) for hour in range(8, 11)]
+
+    def racer(n : int, barrier, results) -> None:
+        with app.app_context():
+            db.engine.dispose(close=False)      # Connections inherited over fork belong to the parent
+        http = app.test_client()
+        rng = random.Random(n)
+        who = {"number" : f"8{n:09d}", "email" : f"racer{n}@bench.in", "name" : "Bench", "passkey" : "1234"}
+        local = []
+        barrier.wait()
+        for _ in range(args.rounds):
+            picks = rng.sample(contested, 3)        # Random order, the server has to sort it out
+            response = http.post("/book/batch", json=dict(who, items=[{"room" : room, "date" : raceDate, "time" : f"{hour:02d}00"} for room, hour in picks]))
+            local.append((response.status_code, picks))
+        results.put((who["email"], local))
+
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(args.clients)
+    results = context.Queue()
+    workers = [context.Process(target=racer, args=(n, barrier, results)) for n in range(args.clients)]
+    for worker in workers:
+        worker.start()
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    with app.app_context():
+        holders = {(row.room_id, row.slot_time.hour) : row.holder_email
+                   for row in db.session.execute(select(QueuedParty.room_id, QueuedParty.slot_time, QueuedParty.holder_email)
+                                                 .where(QueuedParty.slot_date == date.today() + timedelta(days=2),
+                                                        QueuedParty.queued_index == 1))}
+    statuses = Counter(status for _, local in collected for status, _ in local)
+    for email, local in collected:
+        # What a client holds must be exactly the union of its successful batches, a failed one can't leave anything behind
+        expected = {pick for status, picks in local if status == 201 for pick in picks}
+        held = {slot for slot, holderEmail in holders.items() if holderEmail == email}
+        assert held == expected, f"partial batch for {email}: holds {sorted(held)}, won {sorted(expected)}"
+    assert statuses[500] == 0, "a batch errored (deadlock?)"
+    report["race"] = {"clients" : args.clients, "batches" : sum(statuses.values()), "statuses" : dict(statuses),
+                      "slots_held" : len(holders)}
+
+    print(json.dumps(report, indent=2))
+    print("no deadlocks, every batch all-or-nothing")
+
+
+if __name__ == "__main__":
+    main()
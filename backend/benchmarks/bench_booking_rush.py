@@ -0,0 +1,106 @@
+'''The rush when the window opens: many clients trying to book the same slots at once.
+
+Every client is its own process (like a preforked worker) and walks the same slots in its own random order,
+POSTing /book for each. Afterwards each slot
+must have exactly one winner (one 201, one holder row at position 1), everything else must be a clean 404/409.
+
+Usage (from backend/):
+    python -m benchmarks.bench_booking_rush --clients 32 --slots 100
+Point BENCH_DB_URL (or --db-url) at Postgres for meaningful numbers, SQLite serialises all writers.
+'''
+import argparse
+import json
+import random
+import multiprocessing
+import time as clock
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import select, func
+
+from benchmarks._common import load_app, seed_slots, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--slots", type=int, default=100, help="Slots up for grabs (rooms x hours on day 1)")
+    args = parser.parse_args()
+
+    hours = 13
+    rooms = -(-args.slots // hours)
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0")
+    from service.models import Slot, QueuedParty
+
+    with app.app_context():
+        seed_slots(db, rooms, 2, booked_ratio=0)
+        db.session.remove()
+
+    bookingDate = (date.today() + timedelta(days=1)).strftime("%d%m%y")
+    targets = [(room, hour) for room in range(1, rooms + 1) for hour in range(8, 8 + hours)][:args.slots]
+
+    def client(n : int, barrier, results) -> None:
+        with app.app_context():
+            db.engine.dispose(close=False)      # Connections inherited over fork belong to the parent
+        http = app.test_client()
+        order = targets[:]
+        random.Random(n).shuffle(order)
+        local = []
+        barrier.wait()
+        for room, hour in order:
+            start = clock.perf_counter()
+            response = http.post(f"/book/{room}", json={"date" : bookingDate, "time" : f"{hour:02d}00",
+                                                        "number" : f"9{n:09d}", "email" : f"client{n}@bench.in",
+                                                        "name" : "Bench", "passkey" : "1234"})
+            local.append(((clock.perf_counter() - start) * 1000, response.status_code, room, hour))
+        results.put(local)
+
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(args.clients + 1)
+    results = context.Queue()
+    workers = [context.Process(target=client, args=(n, barrier, results)) for n in range(args.clients)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = clock.perf_counter()
+    collected = [results.get() for _ in workers]
+    elapsed = clock.perf_counter() - started
+    for worker in workers:
+        worker.join()
+
+    statuses : Counter = Counter()
+    winners : Counter = Counter()
+    latencies : list[float] = []
+    for local in collected:
+        for took, status, room, hour in local:
+            latencies.append(took)
+            statuses[status] += 1
+            if status == 201:
+                winners[(room, hour)] += 1
+
+    with app.app_context():
+        holdersPerSlot = db.session.execute(select(QueuedParty.slot_id, func.count())
+                                            .where(QueuedParty.queued_index == 1)
+                                            .group_by(QueuedParty.slot_id)).all()
+        bookedSlots = db.session.execute(select(func.count()).select_from(Slot).where(Slot.booked == True)).scalar_one()
+
+    attempts = sum(statuses.values())
+    report = {"clients" : args.clients,
+              "slots" : len(targets),
+              "attempts" : attempts,
+              "seconds" : round(elapsed, 3),
+              "attempts_per_second" : round(attempts / elapsed, 1),
+              "statuses" : dict(statuses),
+              "latency_ms" : summarize(latencies)}
+    print(json.dumps(report, indent=2))
+
+    assert all(count == 1 for count in winners.values()) and len(winners) == len(targets), "a slot had zero or several 201s"
+    assert len(holdersPerSlot) == len(targets) and all(count == 1 for _, count in holdersPerSlot), "a slot has zero or several holder rows"
+    assert bookedSlots == len(targets), "booked flags don't match the winners"
+    assert statuses[500] == 0, "errors during the rush"
+    print("exactly one winner per slot")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''Database load of repeated /bookings/<identity> polling with and without the read-through cache.
+
+A mix of identities that hold bookings and identities that have none (negative cache) poll repeatedly.
+SQL statements are counted with an engine event. The run ends with a book-then-poll freshness check.
+
+Usage (from backend/):
+    python -m benchmarks.bench_bookings_cache --users 200 --polls 5000
+Needs Redis for the cached run.
+'''
+import argparse
+import json
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--users", type=int, default=200, help="Identities holding a booking")
+    parser.add_argument("--strangers", type=int, default=50, help="Identities polling without any booking")
+    parser.add_argument("--polls", type=int, default=5000)
+    args = parser.parse_args()
+
+    rooms, days = 10, 3
+    app, db = load_app(args.db_url, LIB_FUTURE_WINDOW_SIZE=str(days))
+    from service import routes, cacheManager
+
+    with app.app_context():
+        seed_slots(db, rooms, days, booked_ratio=0)
+        engine = db.engine
+
+    client = app.test_client()
+    slots = [(room, day, hour) for room in range(1, rooms + 1) for day in range(days) for hour in range(8, 21)]
+
+    def book(n : int, room : int, day : int, hour : int) -> None:
+        response = client.post(f"/book/{room}", json={"date" : (date.today() + timedelta(days=day)).strftime("%d%m%y"),
+                                                      "time" : f"{hour:02d}00", "number" : f"9{n:09d}",
+                                                      "email" : f"user{n}@bench.in", "name" : "Bench", "passkey" : "1234"})
+        assert response.status_code == 201, (response.status_code, response.get_data())
+
+    for n in range(args.users):
+        book(n, *slots[n])
+
+    identities = [f"user{n}@bench.in" for n in range(args.users)] + [f"8{n:09d}" for n in range(args.strangers)]
+    rng = random.Random(11)
+    picks = [rng.choice(identities) for _ in range(args.polls)]
+
+    statements = 0
+    def countStatement(*_):
+        nonlocal statements
+        statements += 1
+    event.listen(engine, "before_cursor_execute", countStatement)
+
+    def run() -> dict:
+        nonlocal statements
+        statements = 0
+        it = iter(picks)
+        latencies = measure(lambda: client.get(f"/bookings/{next(it)}"), args.polls)
+        return {"sql_statements" : statements, "statements_per_poll" : round(statements / args.polls, 3), "latency_ms" : summarize(latencies)}
+
+    report = {}
+    routes.cacheManager = None
+    report["uncached"] = run()
+    routes.cacheManager = cacheManager
+    report["cached"] = run()
+    if cacheManager:
+        report["cache"] = cacheManager.getStats()
+
+    # A stranger who has been polling (and is negatively cached) books, the very next poll has to see it
+    stranger = args.users
+    assert client.get(f"/bookings/user{stranger}@bench.in").status_code == 404
+    book(stranger, *slots[stranger])
+    fresh = client.get(f"/bookings/user{stranger}@bench.in")
+    assert fresh.status_code == 200, "negative cache entry survived a booking"
+    assert client.get(f"/bookings/9{stranger:09d}").status_code == 200
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+'''Book-then-read freshness and cache hit ratio for slot listings under a polling/booking mix.
+
+Every booking is followed immediately by reads of the filtered and unfiltered listings for that room,
+any read that still shows the slot as free counts as stale. Between bookings clients poll random listings,
+which is where the hit ratio comes from.
+
+Usage (from backend/):
+    python -m benchmarks.bench_cache_invalidation --rooms 10 --bookings 200 --polls-per-booking 20
+Needs Redis, otherwise nothing is cached and the hit ratio is meaningless.
+'''
+import argparse
+import json
+import random
+from datetime import date, timedelta
+
+from benchmarks._common import load_app, seed_slots
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--bookings", type=int, default=200)
+    parser.add_argument("--polls-per-booking", type=int, default=20)
+    args = parser.parse_args()
+
+    # The availability index would answer the unfiltered reads itself, switch it off so the cache is what gets tested
+    app, db = load_app(args.db_url, LIB_FUTURE_WINDOW_SIZE=str(args.days), LIB_AVAILABILITY_INDEX="0")
+    from service import cacheManager
+
+    with app.app_context():
+        seed_slots(db, args.rooms, args.days, booked_ratio=0)
+
+    client = app.test_client()
+    rng = random.Random(3)
+    free = [(room, day, hour) for room in range(1, args.rooms + 1) for day in range(args.days) for hour in range(8, 21)]
+    rng.shuffle(free)
+
+    def listing(room : int, slotDate : date | None = None, hour : int | None = None) -> list[dict]:
+        params = {}
+        if slotDate:
+            params["date"] = slotDate.strftime("%d%m%y")
+        if hour is not None:
+            params["time"] = f"{hour:02d}00"
+        return client.get(f"/rooms/{room}/slots", query_string=params).get_json()
+
+    def isBooked(rows : list[dict], slotDate : date, hour : int) -> bool:
+        return any(row["booked"] for row in rows if row["date"] == slotDate.strftime("%d%m%Y") and row["time"] == f"{hour:02d}:00")
+
+    stale = 0
+    for n in range(min(args.bookings, len(free))):
+        for _ in range(args.polls_per_booking):
+            pollDay = date.today() + timedelta(days=rng.randrange(args.days))
+            listing(rng.randint(1, args.rooms), *rng.choice([(), (pollDay,), (pollDay, rng.randint(8, 20))]))
+
+        room, day, hour = free[n]
+        slotDate = date.today() + timedelta(days=day)
+        response = client.post(f"/book/{room}", json={"date" : slotDate.strftime("%d%m%y"), "time" : f"{hour:02d}00",
+                                                      "number" : f"9{n:09d}", "email" : f"user{n}@bench.in",
+                                                      "name" : "Bench", "passkey" : "1234"})
+        assert response.status_code == 201, (response.status_code, response.get_data())
+
+        for rows in (listing(room), listing(room, slotDate), listing(room, slotDate, hour)):
+            if not isBooked(rows, slotDate, hour):
+                stale += 1
+
+    report = {"bookings" : min(args.bookings, len(free)), "stale_reads" : stale}
+    if cacheManager:
+        report["cache"] = cacheManager.getStats()
+    print(json.dumps(report, indent=2))
+    assert stale == 0, f"{stale} reads returned stale availability"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+'''CacheManager (L1 + Redis) vs plain Redis GETs for a skewed key distribution.
+
+Usage (from backend/):
+    python -m benchmarks.bench_cache_manager --keys 500 --iterations 20000 --l1-bytes 262144
+Needs a reachable Redis at REDIS_HOST:REDIS_PORT. Keys are written under a `bench:` prefix and removed afterwards.
+'''
+import argparse
+import json
+import os
+import random
+
+import orjson
+
+from benchmarks._common import load_env, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--l1-bytes", type=int, default=256 * 1024, help="L1 budget, small enough to force evictions")
+    parser.add_argument("--l1-ttl", type=float, default=5)
+    args = parser.parse_args()
+
+    load_env()
+    from service.config import CacheManager
+
+    cache = CacheManager(args.l1_bytes, 256, 1024 * 1024, os.environ.get("REDIS_HOST", "localhost"), int(os.environ.get("REDIS_PORT", 6379)),
+                         defaultTTL=args.l1_ttl)
+
+    # A room listing sized payload per key
+    payload = orjson.dumps([{"time" : f"{h:02d}:00", "date" : "01012030", "booked" : False, "qLen" : 0, "holder" : None} for h in range(8, 21)] * 3)
+    keys = [f"bench:{i}" for i in range(args.keys)]
+    for key in keys:
+        cache.safe_execute_command("SETEX", True, key, 300, payload)
+
+    rng = random.Random(1)
+    weights = [1 / (rank + 1) for rank in range(args.keys)]     # Zipf-ish, a few rooms/dates are very hot
+    picks = rng.choices(keys, weights=weights, k=args.iterations)
+
+    it = iter(picks)
+    redisOnly = summarize(measure(lambda: cache.safe_execute_command("GET", True, next(it)), args.iterations))
+    it = iter(picks)
+    tiered = summarize(measure(lambda: cache.get(next(it)), args.iterations))
+
+    for key in keys:
+        cache.safe_execute_command("DEL", True, key)
+
+    print(json.dumps({"payload_bytes" : len(payload),
+                      "redis_only" : redisOnly,
+                      "l1_plus_redis" : tiered,
+                      "stats" : cache.getStats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+'''Enqueue storm on a handful of booked slots: NOWAIT lock conflicts with and without the bounded retry.
+
+Forked clients enqueue themselves onto the same slots in random order. Each run reports status codes, the
+contention counters of every client process summed up, and checks that every queue is still 1..n with
+queue_length matching. Afterwards a few clients try to book slots that are already taken, so the
+alternatives offered with the 404 can be checked.
+
+Usage (from backend/):
+    python -m benchmarks.bench_contention --clients 16 --slots 4 --retries 0 3
+Needs Postgres (BENCH_DB_URL or --db-url), SQLite has no row locks to contend on.
+'''
+import argparse
+import json
+import multiprocessing
+import random
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import select, insert
+
+from benchmarks._common import load_app, bench_url, require_postgres, seed_slots
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--slots", type=int, default=4, help="Booked slots everyone piles onto")
+    parser.add_argument("--retries", type=int, nargs="+", default=[0, 3], help="LIB_LOCK_RETRIES values to compare")
+    args = parser.parse_args()
+
+    require_postgres(bench_url(args.db_url), "SQLite has no row locks to contend on")
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0", LIB_MAX_QUEUE_SIZE=str(args.clients + 2))
+    from service import contentionStats
+    from service.models import Slot, QueuedParty
+
+    bookingDate = date.today() + timedelta(days=1)
+    hours = list(range(8, 8 + args.slots))
+
+    def reset() -> None:
+        '''Fresh slots, the contested ones booked by a holder at position 1'''
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seed_slots(db, 2, 2, booked_ratio=0)
+            for hour in hours:
+                slot = db.session.execute(select(Slot).where(Slot.room == 1, Slot.date == bookingDate, Slot.time_slot == time(hour, 0))).scalar_one()
+                slot.booked, slot.queue_length, slot.holder = True, 1, f"holder{hour}@bench.in"
+                db.session.execute(insert(QueuedParty.__table__).values(holder_name="Bench", holder_phone=f"70000000{hour:02d}",
+                                                                        holder_email=f"holder{hour}@bench.in", time_booked=datetime.now(),
+                                                                        queue_position=1, room_id=1, slot_id=slot.id, slot_time=slot.time_slot,
+                                                                        slot_date=bookingDate, passkey="1234"))
+            db.session.commit()
+            db.session.remove()
+
+    def client(n : int, barrier, results) -> None:
+        with app.app_context():
+            db.engine.dispose(close=False)      # Connections inherited over fork belong to the parent
+        http = app.test_client()
+        order = hours[:]
+        random.Random(n).shuffle(order)
+        statuses = Counter()
+        barrier.wait()
+        for hour in order:
+            response = http.post("/enqueue/1", json={"date" : bookingDate.strftime("%d%m%y"), "time" : f"{hour:02d}00",
+                                                     "number" : f"9{n:09d}", "email" : f"client{n}@bench.in",
+                                                     "name" : "Bench", "passkey" : "1234"})
+            statuses[response.status_code] += 1
+        results.put((dict(statuses), contentionStats.getStats()))
+
+    report = {}
+    for retries in args.retries:
+        reset()
+        app.config["LOCK_RETRIES"] = retries
+        context = multiprocessing.get_context("fork")
+        barrier = context.Barrier(args.clients)
+        results = context.Queue()
+        workers = [context.Process(target=client, args=(n, barrier, results)) for n in range(args.clients)]
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        statuses, stats = Counter(), Counter()
+        for clientStatuses, clientStats in collected:
+            statuses.update(clientStatuses)
+            stats.update(clientStats)
+
+        with app.app_context():
+            for hour in hours:
+                slot = db.session.execute(select(Slot).where(Slot.room == 1, Slot.date == bookingDate, Slot.time_slot == time(hour, 0))).scalar_one()
+                positions = db.session.execute(select(QueuedParty.queued_index).where(QueuedParty.slot_id == slot.id)
+                                               .order_by(QueuedParty.queued_index)).scalars().all()
+                assert positions == list(range(1, slot.queue_length + 1)), f"queue of {hour}:00 is {positions}, queue_length {slot.queue_length}"
+            db.session.remove()
+
+        assert statuses[500] == 0, "lock conflicts still surface as 500s"
+        report[f"retries={retries}"] = {"statuses" : {str(status) : count for status, count in statuses.items()},
+                                        "enqueued" : f"{statuses[201]}/{args.clients * args.slots}",
+                                        "contention" : {key : round(value, 4) for key, value in stats.items()}}
+
+    # Slots taken: losers get a 404 that names free slots nearby
+    client = app.test_client()
+    response = client.post("/book/1", json={"date" : bookingDate.strftime("%d%m%y"), "time" : f"{hours[0]:02d}00",
+                                            "number" : "9999999999", "email" : "late@bench.in", "name" : "Bench", "passkey" : "1234"})
+    body = response.get_json()
+    assert response.status_code == 404 and body["alternatives"], body
+    with app.app_context():
+        for alternative in body["alternatives"]:
+            free = db.session.execute(select(Slot.booked).where(Slot.room == alternative["room"],
+                                                                Slot.date == datetime.strptime(alternative["date"], "%d%m%y").date(),
+                                                                Slot.time_slot == time(int(alternative["time"]) // 100, 0))).scalar_one()
+            assert free is False, f"suggested a booked slot {alternative}"
+    report["alternatives_offered"] = body["alternatives"]
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
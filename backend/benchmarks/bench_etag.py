@@ -0,0 +1,105 @@
+'''Polling GET /rooms/<room_id>/slots with If-None-Match: full 200 listings vs 304s off the room's change version.
+
+For both ways a listing is served (the availability index for the unfiltered window, the version-keyed cache for
+?date=) every poll is timed unconditional and conditional, with the bytes on the wire and the SQL statements run.
+Then the validators are checked: a booking and an enqueue on the polled room must turn the next conditional
+poll into a 200 with a new ETag, polls on other rooms must stay 304, a worker that loaded the same rows from scratch
+must hand out the same index ETag, and with Redis unavailable no ETag goes out for the version-keyed listing.
+
+Usage (from backend/):
+    python -m benchmarks.bench_etag --rooms 20 --days 7 --iterations 2000
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise. Needs Redis at REDIS_HOST.
+'''
+import argparse
+import json
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_FUTURE_WINDOW_SIZE=str(args.days), LIB_AVAILABILITY_INDEX="1")
+    app.config["FUTURE_WINDOW_SIZE"] = args.days
+    app.config["MAX_QLEN"] = 10
+    from service import routes, redisManager, availabilityIndex
+    from service.auxillary_modules.redismanager import NullRedisManager
+    from service.auxillary_modules.availability import AvailabilityIndex
+
+    with app.app_context():
+        seeded = seed_slots(db, args.rooms, args.days, booked_ratio=0)
+        statements = [0]
+        event.listen(db.engine, "before_cursor_execute", lambda *_: statements.__setitem__(0, statements[0] + 1))
+        db.session.remove()
+    assert redisManager.ping(), "Redis is needed for the change versions"
+
+    client = app.test_client()
+    tomorrow = date.today() + timedelta(days=1)
+    listings = {"index_window" : "/rooms/1/slots", "cached_date" : "/rooms/1/slots?date=" + tomorrow.strftime("%d%m%y")}
+
+    report = {"slots" : seeded}
+    for name, path in listings.items():
+        first = client.get(path)
+        etag = first.headers.get("ETag")
+        assert first.status_code == 200 and etag and first.headers.get("Cache-Control") == "no-cache", (name, first.status_code, etag)
+        assert client.get(path, headers={"If-None-Match" : etag}).status_code == 304
+
+        results = {}
+        for variant, headers in (("unconditional", {}), ("conditional", {"If-None-Match" : etag})):
+            sizes, before = [], statements[0]
+            def poll():
+                response = client.get(path, headers=headers)
+                sizes.append(len(response.get_data()))
+            results[variant] = summarize(measure(poll, args.iterations))
+            results[variant]["body_bytes_per_poll"] = sum(sizes) / len(sizes)
+            results[variant]["statements"] = statements[0] - before
+        assert results["conditional"]["body_bytes_per_poll"] == 0 and results["conditional"]["statements"] == 0, results["conditional"]
+        results["speedup_p50"] = round(results["unconditional"]["p50"] / results["conditional"]["p50"], 2)
+        report[name] = results
+
+    # Every write to the room has to change both validators, writes elsewhere can't
+    details = {"date" : tomorrow.strftime("%d%m%y"), "time" : "1000", "name" : "Bench", "passkey" : "1234"}
+    tags = {name : client.get(path).headers["ETag"] for name, path in listings.items()}
+    other = client.get("/rooms/2/slots").headers["ETag"]
+    writes = {"book" : ("/book/1", details | {"number" : "9000000001", "email" : "etag1@bench.in"}),
+              "enqueue" : ("/enqueue/1", details | {"number" : "9000000002", "email" : "etag2@bench.in"})}
+    for write, (url, body) in writes.items():
+        response = client.post(url, json=body)
+        assert response.status_code < 300, (write, response.status_code, response.get_json())
+        for name, path in listings.items():
+            after = client.get(path, headers={"If-None-Match" : tags[name]})
+            assert after.status_code == 200 and after.headers["ETag"] != tags[name], f"{write} left {name} validating"
+            assert after.get_json() == client.get(path).get_json()
+            tags[name] = after.headers["ETag"]
+    assert client.get("/rooms/2/slots", headers={"If-None-Match" : other}).status_code == 304, "a write to room 1 invalidated room 2"
+    report["writes_checked"] = list(writes)
+
+    # The index tag comes from its content: another worker, loading the rows after those writes, agrees with this one
+    # that applied them in place
+    with app.app_context():
+        other = AvailabilityIndex(args.days)
+        other.ensureFresh(date.today(), routes._availabilityRows)
+        db.session.remove()
+    assert other.etag(1) == availabilityIndex.etag(1), "two workers with the same rows disagree on the ETag"
+
+    # No version, no validator: a 0 that writes can't bump would vouch for stale listings. The index tag needs no Redis.
+    availabilityIndex.invalidate()
+    routes.redisManager = NullRedisManager()
+    response = client.get(listings["cached_date"], headers={"If-None-Match" : tags["cached_date"]})
+    assert response.status_code == 200 and "ETag" not in response.headers, response.status_code
+    assert client.get(listings["index_window"], headers={"If-None-Match" : tags["index_window"]}).status_code == 304
+    routes.redisManager = redisManager
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+'''Building the JSON response for a cached listing: parse + stdlib re-encode vs sending the cached bytes as they are.
+
+    hit   before: jsonify(orjson.loads(cached)) through Flask's default (stdlib json) provider
+          after:  rawJSON(cached)
+    miss  before: orjson.dumps for the cache, then jsonify the same list again for the client
+          after:  dumpJSON once, the buffer goes to the cache and into rawJSON
+
+Measured on a week of one room's slots and on a short bookings list, inside a request context, plus a check
+that every variant decodes to the same thing and that a cache hit through the test client returns the cached bytes.
+
+Usage (from backend/):
+    python -m benchmarks.bench_json_response --iterations 20000
+'''
+import argparse
+import json
+from datetime import date, timedelta
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0")
+    from service.auxillary_modules.responses import rawJSON, dumpJSON
+
+    stdlib = DefaultJSONProvider(app)
+    listing = [{"time" : f"{hour:02d}:00", "date" : (date.today() + timedelta(days=day)).strftime("%d%m%Y"), "booked" : hour % 3 == 0,
+                "qLen" : hour % 4, "holder" : f"holder{hour}@bench.in" if hour % 3 == 0 else None}
+               for day in range(7) for hour in range(8, 21)]
+    bookings = [{"holder_name" : "Bench", "holder_email" : "user1@bench.in", "holder_phone" : "9000000001", "room" : room,
+                 "time_booked" : "19-10-2026 10:15", "queue_position" : room, "slot_time" : "1000",
+                 "slot_date" : date.today().strftime("%d%m%Y")} for room in range(1, 4)]
+
+    report = {}
+    with app.test_request_context():
+        for name, payload in (("room_listing", listing), ("bookings", bookings)):
+            cached = orjson.dumps(payload)
+            variants = {"hit_before" : lambda: stdlib.response(orjson.loads(cached)),
+                        "hit_after" : lambda: rawJSON(cached),
+                        "miss_before" : lambda: (orjson.dumps(payload), stdlib.response(payload))[1],
+                        "miss_after" : lambda: rawJSON(dumpJSON(payload))}
+            for variant, build in variants.items():
+                assert json.loads(build().get_data()) == payload, f"{name} {variant} changed the payload"
+
+            results = {variant : summarize(measure(build, args.iterations)) for variant, build in variants.items()}
+            results["bytes"] = len(cached)
+            results["hit_speedup_p50"] = round(results["hit_before"]["p50"] / results["hit_after"]["p50"], 2)
+            results["miss_speedup_p50"] = round(results["miss_before"]["p50"] / results["miss_after"]["p50"], 2)
+            report[name] = results
+
+    # End to end: the second request for a listing is a cache hit and must come back byte for byte as cached
+    with app.app_context():
+        seed_slots(db, 2, 2)
+        db.session.remove()
+    client = app.test_client()
+    first, second = client.get("/rooms/1/slots?date=" + date.today().strftime("%d%m%y")), client.get("/rooms/1/slots?date=" + date.today().strftime("%d%m%y"))
+    assert first.status_code == second.status_code == 200 and first.content_type == second.content_type == "application/json"
+    assert first.get_data() == second.get_data(), "a cache hit was re-encoded differently from the miss that filled it"
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+'''Listing reads: ORM entities + __CustomDict__() per row vs bare column tuples formatted in one pass.
+
+Seeds a full window (rooms x days x opening hours, every booked slot with its holder row, the holders drawn from
+a small pool so each has plenty of bookings) and times three reads both ways, the JSON encode included:
+
+    room_window    one room's unfiltered window, what getRoomDetails runs on a cache miss
+    full_window    every room at once, the widest listing there is
+    bookings       one holder's bookings, what getBookings runs on a cache miss
+
+Both ways have to produce the same JSON.
+
+Usage (from backend/):
+    python -m benchmarks.bench_listing_reads --rooms 100 --days 7 --iterations 50
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise.
+'''
+import argparse
+import json
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, insert
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--holders", type=int, default=20, help="Pool the booked slots' holders are drawn from")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0")
+    app.config["FUTURE_WINDOW_SIZE"] = args.days
+    from service.models import Slot, QueuedParty
+    from service.routes import _SLOT_COLUMNS, _BOOKING_COLUMNS, _slotsQuery, _slotListing, _bookingListing
+    from service.auxillary_modules.responses import dumpJSON
+
+    rng = random.Random(7)
+    with app.app_context():
+        seeded = seed_slots(db, args.rooms, args.days, booked_ratio=0.4)
+        booked = db.session.execute(select(Slot.id, Slot.room, Slot.date, Slot.time_slot).where(Slot.booked == True)).all()
+        db.session.execute(insert(QueuedParty.__table__),
+                           [{"holder_name" : "Bench", "holder_phone" : f"9{holder:09d}", "holder_email" : f"holder{holder}@bench.in",
+                             "time_booked" : datetime.now(), "queue_position" : 1, "room_id" : room, "slot_id" : slotId,
+                             "slot_time" : slotTime, "slot_date" : slotDate, "passkey" : "1234"}
+                            for slotId, room, slotDate, slotTime, holder in ((*row, rng.randrange(args.holders)) for row in booked)])
+        db.session.commit()
+
+        today = date.today()
+        window = (Slot.date >= today) & (Slot.date < today + timedelta(days=args.days))
+        # Before: entities, sorted the same way so the JSON can be compared
+        entityRoom = select(Slot).where(Slot.room == 1, window).order_by(Slot.date, Slot.time_slot)
+        entityFull = select(Slot).where(window).order_by(Slot.room, Slot.date, Slot.time_slot)
+        entityBookings = select(QueuedParty).where(QueuedParty.holder_email == "holder0@bench.in").order_by(QueuedParty.slot_date, QueuedParty.slot_time)
+        # After: the listing queries routes.py runs
+        columnFull = select(*_SLOT_COLUMNS).where(window).order_by(Slot.room, Slot.date, Slot.time_slot)
+        columnBookings = select(*_BOOKING_COLUMNS).where(QueuedParty.holder_email == "holder0@bench.in").order_by(QueuedParty.slot_date, QueuedParty.slot_time)
+
+        def viaEntities(query) -> bytes:
+            payload = dumpJSON([row.__CustomDict__() for row in db.session.execute(query).scalars().all()])
+            db.session.expunge_all()        # A request starts with an empty identity map
+            return payload
+
+        cases = {"room_window" : (lambda: viaEntities(entityRoom),
+                                  lambda: dumpJSON(_slotListing(db.session.execute(_slotsQuery(1, None, None)).all()))),
+                 "full_window" : (lambda: viaEntities(entityFull),
+                                  lambda: dumpJSON(_slotListing(db.session.execute(columnFull).all()))),
+                 "bookings" : (lambda: viaEntities(entityBookings),
+                               lambda: dumpJSON(_bookingListing(db.session.execute(columnBookings).all())))}
+
+        report = {"slots" : seeded, "parties" : len(booked)}
+        for name, (before, after) in cases.items():
+            assert before() == after(), f"{name}: the column path produced different JSON"
+            rows = len(json.loads(after()))
+            entityMs, columnMs = summarize(measure(before, args.iterations)), summarize(measure(after, args.iterations))
+            report[name] = {"rows" : rows,
+                            "entities_ms" : entityMs,
+                            "columns_ms" : columnMs,
+                            "speedup_p50" : round(entityMs["p50"] / columnMs["p50"], 2),
+                            "columns_rows_per_second" : round(rows / (columnMs["p50"] / 1000))}
+        db.session.remove()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''What the request instrumentation costs, and whether /metrics adds up.
+
+Runs the same mix of slot listings and booking lookups with the before/after request hooks in place and with
+them taken out, then checks the scrape: request counts match what was sent, the per-request SQL statement
+histograms saw every request, cache lookups were counted and Server-Timing shows up when LIB_SERVER_TIMING is on.
+
+Usage (from backend/):
+    python -m benchmarks.bench_metrics --iterations 2000 --rooms 20
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise.
+'''
+import argparse
+import json
+import random
+import re
+from datetime import date, timedelta
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=20)
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0")
+    from service import metrics, startRequestTally, finishRequestTally
+
+    with app.app_context():
+        seed_slots(db, args.rooms, 3)
+        db.session.remove()
+
+    client = app.test_client()
+    rng = random.Random(1)
+    paths = [f"/rooms/{rng.randint(1, args.rooms)}/slots" if rng.random() < 0.8 else f"/bookings/user{rng.randint(0, 50)}@bench.in"
+             for _ in range(args.iterations)]
+    cursor = iter(paths * 2)
+    request = lambda: client.get(next(cursor))
+
+    report = {}
+    app.before_request_funcs[None].remove(startRequestTally)
+    app.after_request_funcs[None].remove(finishRequestTally)
+    report["hooks_off"] = summarize(measure(request, args.iterations))
+    app.before_request_funcs[None].append(startRequestTally)
+    app.after_request_funcs[None].append(finishRequestTally)
+    report["hooks_on"] = summarize(measure(request, args.iterations))
+    report["overhead_ms_p50"] = round(report["hooks_on"]["p50"] - report["hooks_off"]["p50"], 4)
+
+    # A booking always reaches the database, the listings above were mostly served from cache by now
+    app.config["SERVER_TIMING"] = True
+    booking = client.post("/book/1", json={"date" : (date.today() + timedelta(days=1)).strftime("%d%m%y"), "time" : "2000",
+                                           "number" : "9000000001", "email" : "timing@bench.in", "name" : "Bench", "passkey" : "1234"})
+    timing = booking.headers.get("Server-Timing", "")
+    match = re.match(r'db;dur=[\d.]+;desc="(\d+) statements", redis;dur=[\d.]+;desc="\d+ calls", total;dur=[\d.]+', timing)
+    assert match and int(match.group(1)) > 0, timing
+    report["server_timing_example"] = {"status" : booking.status_code, "header" : timing}
+
+    scrape = client.get("/metrics")
+    assert scrape.status_code == 200 and scrape.content_type.startswith("text/plain"), scrape.status_code
+    text = scrape.get_data(as_text=True)
+    series = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            series[name] = float(value)
+
+    served = sum(value for name, value in series.items() if name.startswith("library_requests_total{"))
+    assert served == args.iterations + 1, f"{served} requests counted, {args.iterations + 1} sent with hooks on"
+    histogramCount = sum(value for name, value in series.items() if name.startswith("library_request_db_statements_count"))
+    assert histogramCount == served, f"statement histograms saw {histogramCount} of {served} requests"
+    lookups = sum(value for name, value in series.items() if name.startswith("library_cache_lookups_total"))
+    report["cache_lookups_counted"] = lookups
+    report["series"] = len(series)
+    report["selected"] = {name : value for name, value in series.items()
+                          if name.startswith(("library_cache_hit_ratio", "library_db_statements_total", "library_lock_conflicts_total",
+                                              "library_request_db_statements_sum", "library_redis_calls_total"))}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+'''GET /stats/occupancy (occupancy summary + pending deltas) vs computing the same figures from the slots.
+
+Seeds rooms x (past + future) days, backfills the summary, then books, enqueues and cancels at random through the
+endpoints. The summary has to match a full GROUP BY over slots and slots_archive at every step: after the
+backfill, after the writes (their deltas still pending), after archive_expired.py compacted the deltas and moved
+the past out of the hot tables, and after a second backfill. Cancellations have to match the number of cancels.
+Then times an uncached stats request against that scan, with statements per write to show what the deltas cost.
+
+Usage (from backend/):
+    python -m benchmarks.bench_occupancy --rooms 20 --past-days 365 --future-days 7 --writes 600
+Postgres only (the automations use psycopg2), BENCH_DB_URL or --db-url.
+'''
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+import psycopg2 as pg
+from sqlalchemy import event, select, update
+
+from benchmarks._common import BACKEND_DIR, load_app, database_url, require_postgres, seed_slots, measure, summarize
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, "automations"))
+
+# What the summary replaces: every slot there ever was, grouped the same way
+GROUND_TRUTH = """SELECT room, extract(isodow FROM date)::int - 1, extract(hour FROM time_slot)::int,
+                         count(*), sum(booked::int), sum(queue_length), max(queue_length)
+                  FROM (SELECT room, date, time_slot, booked, queue_length FROM slots
+                        UNION ALL
+                        SELECT room, date, time_slot, booked, queue_length FROM slots_archive) AS every_slot
+                  GROUP BY 1, 2, 3"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--past-days", type=int, default=365)
+    parser.add_argument("--future-days", type=int, default=7)
+    parser.add_argument("--writes", type=int, default=600)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    url = args.db_url or database_url()
+    require_postgres(url, "archive_expired.py and backfill_occupancy.py use psycopg2")
+    app, db = load_app(url, LIB_AVAILABILITY_INDEX="0", LIB_FUTURE_WINDOW_SIZE=str(args.future_days), LIB_MAX_QUEUE_SIZE="4")
+    from service import routes, redisManager, cacheManager
+    from service.models import Slot
+    from service.auxillary_modules.cachekeys import occupancyWindow, occupancyKey
+    from archive_expired import archive
+    from backfill_occupancy import backfill
+
+    with app.app_context():
+        seeded = seed_slots(db, args.rooms, args.past_days + args.future_days, booked_ratio=0.3)
+        db.session.execute(update(Slot).values(date=Slot.date - args.past_days))
+        db.session.execute(update(Slot).where(Slot.booked == True, Slot.id % 4 == 0).values(queue_length=Slot.id % 3 + 2))     # Some history of queues
+        db.session.commit()
+        future = db.session.execute(select(Slot.room, Slot.date, Slot.time_slot).where(Slot.date > date.today())).all()
+        statements = [0]
+        event.listen(db.engine, "before_cursor_execute", lambda *_: statements.__setitem__(0, statements[0] + 1))
+        db.session.remove()
+
+    conn = pg.connect(url)
+    def truth() -> dict:
+        with conn.cursor() as db_cursor:
+            db_cursor.execute(GROUND_TRUTH)
+            rows = db_cursor.fetchall()
+        conn.commit()
+        return {tuple(row[:3]) : tuple(int(value) for value in row[3:]) for row in rows}
+    def summary() -> dict:
+        '''(slots, booked, parties, peak_queue) and cancellations, through the query the endpoint runs'''
+        with app.app_context():
+            rows = db.session.execute(routes._occupancyQuery(None)).all()
+            db.session.remove()
+        return ({tuple(row[:3]) : tuple(int(value) for value in row[3:7]) for row in rows if row[3]},
+                sum(int(row[7]) for row in rows))
+    def check(step : str, cancels : int, exactPeak : bool) -> None:
+        counts, cancellations = summary()
+        expected = truth()
+        assert counts.keys() == expected.keys(), f"{step}: buckets differ"
+        for bucket, (slots, booked, parties, peak) in expected.items():
+            got = counts[bucket]
+            assert got[:3] == (slots, booked, parties), f"{step}: {bucket} has {got}, the slots say {(slots, booked, parties, peak)}"
+            assert got[3] == peak if exactPeak else got[3] >= peak, f"{step}: {bucket} peak {got[3]} vs {peak}"
+        assert cancellations == cancels, f"{step}: {cancellations} cancellations counted, {cancels} made"
+
+    report = {"slots" : seeded, "rooms" : args.rooms, "days" : args.past_days + args.future_days}
+    report["backfill"] = {key : round(value, 3) for key, value in backfill(conn).items()}
+    check("backfill", 0, True)
+
+    # Random traffic on the future slots through the endpoints, deltas pile up uncompacted
+    client = app.test_client()
+    rng = random.Random(7)
+    held : list[tuple[int, str]] = []           # (slot_id, identity) of parties that exist
+    cancels = 0
+    perWrite = {"book" : [], "enqueue" : [], "cancel" : []}
+    for n in range(args.writes):
+        room, slotDate, slotTime = rng.choice(future)
+        details = {"date" : slotDate.strftime("%d%m%y"), "time" : slotTime.strftime("%H%M"), "name" : "Bench", "passkey" : "1234",
+                   "email" : f"occ{n}@bench.in", "number" : f"8{n:09d}"}
+        kind = rng.choice(("book", "enqueue", "enqueue", "cancel")) if held else "book"
+        before = statements[0]
+        if kind == "cancel":
+            slotId, identity = held.pop(rng.randrange(len(held)))
+            response = client.delete(f"/cancel/{slotId}", json={"identity" : identity, "passkey" : "1234"})
+            assert response.status_code == 200, response.get_json()
+            cancels += 1
+        else:
+            response = client.post(f"/{kind}/{room}", json=details)
+            if response.status_code == 201:
+                with app.app_context():
+                    slotId = db.session.execute(select(Slot.id).where(Slot.room == room, Slot.date == slotDate, Slot.time_slot == slotTime)).scalar()
+                    db.session.remove()
+                held.append((slotId, details["email"]))
+            else:
+                kind = None             # Taken, not booked yet or full, nothing changed
+        if kind:
+            perWrite[kind].append(statements[0] - before)
+    report["writes"] = {kind : {"count" : len(counts), "statements" : round(sum(counts) / len(counts), 2) if counts else None} for kind, counts in perWrite.items()}
+    check("writes", cancels, False)
+
+    # The endpoint says the same, and answers without scanning anything. Answers are cached per OCCUPANCY_TTL window,
+    # dropping the current window's entry makes the next one a fresh read.
+    def uncached():
+        key = occupancyKey(occupancyWindow(app.config["OCCUPANCY_TTL"]), None)
+        cacheManager.popFromCache(key)
+        redisManager.safe_execute_command("DEL", True, key)
+        return client.get("/stats/occupancy")
+    stats = uncached().get_json()["rooms"]
+    expected = truth()
+    assert sum(room["total"]["slots"] for room in stats.values()) == sum(counts[0] for counts in expected.values())
+    assert sum(room["total"]["cancellations"] for room in stats.values()) == cancels
+    report["stats_uncached"] = summarize(measure(uncached, args.iterations))
+    report["stats_cached"] = summarize(measure(lambda: client.get("/stats/occupancy"), args.iterations))
+    report["ground_truth_scan"] = summarize(measure(truth, max(args.iterations // 5, 3)))
+    report["speedup_p50"] = round(report["ground_truth_scan"]["p50"] / report["stats_uncached"]["p50"], 1)
+
+    # Archival compacts the deltas and moves the past out, figures don't move
+    before = summary()
+    run = archive(conn, date.today() - timedelta(days=1), 5000, 0)
+    assert run["complete"] and run["occupancy_deltas"] > 0, run
+    assert summary() == before, "compaction changed the figures"
+    check("archive", cancels, False)
+    with conn.cursor() as db_cursor:
+        db_cursor.execute("SELECT (SELECT count(*) FROM occupancy_deltas), (SELECT count(*) FROM occupancy)")
+        pending, buckets = db_cursor.fetchone()
+    conn.commit()
+    assert pending == 0
+    report["archive"] = {"deltas_compacted" : run["occupancy_deltas"], "summary_rows" : buckets, "slots_archived" : run["slots"]}
+
+    # Rebuilding from the (now mostly archived) slots gives the same counts, the cancellations carry over
+    report["rebackfill"] = {key : round(value, 3) for key, value in backfill(conn).items()}
+    check("rebackfill", cancels, True)
+    conn.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+'''Queue churn on a few slots under both concurrency modes: NOWAIT row locks vs version compare-and-swap.
+
+Forked clients loop over the same slots in random order. A client with a reservation on the slot cancels it,
+otherwise it enqueues, and books the slot when the enqueue says there is nothing to queue behind. So every kind
+of slot write (book, enqueue, cancel) races every other, and holders keep handing over to whoever is next.
+
+Afterwards each slot has to add up: queue_length equals book + enqueue - cancel successes, positions are exactly
+1..n, the holder is whoever sits at 1 (nobody for an empty queue) and booked matches. A lost update breaks one of these.
+
+Usage (from backend/):
+    python -m benchmarks.bench_optimistic --clients 16 --slots 3 --rounds 30
+Needs Postgres (BENCH_DB_URL or --db-url), SQLite serialises all writers.
+'''
+import argparse
+import json
+import multiprocessing
+import random
+import time as timer
+from collections import Counter
+from datetime import date, time, timedelta
+
+from sqlalchemy import select
+
+from benchmarks._common import load_app, bench_url, require_postgres, seed_slots
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--slots", type=int, default=3, help="Slots everyone churns on")
+    parser.add_argument("--rounds", type=int, default=30, help="Passes over the slots per client")
+    parser.add_argument("--modes", nargs="+", default=["pessimistic", "optimistic"])
+    args = parser.parse_args()
+
+    if "pessimistic" in args.modes:
+        require_postgres(bench_url(args.db_url), "pessimistic mode takes NOWAIT row locks, SQLite has none; --modes optimistic runs anywhere")
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0", LIB_MAX_QUEUE_SIZE=str(args.clients + 2))
+    from service import contentionStats
+    from service.models import Slot, QueuedParty
+
+    bookingDate = date.today() + timedelta(days=1)
+    hours = list(range(8, 8 + args.slots))
+
+    def reset() -> dict[int, int]:
+        '''Fresh, free slots. Returns {hour : slot id}'''
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seed_slots(db, 2, 2, booked_ratio=0)
+            ids = {hour : db.session.execute(select(Slot.id).where(Slot.room == 1, Slot.date == bookingDate,
+                                                                   Slot.time_slot == time(hour, 0))).scalar_one() for hour in hours}
+            db.session.remove()
+        return ids
+
+    def client(n : int, slotIds : dict[int, int], barrier, results) -> None:
+        with app.app_context():
+            db.engine.dispose(close=False)      # Connections inherited over fork belong to the parent
+        http = app.test_client()
+        rng = random.Random(n)
+        who = {"number" : f"9{n:09d}", "email" : f"client{n}@bench.in", "name" : "Bench", "passkey" : "1234"}
+        queued = set()
+        statuses, applied = Counter(), Counter()        # applied: (hour, delta) of every write that went through
+        barrier.wait()
+        for _ in range(args.rounds):
+            order = hours[:]
+            rng.shuffle(order)
+            for hour in order:
+                if hour in queued:
+                    response = http.delete(f"/cancel/{slotIds[hour]}", json={"identity" : who["email"], "passkey" : who["passkey"]})
+                    action, delta = "cancel", -1
+                else:
+                    body = dict(who, date=bookingDate.strftime("%d%m%y"), time=f"{hour:02d}00")
+                    response = http.post("/enqueue/1", json=body)
+                    action, delta = "enqueue", 1
+                    if response.status_code == 409 and (response.get_json() or {}).get("redir"):
+                        response = http.post("/book/1", json=body)
+                        action = "book"
+                statuses[f"{action} {response.status_code}"] += 1
+                if response.status_code in (200, 201):
+                    applied[hour] += delta
+                    queued.symmetric_difference_update({hour})
+        results.put((dict(statuses), dict(applied), contentionStats.getStats()))
+
+    report = {}
+    for mode in args.modes:
+        slotIds = reset()
+        app.config["CONCURRENCY_MODE"] = mode
+        context = multiprocessing.get_context("fork")
+        barrier = context.Barrier(args.clients + 1)
+        results = context.Queue()
+        workers = [context.Process(target=client, args=(n, slotIds, barrier, results)) for n in range(args.clients)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = timer.perf_counter()
+        collected = [results.get() for _ in workers]
+        elapsed = timer.perf_counter() - start
+        for worker in workers:
+            worker.join()
+
+        statuses, applied, stats = Counter(), Counter(), Counter()
+        for clientStatuses, clientApplied, clientStats in collected:
+            statuses.update(clientStatuses)
+            applied.update(clientApplied)
+            stats.update(clientStats)
+
+        with app.app_context():
+            for hour in hours:
+                slot = db.session.get(Slot, slotIds[hour])
+                queue = db.session.execute(select(QueuedParty.queued_index, QueuedParty.holder_email)
+                                           .where(QueuedParty.slot_id == slot.id)
+                                           .order_by(QueuedParty.queued_index)).all()
+                where = f"{mode}, {hour}:00"
+                assert slot.queue_length == applied[hour], f"{where}: queue_length {slot.queue_length} but {applied[hour]} net writes went through"
+                assert [position for position, _ in queue] == list(range(1, slot.queue_length + 1)), f"{where}: positions {[p for p, _ in queue]}"
+                assert slot.holder == (queue[0].holder_email if queue else None), f"{where}: holder {slot.holder}, position 1 is {queue[:1]}"
+                assert slot.booked == bool(queue), f"{where}: booked {slot.booked} with {len(queue)} queued"
+            db.session.remove()
+
+        assert not any(key.endswith(" 500") for key in statuses), f"{mode}: {statuses}"
+        writes = sum(count for key, count in statuses.items() if key.endswith((" 200", " 201")))
+        report[mode] = {"requests" : sum(statuses.values()),
+                        "writes_applied" : writes,
+                        "writes_per_second" : round(writes / elapsed, 1),
+                        "seconds" : round(elapsed, 3),
+                        "statuses" : dict(sorted(statuses.items())),
+                        "contention" : {key : round(value, 4) for key, value in stats.items()}}
+
+    print(json.dumps(report, indent=2))
+    print("no lost updates: queue_length, positions and holder add up in every mode")
+
+
+if __name__ == "__main__":
+    main()
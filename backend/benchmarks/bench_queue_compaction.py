@@ -0,0 +1,104 @@
+'''Queue compaction in cancelBooking: behaviour for front/middle/tail cancellations, then timing on long queues.
+
+The timing compares the set-based UPDATE cancelBooking now issues with the old approach of loading the
+queue through the ORM and decrementing it row by row, both inside a transaction that is rolled back.
+
+Usage (from backend/):
+    python -m benchmarks.bench_queue_compaction --queue-lengths 5 20 100 --iterations 50
+'''
+import argparse
+import json
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import select, update, insert
+
+from benchmarks._common import load_app, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--queue-lengths", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    maxQueue = max(args.queue_lengths + [5])
+    app, db = load_app(args.db_url, LIB_MAX_QUEUE_SIZE=str(maxQueue))
+    from service.models import Slot, QueuedParty
+
+    client = app.test_client()
+    slotDate = date.today() + timedelta(days=1)
+    counter = iter(range(10 ** 9))
+
+    def makeQueue(length : int) -> int:
+        '''A booked slot with `length` parties at positions 1..length, returns the slot id'''
+        hour = next(counter)
+        slotId = db.session.execute(insert(Slot).values(room=1, date=slotDate + timedelta(days=hour // 24), time_slot=time(hour % 24, 0),
+                                                        booked=True, queue_length=length, holder="p1@bench.in")
+                                    .returning(Slot.id)).scalar_one()
+        db.session.execute(insert(QueuedParty), [{"holder_name" : "Bench", "holder_phone" : f"{slotId:05d}{i:05d}",
+                                                  "holder_email" : f"p{i}@bench.in", "time_booked" : datetime.now(),
+                                                  "queued_index" : i, "room_id" : 1, "slot_id" : slotId,
+                                                  "slot_time" : time(hour % 24, 0), "slot_date" : slotDate + timedelta(days=hour // 24),
+                                                  "passkey" : "1234"} for i in range(1, length + 1)])
+        db.session.commit()
+        return slotId
+
+    def queueOf(slotId : int) -> list[tuple[str, int]]:
+        return db.session.execute(select(QueuedParty.holder_email, QueuedParty.queued_index)
+                                  .where(QueuedParty.slot_id == slotId)
+                                  .order_by(QueuedParty.queued_index)).all()
+
+    with app.app_context():
+        # Behaviour: cancel the holder, someone in the middle and the last in line of a 5-party queue, then the lone holder
+        checks = {}
+        for name, position in (("front", 1), ("middle", 3), ("tail", 5)):
+            slotId = makeQueue(5)
+            response = client.delete(f"/cancel/{slotId}", json={"identity" : f"p{position}@bench.in", "passkey" : "1234"})
+            assert response.status_code == 200, (name, response.status_code, response.get_data())
+            remaining = queueOf(slotId)
+            expected = [(f"p{i}@bench.in", rank) for rank, i in enumerate([i for i in range(1, 6) if i != position], start=1)]
+            assert remaining == expected, (name, remaining)
+            slot = db.session.get(Slot, slotId)
+            db.session.refresh(slot)
+            assert (slot.booked, slot.queue_length, slot.holder) == (True, 4, expected[0][0]), (name, slot)
+            checks[name] = "ok"
+
+        slotId = makeQueue(1)
+        assert client.delete(f"/cancel/{slotId}", json={"identity" : "p1@bench.in", "passkey" : "1234"}).status_code == 200
+        slot = db.session.get(Slot, slotId)
+        db.session.refresh(slot)
+        assert (slot.booked, slot.queue_length, slot.holder) == (False, 0, None), slot
+        checks["last_party"] = "ok"
+
+        timings = {}
+        for length in args.queue_lengths:
+            slotId = makeQueue(length)
+            oldWay, newWay = [], []
+            for _ in range(args.iterations):
+                # Old: pull the whole queue into Python, decrement everyone behind the front party, one UPDATE each
+                start = clock.perf_counter()
+                queue = db.session.execute(select(QueuedParty).where(QueuedParty.slot_id == slotId)).scalars().all()
+                queue.sort(key=lambda party: party.queued_index)
+                for party in queue[1:]:
+                    party.queued_index -= 1
+                db.session.flush()
+                oldWay.append((clock.perf_counter() - start) * 1000)
+                db.session.rollback()
+
+                start = clock.perf_counter()
+                db.session.execute(update(QueuedParty)
+                                   .where(QueuedParty.slot_id == slotId, QueuedParty.queued_index > 1)
+                                   .values(queued_index=QueuedParty.queued_index - 1)
+                                   .execution_options(synchronize_session=False))
+                newWay.append((clock.perf_counter() - start) * 1000)
+                db.session.rollback()
+
+            timings[length] = {"row_by_row_ms" : summarize(oldWay), "set_based_ms" : summarize(newWay)}
+
+    print(json.dumps({"behaviour" : checks, "compaction" : timings}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+'''Queue position updates pushed over SSE vs polling /bookings/<identity>.
+
+Fills one slot's queue, opens a /bookings/<identity>/events stream per party (each in its own thread, through the
+test client), then cancels the holder over and over. Every stream has to see its party move up one place per
+cancel, and a null position once the party itself is the one cancelled, matching what the database ends up with.
+Timed from the start of each cancel to the event arriving, once through Redis pub/sub and once with the in-process
+broker. SQL statements run by the stream threads after their snapshot are counted (there should be none), next to
+what a single poll of /bookings/<identity> costs with and without a cache hit.
+
+Usage (from backend/):
+    python -m benchmarks.bench_queue_events --parties 10 --rounds 3
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise.
+'''
+import argparse
+import json
+import threading
+from datetime import date, timedelta
+from time import perf_counter, sleep
+
+from sqlalchemy import event, select
+
+from benchmarks._common import load_app, seed_slots, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--parties", type=int, default=10, help="Queue length of the followed slot, every party streams")
+    parser.add_argument("--rounds", type=int, default=3, help="Fill, stream and drain the queue this many times per broker")
+    parser.add_argument("--polls", type=int, default=500)
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_SSE_HEARTBEAT="0.2", LIB_SSE_MAX_SYNC_STREAMS=str(args.parties))
+    app.config["MAX_QLEN"] = args.parties
+    app.config["SSE_HEARTBEAT"] = 0.2
+    from service import routes, eventBroker, redisManager
+    from service.models import Slot
+    from service.auxillary_modules.events import EventBroker
+    from service.auxillary_modules.cachekeys import bookingsVersionKey
+
+    with app.app_context():
+        seed_slots(db, 1, 2, booked_ratio=0)
+        statements = {"stream" : 0}
+        def count(*_):
+            if threading.current_thread().name.startswith("stream"):
+                statements["stream"] += 1
+        event.listen(db.engine, "before_cursor_execute", count)
+        tomorrow = date.today() + timedelta(days=1)
+        slotId = db.session.execute(select(Slot.id).where(Slot.room == 1, Slot.date == tomorrow, Slot.time_slot == select(Slot.time_slot).where(Slot.room == 1, Slot.date == tomorrow).order_by(Slot.time_slot).limit(1).scalar_subquery())).scalar()
+        slotTime = db.session.get(Slot, slotId).time_slot
+        db.session.remove()
+
+    client = app.test_client()
+    details = {"date" : tomorrow.strftime("%d%m%y"), "time" : slotTime.strftime("%H%M"), "name" : "Bench", "passkey" : "1234"}
+    party = lambda i: (f"party{i}@bench.in", f"9{i:09d}")
+
+    def fill() -> None:
+        for i in range(1, args.parties + 1):
+            email, phone = party(i)
+            response = client.post("/book/1" if i == 1 else "/enqueue/1", json=details | {"email" : email, "number" : phone})
+            assert response.status_code == 201, (i, response.status_code, response.get_json())
+
+    def follow(i : int, received : list, opened : threading.Event) -> None:
+        '''Read one stream until the party's position hits null (cancelled), keeping (position, arrival time)'''
+        response = app.test_client().get(f"/bookings/{party(i)[0]}/events")
+        buffer = b""
+        for chunk in response.response:
+            buffer += chunk
+            while b"\n\n" in buffer:
+                frame, buffer = buffer.split(b"\n\n", 1)
+                lines = dict(line.split(b": ", 1) for line in frame.split(b"\n") if b": " in line and not line.startswith(b":"))
+                if lines.get(b"event") == b"snapshot":
+                    opened.set()
+                elif lines.get(b"event") == b"position":
+                    position = json.loads(lines[b"data"])["queue_index"]
+                    received.append((position, perf_counter()))
+                    if position is None:
+                        response.close()
+                        return
+
+    report = {"parties" : args.parties, "rounds" : args.rounds}
+    for broker, label in ((eventBroker, type(eventBroker).__name__), (EventBroker(app.config["SSE_MAILBOX"]), "EventBroker")):
+        routes.eventBroker = broker
+        latencies = []
+        for _ in range(args.rounds):
+            fill()
+            streams = []
+            for i in range(1, args.parties + 1):
+                received, opened = [], threading.Event()
+                thread = threading.Thread(target=follow, args=(i, received, opened), name=f"stream-{i}", daemon=True)
+                thread.start()
+                assert opened.wait(5), f"stream {i} never sent its snapshot"
+                streams.append((thread, received))
+
+            started = []
+            for c in range(1, args.parties + 1):
+                started.append(perf_counter())
+                response = client.delete(f"/cancel/{slotId}", json={"identity" : party(c)[0], "passkey" : "1234"})
+                assert response.status_code == 200, (c, response.status_code, response.get_json())
+                sleep(0.01)
+
+            for i, (thread, received) in enumerate(streams, start=1):
+                thread.join(5)
+                assert not thread.is_alive(), f"stream {i} never saw its party leave"
+                # Cancel c moves party i (c < i) to i - c, cancel i removes it
+                assert [position for position, _ in received] == [i - c for c in range(1, i)] + [None], (i, received)
+                latencies.extend((arrived - started[c]) * 1000 for c, (_, arrived) in enumerate(received))
+        assert broker.streams == 0, f"{broker.streams} subscriptions outlived their streams"
+        report[label] = {"events" : len(latencies), "delivery_ms" : summarize(latencies)}
+    routes.eventBroker = eventBroker
+    report["statements_after_snapshot"] = statements["stream"] - 2 * args.rounds * args.parties      # One snapshot query each
+    assert report["statements_after_snapshot"] == 0, report["statements_after_snapshot"]
+
+    # What the streams replace: one waiter's poll, served from cache, and right after a change (version bumped, cache miss)
+    fill()
+    email = party(args.parties)[0]
+    report["poll_cached"] = summarize(measure(lambda: client.get(f"/bookings/{email}"), args.polls))
+    bumpAndPoll = lambda: (redisManager.safe_execute_command("INCR", True, bookingsVersionKey(email)), client.get(f"/bookings/{email}"))
+    report["poll_after_change"] = summarize(measure(bumpAndPoll, args.polls))
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+'''RedisManager under a dead Redis (with and without the circuit breaker), and pipelined vs one-by-one commands.
+
+Usage (from backend/):
+    python -m benchmarks.bench_redis_resilience --dead-host 10.255.255.1 --calls 200
+The dead host should blackhole packets (connect timeout) rather than refuse them, that is the expensive case.
+The pipelining half needs a live Redis at REDIS_HOST:REDIS_PORT.
+'''
+import argparse
+import json
+import os
+
+from benchmarks._common import load_env, measure, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dead-host", default="10.255.255.1")
+    parser.add_argument("--dead-port", type=int, default=6379)
+    parser.add_argument("--socket-timeout", type=float, default=0.5)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=500, help="Keys per pipelined batch")
+    args = parser.parse_args()
+
+    load_env()
+    from service.auxillary_modules.redismanager import RedisManager, NullRedisManager
+
+    report = {}
+
+    # A breaker that never opens is the old behaviour: every call pays the socket timeout
+    unprotected = RedisManager(args.dead_host, args.dead_port, socketTimeout=args.socket_timeout, breakerThreshold=10 ** 9)
+    report["dead_no_breaker"] = summarize(measure(lambda: unprotected.safe_execute_command("GET", True, "k"), min(args.calls, 10)))
+
+    protected = RedisManager(args.dead_host, args.dead_port, socketTimeout=args.socket_timeout, breakerThreshold=3, breakerCooldown=60)
+    report["dead_with_breaker"] = summarize(measure(lambda: protected.safe_execute_command("GET", True, "k"), args.calls))
+    report["dead_with_breaker"]["rejected"] = protected.breaker.rejected
+
+    null = NullRedisManager()
+    report["null_manager"] = summarize(measure(lambda: null.safe_execute_command("GET", True, "k"), args.calls))
+
+    live = RedisManager(os.environ.get("REDIS_HOST", "localhost"), int(os.environ.get("REDIS_PORT", 6379)))
+    if live.ping():
+        keys = [f"bench:pipe:{i}" for i in range(args.batch)]
+
+        def oneByOne():
+            for key in keys:
+                live.safe_execute_command("SETEX", True, key, 60, b"x" * 256)
+            for key in keys:
+                live.safe_execute_command("GET", True, key)
+
+        def batched():
+            live.safe_setex_many((key, 60, b"x" * 256) for key in keys)
+            live.safe_mget(*keys)
+
+        report[f"live_{args.batch}_setex_get_one_by_one"] = summarize(measure(oneByOne, 5))
+        report[f"live_{args.batch}_setex_get_batched"] = summarize(measure(batched, 5))
+        live.safe_execute_command("DEL", True, *keys)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+'''Rendering the availability grid: one GET /rooms/<room_id>/slots per room vs a single GET /rooms/availability.
+
+Both are timed cold (versions bumped before every round, so every listing is a cache miss and hits the database)
+and warm (served from cache), with bytes on the wire and SQL statements per round. The grid has to agree with
+the per-room listings: same hours per room and day, same booked ones, and "full" exactly where qLen reached MAX_QLEN.
+
+Usage (from backend/):
+    python -m benchmarks.bench_room_grid --rooms 100 --days 7 --rounds 30
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise.
+'''
+import argparse
+import json
+from datetime import datetime
+from time import perf_counter
+
+from sqlalchemy import event, update
+
+from benchmarks._common import load_app, seed_slots, summarize
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--rounds", type=int, default=30)
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0")
+    app.config["FUTURE_WINDOW_SIZE"] = args.days
+    from service import redisManager
+    from service.models import Slot
+    from service.auxillary_modules.cachekeys import SLOTS_GENERATION_KEY, slotsVersionKey
+
+    with app.app_context():
+        seeded = seed_slots(db, args.rooms, args.days, booked_ratio=0.4)
+        db.session.execute(update(Slot).where(Slot.booked == True, Slot.id % 3 == 0).values(queue_length=app.config["MAX_QLEN"]))
+        db.session.commit()
+        statements = [0]
+        event.listen(db.engine, "before_cursor_execute", lambda *_: statements.__setitem__(0, statements[0] + 1))
+        db.session.remove()
+
+    client = app.test_client()
+    perRoom = lambda: [client.get(f"/rooms/{room}/slots") for room in range(1, args.rooms + 1)]
+    grid = lambda: [client.get("/rooms/availability")]
+    invalidate = {"per_room" : lambda: redisManager.safe_pipeline([("INCR", slotsVersionKey(room)) for room in range(1, args.rooms + 1)]),
+                  "grid" : lambda: redisManager.safe_execute_command("INCR", True, SLOTS_GENERATION_KEY)}
+
+    # Same picture both ways, past cache entries from an earlier seed out of the way first
+    for bump in invalidate.values():
+        bump()
+    listings = {room : response.get_json() for room, response in enumerate(perRoom(), start=1)}
+    answer = grid()[0]
+    assert answer.status_code == 200, answer.status_code
+    rooms = answer.get_json()["rooms"]
+    for room, listing in listings.items():
+        days = {}
+        for slot in listing:
+            day = days.setdefault(datetime.strptime(slot["date"], "%d%m%Y").strftime("%d%m%y"), {"hours" : [], "booked" : [], "full" : []})
+            hour = int(slot["time"][:2])
+            day["hours"].append(hour)
+            if slot["booked"]:
+                day["booked"].append(hour)
+            if slot["qLen"] >= app.config["MAX_QLEN"]:
+                day["full"].append(hour)
+        assert rooms[str(room)] == days, f"room {room} differs between the grid and its listing"
+
+    report = {"slots" : seeded, "rooms" : args.rooms, "days" : args.days}
+    for name, fetch in (("per_room", perRoom), ("grid", grid)):
+        results = {}
+        for state in ("cold", "warm"):
+            samples, before, size = [], statements[0], 0
+            for _ in range(args.rounds):
+                if state == "cold":
+                    invalidate[name]()
+                start = perf_counter()
+                responses = fetch()
+                samples.append((perf_counter() - start) * 1000)
+                size = sum(len(response.get_data()) for response in responses)
+            results[state] = summarize(samples)
+            results[state]["statements_per_round"] = (statements[0] - before) / args.rounds
+        results["requests_per_round"] = len(fetch())
+        results["bytes_per_round"] = size
+        report[name] = results
+
+    for state in ("cold", "warm"):
+        report[f"{state}_speedup_p50"] = round(report["per_room"][state]["p50"] / report["grid"][state]["p50"], 2)
+    report["bytes_ratio"] = round(report["per_room"]["bytes_per_round"] / report["grid"]["bytes_per_round"], 2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
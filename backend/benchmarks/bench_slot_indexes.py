@@ -0,0 +1,159 @@
+'''Plan and latency of the slot lookup paths before and after the 7c3e5a1f9d42 indexes.
+
+Seeds a scratch schema (never touches the real tables) with a year of slots for every room,
+runs the queries routes.py actually issues, adds the indexes and runs them again.
+
+Usage (from backend/):
+    python -m benchmarks.bench_slot_indexes --rooms 50 --days 365 --iterations 500
+Postgres only, EXPLAIN output is meaningless anywhere else.
+'''
+import argparse
+import json
+import random
+from datetime import date, time, timedelta
+
+from sqlalchemy import create_engine, text
+
+from benchmarks._common import database_url, measure, summarize
+
+SCHEMA = "bench_slot_indexes"
+
+DDL = [
+    f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+    f"CREATE SCHEMA {SCHEMA}",
+    f"""CREATE TABLE {SCHEMA}.slots (
+        id SERIAL PRIMARY KEY,
+        time_slot TIME NOT NULL,
+        date DATE NOT NULL,
+        room SMALLINT NOT NULL,
+        booked BOOLEAN NOT NULL,
+        queue_length SMALLINT NOT NULL,
+        holder VARCHAR(64))""",
+    f"""CREATE TABLE {SCHEMA}.queued_parties (
+        id SERIAL PRIMARY KEY,
+        holder_name VARCHAR(64) NOT NULL,
+        holder_phone VARCHAR(10) NOT NULL,
+        holder_email VARCHAR(64) NOT NULL,
+        time_booked TIMESTAMP NOT NULL,
+        queue_position SMALLINT NOT NULL,
+        room_id SMALLINT NOT NULL,
+        slot_id INTEGER NOT NULL REFERENCES {SCHEMA}.slots(id),
+        slot_time TIME NOT NULL,
+        slot_date DATE NOT NULL,
+        passkey VARCHAR(4) NOT NULL)""",
+    # Same pre-existing indexes as production (11bca5c3b79b)
+    f"CREATE INDEX ON {SCHEMA}.queued_parties (holder_email)",
+    f"CREATE INDEX ON {SCHEMA}.queued_parties (holder_phone)",
+]
+
+INDEXES = [
+    f"CREATE UNIQUE INDEX uq_slots_room_date_time_slot ON {SCHEMA}.slots (room, date, time_slot)",
+    f"CREATE INDEX ix_queued_parties_slot_id_queue_position ON {SCHEMA}.queued_parties (slot_id, queue_position)",
+    f"CREATE INDEX ix_queued_parties_slot_date_slot_time_room_id ON {SCHEMA}.queued_parties (slot_date, slot_time, room_id)",
+]
+
+# The statements routes.py emits, reduced to their WHERE clauses
+QUERIES = {
+    "getRoomDetails (room, date, time)" : f"SELECT * FROM {SCHEMA}.slots WHERE room = :room AND date = :date AND time_slot = :time",
+    "getRoomDetails (room, window)" : f"SELECT * FROM {SCHEMA}.slots WHERE room = :room AND date >= :date AND date < :date + 3",
+    "bookRoom FOR UPDATE NOWAIT" : f"SELECT * FROM {SCHEMA}.slots WHERE room = :room AND booked = false AND date = :date AND time_slot = :time FOR UPDATE NOWAIT",
+    "bookRoom holder conflict" : f"SELECT * FROM {SCHEMA}.queued_parties WHERE slot_time = :time AND slot_date = :date AND room_id = :room AND queue_position = 0",
+    "cancelBooking queue scan" : f"SELECT * FROM {SCHEMA}.queued_parties WHERE slot_id = :slot_id AND queue_position > 0",
+}
+
+
+def seed(conn, rooms : int, days : int, open_hour : int, close_hour : int) -> None:
+    start = date.today() - timedelta(days=days - 7)
+    conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.slots (room, date, time_slot, booked, queue_length, holder)
+        SELECT r, d::date, make_time(h, 0, 0), random() < 0.3, 0, NULL
+        FROM generate_series(1, :rooms) r,
+             generate_series(CAST(:start AS date), CAST(:start AS date) + :days - 1, interval '1 day') d,
+             generate_series(:open_hour, :close_hour) h
+    """), {"rooms" : rooms, "start" : start, "days" : days, "open_hour" : open_hour, "close_hour" : close_hour})
+
+    # Every booked slot gets a holder plus a short queue behind it
+    conn.execute(text(f"""
+        INSERT INTO {SCHEMA}.queued_parties (holder_name, holder_phone, holder_email, time_booked, queue_position,
+                                            room_id, slot_id, slot_time, slot_date, passkey)
+        SELECT 'bench', lpad((s.id % 10000000000)::text, 10, '0'), 'u' || s.id || '_' || q || '@bench.in', now(), q,
+               s.room, s.id, s.time_slot, s.date, '1234'
+        FROM {SCHEMA}.slots s, generate_series(0, 2) q
+        WHERE s.booked
+    """))
+    conn.execute(text(f"UPDATE {SCHEMA}.slots SET queue_length = 3, holder = 'holder@bench.in' WHERE booked"))
+    conn.execute(text(f"ANALYZE {SCHEMA}.slots"))
+    conn.execute(text(f"ANALYZE {SCHEMA}.queued_parties"))
+
+
+def run_queries(engine, rooms : int, iterations : int, open_hour : int, close_hour : int, max_slot_id : int) -> dict:
+    rng = random.Random(42)
+    today = date.today()
+    results = {}
+
+    def params() -> dict:
+        return {"room" : rng.randint(1, rooms),
+                "date" : today + timedelta(days=rng.randint(0, 2)),
+                "time" : time(rng.randint(open_hour, close_hour), 0),
+                "slot_id" : rng.randint(1, max_slot_id)}
+
+    for name, query in QUERIES.items():
+        statement = text(query)
+        with engine.connect() as conn:
+            plan = conn.execute(text("EXPLAIN ANALYZE " + query), params()).scalars().all()
+            conn.rollback()
+
+            def once():
+                conn.execute(statement, params()).all()
+                conn.rollback()         # Releases the FOR UPDATE lock, same as the route's commit would
+
+            results[name] = {"plan" : plan[0].strip(), "latency_ms" : summarize(measure(once, iterations))}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None, help="Defaults to BENCH_DB_URL, then the app's DB_* variables")
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--open-hour", type=int, default=8)
+    parser.add_argument("--close-hour", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--keep", action="store_true", help="Leave the scratch schema behind for poking around")
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url or database_url())
+    with engine.begin() as conn:
+        for statement in DDL:
+            conn.execute(text(statement))
+        seed(conn, args.rooms, args.days, args.open_hour, args.close_hour)
+        slot_count = conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.slots")).scalar_one()
+        party_count = conn.execute(text(f"SELECT count(*) FROM {SCHEMA}.queued_parties")).scalar_one()
+
+    report = {"slots" : slot_count, "queued_parties" : party_count}
+    report["before"] = run_queries(engine, args.rooms, args.iterations, args.open_hour, args.close_hour, slot_count)
+
+    with engine.begin() as conn:
+        for statement in INDEXES:
+            conn.execute(text(statement))
+        conn.execute(text(f"ANALYZE {SCHEMA}.slots"))
+        conn.execute(text(f"ANALYZE {SCHEMA}.queued_parties"))
+
+    report["after"] = run_queries(engine, args.rooms, args.iterations, args.open_hour, args.close_hour, slot_count)
+
+    if not args.keep:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+    print(f"{slot_count} slots, {party_count} queued parties, {args.iterations} iterations per query\n")
+    for name in QUERIES:
+        before, after = report["before"][name], report["after"][name]
+        print(name)
+        print(f"  before: p50 {before['latency_ms']['p50']:>8} ms  p99 {before['latency_ms']['p99']:>8} ms  | {before['plan']}")
+        print(f"  after : p50 {after['latency_ms']['p50']:>8} ms  p99 {after['latency_ms']['p99']:>8} ms  | {after['plan']}")
+    print()
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
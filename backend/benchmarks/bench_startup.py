@@ -0,0 +1,166 @@
+'''How long a worker takes from exec to its first response, and how much of a preforked worker stays shared with the master.
+
+Every measurement runs in a fresh interpreter:
+    import      `import service` on its own, then `from service import app` (create_app with the .env config),
+                with the sockets open at that point and whether alembic got imported
+    cold        one worker started the unpreloaded way: exec, import, build the app, serve GET /rooms/1/slots
+    preforked   a master builds the app once (gunicorn --preload) and forks --workers workers, each serves the
+                same request, then reports how much of its memory is still shared with the master
+A master that holds sockets when it forks hands the same connections to every worker, so with the factory nothing
+may be connected until the first request; that gets checked too.
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup --runs 5 --workers 4
+    python -m benchmarks.bench_startup --backend-dir /tmp/old --service-path     # the same against another checkout
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise. Linux only (reads /proc).
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time as clock
+
+from benchmarks._common import BACKEND_DIR, load_app, seed_slots
+
+# Shared by every child: sockets among the open fds, and memory from smaps_rollup, in kB
+PROBES = """
+import os
+def sockets():
+    count = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            count += os.readlink(f"/proc/self/fd/{fd}").startswith("socket:")
+        except OSError:
+            pass
+    return count
+def memory():
+    fields = {}
+    with open("/proc/self/smaps_rollup") as rollup:
+        for line in rollup:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {"rss" : fields["Rss"], "pss" : fields["Pss"], "private" : fields["Private_Clean"] + fields["Private_Dirty"]}
+"""
+
+CHILDREN = {
+    "import" : PROBES + """
+import json, sys, time
+started = time.perf_counter()
+import service
+imported = time.perf_counter()
+built = "app" in vars(service) or vars(service).get("_default") is not None     # Did the import alone build the app?
+from service import app
+ready = time.perf_counter()
+print(json.dumps({"import_ms" : (imported - started) * 1000, "create_app_ms" : (ready - imported) * 1000, "app_built_on_import" : built,
+                  "sockets" : sockets(), "alembic" : "alembic" in sys.modules, "modules" : len(sys.modules)}))
+""",
+    "cold" : PROBES + """
+import json, time
+started = time.perf_counter()
+from service import app
+ready = time.perf_counter()
+status = app.test_client().get("/rooms/1/slots").status_code
+print(json.dumps({"app_ms" : (ready - started) * 1000, "first_request_ms" : (time.perf_counter() - ready) * 1000,
+                  "status" : status, **memory()}))
+""",
+    "preforked" : PROBES + """
+import json, time
+from service import app
+master = {"sockets" : sockets(), **memory()}
+pipes = []
+for _ in range({workers}):
+    readEnd, writeEnd = os.pipe()
+    forked = time.perf_counter()
+    if os.fork() == 0:
+        os.close(readEnd)
+        status = app.test_client().get("/rooms/1/slots").status_code
+        result = {"first_request_ms" : (time.perf_counter() - forked) * 1000, "status" : status, **memory()}
+        os.write(writeEnd, json.dumps(result).encode())
+        os._exit(0)
+    os.close(writeEnd)
+    pipes.append(readEnd)
+workers = []
+for readEnd in pipes:
+    chunks = []
+    while chunk := os.read(readEnd, 65536):
+        chunks.append(chunk)
+    workers.append(json.loads(b"".join(chunks)))
+    os.wait()
+print(json.dumps({"master" : master, "workers" : workers}))
+""",
+}
+
+
+def run_child(mode : str, backend_dir : str, env : dict, workers : int = 0) -> tuple[dict, float]:
+    '''Output of one child and its wall time in ms, interpreter startup included'''
+    start = clock.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILDREN[mode].replace("{workers}", str(workers))], cwd=backend_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1]), (clock.perf_counter() - start) * 1000
+
+
+def median(results : list[dict], key : str) -> float:
+    return round(statistics.median(result[key] for result in results), 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement, medians are reported")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--backend-dir", default=BACKEND_DIR, help="Checkout whose service is measured (default: this one)")
+    parser.add_argument("--service-path", action="store_true", help="Put service/ on PYTHONPATH too, checkouts from before create_app need it")
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0")
+    with app.app_context():
+        seeded = seed_slots(db, 5, 7)
+        db.session.remove()
+
+    backend = os.path.abspath(args.backend_dir)
+    paths = [os.path.join(backend, "service"), backend] if args.service_path else [backend]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(paths))
+    own = backend == BACKEND_DIR
+
+    report = {"backend_dir" : backend, "slots" : seeded, "runs" : args.runs}
+
+    imports = [run_child("import", backend, env) for _ in range(args.runs)]
+    results = [result for result, _ in imports]
+    report["import"] = {"process_ms" : round(statistics.median(wall for _, wall in imports), 1),
+                        "import_ms" : median(results, "import_ms"), "create_app_ms" : median(results, "create_app_ms"),
+                        "app_built_on_import" : results[0]["app_built_on_import"], "sockets_after_create_app" : max(result["sockets"] for result in results),
+                        "alembic_imported" : results[0]["alembic"], "modules" : results[0]["modules"]}
+
+    colds = [run_child("cold", backend, env) for _ in range(args.runs)]
+    results = [result for result, _ in colds]
+    assert all(result["status"] == 200 for result in results), results
+    report["cold"] = {"to_first_response_ms" : round(statistics.median(wall for _, wall in colds), 1),
+                      "app_ms" : median(results, "app_ms"), "first_request_ms" : median(results, "first_request_ms"),
+                      "rss_kb" : median(results, "rss"), "private_kb" : median(results, "private")}
+
+    preforked, _ = run_child("preforked", backend, env, args.workers)
+    workers = preforked["workers"]
+    assert all(worker["status"] == 200 for worker in workers), workers
+    report["preforked"] = {"workers" : args.workers, "master_sockets_at_fork" : preforked["master"]["sockets"],
+                           "master_rss_kb" : preforked["master"]["rss"],
+                           "fork_to_first_response_ms" : median(workers, "first_request_ms"),
+                           "worker_rss_kb" : median(workers, "rss"), "worker_private_kb" : median(workers, "private"),
+                           "worker_pss_kb" : median(workers, "pss")}
+    # What N workers cost: N cold processes vs a master plus N forks (private pages only, the rest is the master's)
+    report["memory_for_workers_kb"] = {"cold" : report["cold"]["private_kb"] * args.workers,
+                                       "preforked" : preforked["master"]["rss"] + sum(worker["private"] for worker in workers)}
+
+    if own:
+        assert not report["import"]["app_built_on_import"], "importing service built the app"
+        assert not report["import"]["alembic_imported"], "alembic imported outside the flask command"
+        assert report["import"]["sockets_after_create_app"] == 0, "create_app connected to something"
+        assert report["preforked"]["master_sockets_at_fork"] == 0, "the master would hand its connections to the workers"
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
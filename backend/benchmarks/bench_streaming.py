@@ -0,0 +1,135 @@
+'''Peak memory of one huge listing: built whole (the cached path), streamed (?stream=1) and walked in keyset pages (?limit=).
+
+Seeds one room with a long run of days and one identity with a lot of bookings, checks that all three ways return
+the same rows for both getRoomDetails and getBookings, then has fresh child processes fetch the room's unfiltered
+listing over windows of growing size. Each child resets its RSS high water mark (/proc/self/clear_refs) right
+before the request and reports how far above its resting RSS it went, so the import and warmup don't count.
+
+Usage (from backend/):
+    python -m benchmarks.bench_streaming --days 6000 --windows 500 1500 3000 6000
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise. Linux only (reads /proc).
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import date, datetime
+from time import perf_counter
+
+from sqlalchemy import insert, select
+
+from benchmarks._common import load_app, load_env, seed_slots
+
+MODES = ("full", "stream", "pages")
+
+
+def rss_kb(field : str) -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def fetch(client, path : str, mode : str) -> tuple[int, int]:
+    '''(rows, bytes) of the listing at `path`, read the way a client of that mode would'''
+    if mode == "pages":
+        rows = size = 0
+        url = path + ("&" if "?" in path else "?") + "limit=500"
+        while url:
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            body = response.get_data()
+            rows, size = rows + len(json.loads(body)), size + len(body)
+            link = response.headers.get("Link")
+            url = link[1:link.index(">")] if link else None
+        return rows, size
+    response = client.get(path + (("&" if "?" in path else "?") + "stream=1" if mode == "stream" else ""))
+    assert response.status_code == 200, response.status_code
+    size = rows = 0
+    for chunk in response.response:         # As the server hands it over, nothing kept around
+        size += len(chunk)
+        rows += chunk.count(b"}")           # Slots are flat objects, one brace per row wherever the chunks split
+    return rows, size
+
+
+def child(mode : str, window : int) -> None:
+    load_env()
+    os.environ["LIB_AVAILABILITY_INDEX"] = "0"
+    from service import app, redisManager
+    from service.auxillary_modules.cachekeys import slotsVersionKey
+    app.config["FUTURE_WINDOW_SIZE"] = window
+
+    client = app.test_client()
+    fetch(client, "/rooms/1/slots?date=" + date.today().strftime("%d%m%y"), mode)     # Warm up on one day: imports, pools, first queries
+    redisManager.safe_execute_command("INCR", True, slotsVersionKey(1))     # The full path must not find it cached
+
+    resting = rss_kb("VmRSS")
+    with open("/proc/self/clear_refs", "w") as refs:
+        refs.write("5")                                     # Resets VmHWM to the current RSS
+    start = perf_counter()
+    rows, size = fetch(client, "/rooms/1/slots", mode)
+    print(json.dumps({"rows" : rows, "bytes" : size, "ms" : round((perf_counter() - start) * 1000, 1),
+                      "peak_over_resting_kb" : rss_kb("VmHWM") - resting}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--days", type=int, default=6000, help="Days of slots seeded for room 1")
+    parser.add_argument("--windows", type=int, nargs="+", default=[500, 1500, 3000, 6000])
+    parser.add_argument("--bookings", type=int, default=1200, help="Bookings of the identity whose listing is checked")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "WINDOW"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child[0], int(args.child[1]))
+
+    app, db = load_app(args.db_url, LIB_AVAILABILITY_INDEX="0")
+    from service.models import Slot, QueuedParty
+
+    with app.app_context():
+        seeded = seed_slots(db, 1, args.days, booked_ratio=0)
+        slots = db.session.execute(select(Slot.id, Slot.room, Slot.date, Slot.time_slot).where(Slot.room == 1)
+                                   .order_by(Slot.date, Slot.time_slot).limit(args.bookings)).all()
+        db.session.execute(insert(QueuedParty.__table__),
+                           [{"holder_name" : "Bench", "holder_phone" : "9000000001", "holder_email" : "many@bench.in", "time_booked" : datetime.now(),
+                             "queue_position" : 2, "room_id" : room, "slot_id" : slotId, "slot_time" : slotTime, "slot_date" : slotDate, "passkey" : "1234"}
+                            for slotId, room, slotDate, slotTime in slots])
+        db.session.commit()
+        db.session.remove()
+
+    # Same rows every way, for both listings, past cache entries from an earlier seed out of the way first
+    from service import redisManager
+    from service.auxillary_modules.cachekeys import slotsVersionKey, bookingsVersionKey
+    redisManager.safe_pipeline([("INCR", slotsVersionKey(1)), ("INCR", bookingsVersionKey("many@bench.in"))])
+    app.config["FUTURE_WINDOW_SIZE"] = min(args.windows)
+    client = app.test_client()
+    for path in ("/rooms/1/slots", "/bookings/many@bench.in"):
+        whole = client.get(path).get_json()
+        streamed = json.loads(client.get(path + "?stream=1").get_data())
+        paged, url = [], path + "?limit=97"         # Deliberately not a divisor, the last page comes up short
+        while url:
+            response = client.get(url)
+            paged.extend(response.get_json())
+            link = response.headers.get("Link")
+            url = link[1:link.index(">")] if link else None
+        assert whole == streamed == paged, f"{path}: the three ways disagree"
+    assert len(paged) == args.bookings
+
+    report = {"slots" : seeded, "bookings_checked" : args.bookings, "windows" : {}}
+    env = dict(os.environ, DB_URL=os.environ["DB_URL"])
+    for window in args.windows:
+        results = {}
+        for mode in MODES:
+            output = subprocess.run([sys.executable, "-m", "benchmarks.bench_streaming", "--child", mode, str(window)],
+                                    capture_output=True, text=True, env=env, check=True).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+        assert len({result["rows"] for result in results.values()}) == 1, results
+        report["windows"][window] = results
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
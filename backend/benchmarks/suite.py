@@ -0,0 +1,264 @@
+'''Reproducible load suite: seeds a world and runs the booking-rush scenarios against the app with concurrent clients.
+
+The world is rooms x days x opening hours, a share of the slots already booked by a population of users (with
+their holder rows, so lookups and cancellations find something). Every scenario starts from a freshly seeded
+world, and every client is its own forked process with its own seeded RNG:
+
+    availability   GET /rooms/<id>/slots, hot rooms polled far more than the rest, sometimes filtered by date
+    burst          the newest day opens, everyone POSTs /book on the same popular slots at once
+    churn          POST /enqueue onto booked slots, DELETE /cancel of earlier enqueues
+    lookups        GET /bookings/<identity> for users holding slots, plus some who have never booked
+
+Results are JSON: per scenario, per endpoint throughput, status codes and p50/p95/p99 latency, with the commit,
+database and settings alongside. Keep the file from one commit and pass it to --compare on the next.
+
+Usage (from backend/):
+    python -m benchmarks.suite --rooms 20 --days 4 --users 500 --clients 8 --ops 200 --output bench.json
+    python -m benchmarks.suite --scenarios burst churn --compare bench.json
+BENCH_DB_URL (or --db-url) picks the database, a throwaway SQLite file otherwise. SQLite serialises all writers,
+so burst and churn only say something on Postgres: on SQLite they're skipped unless named in --scenarios.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time as clock
+from collections import Counter, defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Callable
+
+from sqlalchemy import insert
+
+from benchmarks._common import BACKEND_DIR, load_app, summarize
+
+SCENARIOS = ("availability", "burst", "churn", "lookups")
+POSTGRES_SCENARIOS = ("burst", "churn")        # Write contention, what SQLite reports there is its global write lock
+
+
+def identity(user : int) -> dict:
+    return {"number" : f"8{user:09d}", "email" : f"user{user}@bench.in", "name" : "Bench", "passkey" : "1234"}
+
+
+def seed_world(app, db, rooms : int, days : int, users : int, booked_ratio : float, seed : int) -> dict[tuple, tuple[int, int]]:
+    '''Fresh tables holding rooms x days x opening hours from today. Booked slots get a holder drawn from `users`
+    and the matching party row at position 1. The newest day is left free for the burst.
+    Returns {(room, date, hour) : (slot id, holding user)} of the booked slots.'''
+    from service import redisManager
+    from service.models import Slot, QueuedParty
+    from service.auxillary_modules.cachekeys import slotsBumpCommands, bookingsBumpCommands
+
+    rng = random.Random(seed)
+    today = date.today()
+    hours = range(app.config["OPENING_TIME"] // 100, app.config["CLOSING_TIME"] // 100 + 1)
+    slots, holders = [], []
+    for day in range(days):
+        for room in range(1, rooms + 1):
+            for hour in hours:
+                booked = day < days - 1 and rng.random() < booked_ratio
+                holder = rng.randrange(users) if booked else None
+                holders.append(holder)
+                slots.append({"room" : room, "date" : today + timedelta(days=day), "time_slot" : time(hour, 0), "booked" : booked,
+                              "queue_length" : int(booked), "holder" : identity(holder)["email"] if booked else None})
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        ids = db.session.execute(insert(Slot).returning(Slot.id, sort_by_parameter_order=True), slots).scalars().all()
+        parties = [{"holder_name" : "Bench", "holder_phone" : identity(holder)["number"], "holder_email" : identity(holder)["email"],
+                    "time_booked" : datetime.now(), "queue_position" : 1, "room_id" : slot["room"], "slot_id" : slotId,
+                    "slot_time" : slot["time_slot"], "slot_date" : slot["date"], "passkey" : "1234"}
+                   for slot, slotId, holder in zip(slots, ids, holders) if holder is not None]
+        if parties:
+            db.session.execute(insert(QueuedParty.__table__), parties)
+        db.session.commit()
+        db.session.remove()
+
+    # Whatever an earlier run left in Redis was cached under the current versions, move them all on
+    commands = [command for day in range(days) for room in range(1, rooms + 1) for command in slotsBumpCommands(room, today + timedelta(days=day))]
+    commands += bookingsBumpCommands(*(value for user in range(users) for value in (identity(user)["email"], identity(user)["number"])))
+    redisManager.safe_pipeline(commands)
+
+    return {(slot["room"], slot["date"], slot["time_slot"].hour) : (slotId, holder) for slot, slotId, holder in zip(slots, ids, holders) if holder is not None}
+
+
+# Every client gets (n, rng, http, world) and returns [(endpoint, status, latency ms), ...]
+def availability(n : int, rng : random.Random, http, world : dict) -> list[tuple]:
+    weights = [1 / rank for rank in range(1, world["rooms"] + 1)]     # Zipf-ish, a few rooms are everyone's favourite
+    samples = []
+    for _ in range(world["ops"]):
+        room = rng.choices(range(1, world["rooms"] + 1), weights=weights)[0]
+        query = f"?date={(date.today() + timedelta(days=rng.randrange(world['days']))).strftime('%d%m%y')}" if rng.random() < 0.3 else ""
+        samples.append(timed(http.get, "GET /rooms/<room_id>/slots", f"/rooms/{room}/slots{query}"))
+    return samples
+
+def burst(n : int, rng : random.Random, http, world : dict) -> list[tuple]:
+    '''Everyone wants the same few rooms on the newest day, each client in its own order'''
+    opening = date.today() + timedelta(days=world["days"] - 1)
+    targets = [(room, hour) for room in range(1, min(world["rooms"], 4) + 1) for hour in world["hours"]]
+    rng.shuffle(targets)
+    who = identity(world["users"] + n)      # Not a seeded user, nobody holds anything yet
+    samples = []
+    for room, hour in (targets * (world["ops"] // len(targets) + 1))[:world["ops"]]:
+        samples.append(timed(http.post, "POST /book/<room_id>", f"/book/{room}",
+                             json=dict(who, date=opening.strftime("%d%m%y"), time=f"{hour:02d}00")))
+    return samples
+
+def churn(n : int, rng : random.Random, http, world : dict) -> list[tuple]:
+    slots = sorted(world["booked"])
+    who = identity(world["users"] + n)
+    queued, samples = [], []
+    for _ in range(world["ops"]):
+        if queued and rng.random() < 0.5:
+            slotId = queued.pop(rng.randrange(len(queued)))
+            samples.append(timed(http.delete, "DELETE /cancel/<slot_id>", f"/cancel/{slotId}", json={"identity" : who["email"], "passkey" : who["passkey"]}))
+            continue
+        room, slotDate, hour = rng.choice(slots)
+        sample = timed(http.post, "POST /enqueue/<room_id>", f"/enqueue/{room}", json=dict(who, date=slotDate.strftime("%d%m%y"), time=f"{hour:02d}00"))
+        if sample[1] == 201:
+            queued.append(world["booked"][(room, slotDate, hour)][0])
+        samples.append(sample)
+    return samples
+
+def lookups(n : int, rng : random.Random, http, world : dict) -> list[tuple]:
+    holders = sorted({holder for _, holder in world["booked"].values()})
+    samples = []
+    for _ in range(world["ops"]):
+        # One in five has never booked anything, the 404 (cached as a negative) is part of the mix
+        who = identity(rng.choice(holders) if rng.random() < 0.8 else world["users"] + rng.randrange(world["users"]))
+        samples.append(timed(http.get, "GET /bookings/<identity>", f"/bookings/{who['email'] if rng.random() < 0.7 else who['number']}"))
+    return samples
+
+CLIENTS : dict[str, Callable] = {"availability" : availability, "burst" : burst, "churn" : churn, "lookups" : lookups}
+
+
+def timed(call : Callable, endpoint : str, *args, **kwargs) -> tuple[str, int, float]:
+    start = clock.perf_counter()
+    response = call(*args, **kwargs)
+    return endpoint, response.status_code, (clock.perf_counter() - start) * 1000
+
+
+def run_scenario(app, db, name : str, clients : int, world : dict, seed : int) -> dict:
+    def client(n : int, barrier, results) -> None:
+        with app.app_context():
+            db.engine.dispose(close=False)      # Connections inherited over fork belong to the parent
+        http = app.test_client()
+        rng = random.Random(seed * 1000 + n)
+        barrier.wait()
+        results.put(CLIENTS[name](n, rng, http, world))
+
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(clients + 1)
+    results = context.Queue()
+    workers = [context.Process(target=client, args=(n, barrier, results)) for n in range(clients)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = clock.perf_counter()
+    collected = [results.get() for _ in workers]
+    elapsed = clock.perf_counter() - started
+    for worker in workers:
+        worker.join()
+
+    latencies, statuses = defaultdict(list), defaultdict(Counter)
+    for samples in collected:
+        for endpoint, status, took in samples:
+            latencies[endpoint].append(took)
+            statuses[endpoint][str(status)] += 1
+
+    total = sum(len(samples) for samples in collected)
+    return {"seconds" : round(elapsed, 3),
+            "requests" : total,
+            "requests_per_second" : round(total / elapsed, 1),
+            "endpoints" : {endpoint : {"requests" : len(samples),
+                                       "requests_per_second" : round(len(samples) / elapsed, 1),
+                                       "statuses" : dict(sorted(statuses[endpoint].items())),
+                                       "latency_ms" : summarize(samples)}
+                           for endpoint, samples in sorted(latencies.items())}}
+
+
+def compare(previous : dict, current : dict) -> dict:
+    '''Percentage change per scenario and endpoint, positive throughput and negative latency are improvements'''
+    change = lambda old, new: round((new - old) / old * 100, 1) if old else None
+    deltas = {}
+    for name, scenario in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        deltas[name] = {endpoint : {"requests_per_second_pct" : change(before["endpoints"][endpoint]["requests_per_second"], stats["requests_per_second"]),
+                                    **{f"{pct}_pct" : change(before["endpoints"][endpoint]["latency_ms"][pct], stats["latency_ms"][pct])
+                                       for pct in ("p50", "p95", "p99")}}
+                        for endpoint, stats in scenario["endpoints"].items() if endpoint in before["endpoints"]}
+    return {"against" : previous.get("meta", {}).get("commit"), "scenarios" : deltas}
+
+
+def commit() -> str | None:
+    try:
+        head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+        return head + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--days", type=int, default=4, help="Days from today, the last one opens during the burst")
+    parser.add_argument("--users", type=int, default=500, help="Seeded users holding the booked slots")
+    parser.add_argument("--booked", type=float, default=0.3, help="Share of slots booked before the window opens")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent client processes per scenario")
+    parser.add_argument("--ops", type=int, default=200, help="Requests per client per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=None, help="Default: all of them (the read ones on SQLite)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Write the JSON here as well as to stdout")
+    parser.add_argument("--compare", default=None, help="Earlier --output file to diff against")
+    args = parser.parse_args()
+
+    app, db = load_app(args.db_url, LIB_FUTURE_WINDOW_SIZE=str(args.days - 1))        # The booking window covers the world
+    from service import cacheManager
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    scenarios = args.scenarios or [name for name in SCENARIOS if dialect == "postgresql" or name not in POSTGRES_SCENARIOS]
+    skipped = [name for name in SCENARIOS if name not in scenarios]
+    if skipped and not args.scenarios:
+        print(f"Skipping {', '.join(skipped)} on {dialect}, they need Postgres (BENCH_DB_URL or --db-url)", file=sys.stderr)
+
+    hours = list(range(app.config["OPENING_TIME"] // 100, app.config["CLOSING_TIME"] // 100 + 1))
+    report = {"meta" : {"commit" : commit(),
+                        "timestamp" : datetime.now().isoformat(timespec="seconds"),
+                        "python" : platform.python_version(),
+                        "cpus" : os.cpu_count(),
+                        "database" : dialect,
+                        "redis" : cacheManager is not None,
+                        "world" : {"rooms" : args.rooms, "days" : args.days, "hours" : len(hours), "users" : args.users, "booked" : args.booked},
+                        "clients" : args.clients,
+                        "ops_per_client" : args.ops,
+                        "seed" : args.seed,
+                        "skipped" : skipped,
+                        "settings" : {key : app.config[key] for key in ("CONCURRENCY_MODE", "AVAILABILITY_INDEX", "MAX_QLEN", "LOCK_RETRIES")}},
+              "scenarios" : {}}
+
+    for name in scenarios:
+        world = {"rooms" : args.rooms, "days" : args.days, "hours" : hours, "users" : args.users, "ops" : args.ops,
+                 "booked" : seed_world(app, db, args.rooms, args.days, args.users, args.booked, args.seed)}
+        report["scenarios"][name] = run_scenario(app, db, name, args.clients, world, args.seed)
+        print(f"{name}: {report['scenarios'][name]['requests_per_second']} req/s", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            report["comparison"] = compare(json.load(previous), report)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,120 @@
-from flask import Flask
+'''Apps are built by create_app. Importing the package only sets up what needs no configuration (db, the
+contention and metrics tallies), so models, auxillary_modules and scripts can be imported without a .env, and
+nothing here opens a connection: the DB and Redis pools connect on first use, inside the worker that uses them.
+
+Every app gets its own config, Redis handles, event broker and availability index (app.extensions["library"]),
+routes.py reaches the ones of the app serving the request. The first app built in a process is also the one
+`from service import app` (run.py, asgi.py, gunicorn service:app, flask --app service) and `from service import
+redisManager` etc. give, built from the environment the first time it's asked for if nothing built one before.
+'''
+from flask import Flask, request, Response, current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from werkzeug.local import LocalProxy
+
+from service.config import AppConfig, CacheManager, loadEnv
+from service.auxillary_modules.redismanager import NullRedisManager
+from service.auxillary_modules.availability import AvailabilityIndex
+from service.auxillary_modules.contention import ContentionStats
+from service.auxillary_modules.metrics import Metrics
+from service.auxillary_modules.responses import ORJSONProvider
+from service.auxillary_modules.events import EventBroker, RedisEventBroker
+
+from typing import Any
+
+db = SQLAlchemy()
+contentionStats = ContentionStats()
 
-from redis import Redis
+# Per-request latency, SQL and Redis tallies. Engine events cover every engine (the async one in asgi.py too).
+metrics = Metrics()
 
-from service.config import configObj
-from service.auxillary_modules.redismanager import RedisManager
+EXTENSIONS = ("redisManager", "cacheManager", "eventBroker", "availabilityIndex")
+
+_default : Flask | None = None          # First app built in this process
+
+def create_app(config : Any = None) -> Flask:
+    '''Build an app from `config` (an object or a mapping, loaded like app.config.from_object / from_mapping),
+    by default AppConfig from backend/.env and the environment. Nothing stays connected afterwards.'''
+    global _default
+    if config is None:
+        loadEnv()
+        config = AppConfig()
+
+    app = Flask(__name__)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    else:
+        app.config.from_object(config)
+    app.json = ORJSONProvider(app)        # jsonify, get_json and the error handlers all go through orjson
 
-app = Flask(__name__)
-app.config.from_object(configObj)
+    db.init_app(app)            # Engine and pool only, the first query connects
+    if _underFlaskCLI():
+        # Alembic is a good share of the import time and only `flask db` needs it, workers skip it
+        from flask_migrate import Migrate
+        Migrate(app, db)
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+    if app.config["REDIS_HOST"]:
+        # CacheManager is a RedisManager with a local L1 in front, one connection pool serves both
+        cacheManager = CacheManager(app.config["CACHE_MAX_BYTES"], app.config["CACHE_MAX_KEY_BYTES"], app.config["CACHE_MAX_VALUE_BYTES"],
+                                    app.config["REDIS_HOST"], app.config["REDIS_PORT"], defaultTTL=app.config["CACHE_L1_TTL"],
+                                    maxConnections=app.config["REDIS_MAX_CONNECTIONS"],
+                                    socketTimeout=app.config["REDIS_SOCKET_TIMEOUT"],
+                                    breakerThreshold=app.config["REDIS_BREAKER_THRESHOLD"],
+                                    breakerCooldown=app.config["REDIS_BREAKER_COOLDOWN"])
+        redisManager = cacheManager
+        redisManager.observer = metrics.observeRedis
 
-try:
-    redisManager = RedisManager(app.config["REDIS_HOST"], app.config["REDIS_PORT"])
-except Exception as e:
-    if app.config["REQUIRE_REDIS"]:
-        raise ConnectionError("REQUIRE_REDIS set to True, but encountered failure in establishing connection to Redis")
+        if app.config["REQUIRE_REDIS"]:
+            if not redisManager.ping():
+                raise ConnectionError("REQUIRE_REDIS set to True, but encountered failure in establishing connection to Redis")
+            redisManager.disconnect()       # Checked, not kept: a preforked master must not hand its socket to every worker
     else:
         print("\n\n============== WARNING: RUNNING APP WITHOUT REDIS LAYER ==============\n\n")
-        redisManager = None
+        # Caching is off entirely without Redis, the version counters that keep it fresh live there
+        redisManager = NullRedisManager()
+        cacheManager = None
+
+    app.extensions["library"] = {
+        "redisManager" : redisManager,
+        "cacheManager" : cacheManager,
+        # Queue changes for the SSE streams, across workers through Redis pub/sub when there is a Redis
+        "eventBroker" : RedisEventBroker(redisManager, app.config["SSE_MAILBOX"]) if redisManager else EventBroker(app.config["SSE_MAILBOX"]),
+        "availabilityIndex" : AvailabilityIndex(app.config["FUTURE_WINDOW_SIZE"], app.config["AVAILABILITY_INDEX_MAX_AGE"]) if app.config["AVAILABILITY_INDEX"] else None,
+    }
+
+    metrics.instrumentEngines()
+    app.before_request(startRequestTally)
+    app.after_request(finishRequestTally)
+
+    from service import models
+    from service.routes import bp
+    app.register_blueprint(bp)
+
+    if _default is None:
+        _default = app
+    return app
+
+def extension(name : str) -> LocalProxy:
+    '''`name` from app.extensions["library"] of the app handling the current request'''
+    return LocalProxy(lambda: current_app.extensions["library"][name])
+
+def __getattr__(name : str) -> Any:
+    '''The default app is only built when something asks for it (or for what comes with it)'''
+    if name == "app" or name in EXTENSIONS:
+        app = _default or create_app()
+        return app if name == "app" else app.extensions["library"][name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _underFlaskCLI() -> bool:
+    '''The flask command loads the app from inside its click context, servers and scripts don't have one'''
+    from click import get_current_context
+    return get_current_context(silent=True) is not None
+
+def startRequestTally() -> None:
+    metrics.startRequest()
 
-from service import models
-from service import routes
\ No newline at end of file
+def finishRequestTally(response : Response) -> Response:
+    # Labelled by view name like asgi.py does, without the blueprint prefix
+    tally = metrics.finishRequest(request.endpoint.rpartition(".")[2] if request.endpoint else "unmatched", request.method, response.status_code)
+    if tally and current_app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = tally.serverTiming()
+    return response
@@ -0,0 +1,492 @@
+'''ASGI entry point. The hot endpoints (slot listings, booking, enqueueing) run as coroutines on an async DB driver
+and an async Redis client, everything else is the regular Flask app served from a threadpool.
+
+Validation, SQL and cache keys are shared with routes.py, only the I/O differs. Run from backend/ with
+    uvicorn service.asgi:application --workers 4
+DB_ASYNC_URL overrides the async database URL, by default it's the sync one on asyncpg (or aiosqlite for SQLite).
+On SQLite the async writes of a process take turns and wait up to SQLITE_BUSY_TIMEOUT seconds for the file lock,
+that keeps one worker correct; serving with several workers, or measuring anything, wants Postgres.
+'''
+import asyncio
+import re
+from contextlib import aclosing, nullcontext
+from time import perf_counter, monotonic
+from datetime import datetime, date, time, timedelta
+from traceback import format_exc
+from typing import Any, Awaitable, Callable, NamedTuple
+from urllib.parse import parse_qs
+
+import orjson
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from werkzeug.exceptions import HTTPException, BadRequest, Conflict, NotFound, InternalServerError
+from werkzeug.http import parse_etags
+
+from service import app, cacheManager, availabilityIndex, contentionStats, metrics, eventBroker
+from service.models import Slot, QueuedParty
+from service.routes import _availabilityQuery, _slotsQuery, _slotListing, _slotPayload, _claimQuery, _partyInsert, _conflictQuery, \
+                           _occupancyDelta, _occupancyInsert, _BOOKED, \
+                           _holderConflictError, _alreadyQueuedQuery, _slotAt, _enqueueRejection, _lockUnavailable, \
+                           _alternativesQuery, _alternativePayload, _optimistic, _versionedUpdate, \
+                           Position, _queueEvents, _identityClause, _bookingsQuery, _bookingListing, _LARGE_LISTING_ARGS
+from service.auxillary_modules.auxillary import parseBookingDetails, parseSlotFilters, checkJSONMimetype
+from service.auxillary_modules.redismanager import AsyncRedisManager
+from service.auxillary_modules.responses import dumpJSON
+from service.auxillary_modules.contention import isLockConflict, backoffDelay
+from service.auxillary_modules.events import Subscription, RESYNC, identityChannel, slotChannel, sseFrame
+from service.auxillary_modules.cachekeys import SLOTS_TTL, slotsKey, slotsVersionReadCommands, parseVersionRead, slotsETag, \
+                                                slotsBumpCommands, bookingsBumpCommands
+
+ASYNC_DRIVERS = {"postgresql" : "postgresql+asyncpg", "sqlite" : "sqlite+aiosqlite"}
+SQLITE_BUSY_TIMEOUT = 30
+
+def asyncDatabaseUrl(syncUrl : str) -> str:
+    url = make_url(syncUrl)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend}, set DB_ASYNC_URL")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+asyncUrl = make_url(app.config["ASYNC_DATABASE_URI"] or asyncDatabaseUrl(app.config["SQLALCHEMY_DATABASE_URI"]))
+dialect : str = asyncUrl.get_backend_name()
+engine = create_async_engine(asyncUrl, connect_args={"timeout" : SQLITE_BUSY_TIMEOUT} if dialect == "sqlite" else {})
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# SQLite has one writer at a time, and a transaction that read before it writes fails outright instead of waiting
+# when another one got the write lock first. Coroutines of this process take turns writing so they never race for it.
+_writes = asyncio.Lock() if dialect == "sqlite" else nullcontext()
+
+aredis : AsyncRedisManager | None = None
+if app.config["REDIS_HOST"]:
+    aredis = AsyncRedisManager(app.config["REDIS_HOST"], app.config["REDIS_PORT"],
+                               maxConnections=app.config["REDIS_MAX_CONNECTIONS"],
+                               socketTimeout=app.config["REDIS_SOCKET_TIMEOUT"],
+                               breakerThreshold=app.config["REDIS_BREAKER_THRESHOLD"],
+                               breakerCooldown=app.config["REDIS_BREAKER_COOLDOWN"])
+    aredis.observer = metrics.observeRedis
+
+_indexReload = asyncio.Lock()
+
+### HELPERS ###
+class Request:
+    def __init__(self, scope : dict, body : bytes):
+        self.method : str = scope["method"]
+        self.path : str = scope["path"]
+        self.rootPath : str = scope.get("root_path", "")
+        self.query : dict[str, list[str]] = parse_qs(scope["query_string"].decode("latin-1"))
+        self.headers : dict[bytes, bytes] = dict(scope["headers"])
+        self.body = body
+
+    def arg(self, name : str) -> str | None:
+        values = self.query.get(name)
+        return values[0] if values else None
+
+    def matches(self, etag : str | None) -> bool:
+        '''If-None-Match against an unquoted strong ETag, like flask.request.if_none_match.contains()'''
+        header = self.headers.get(b"if-none-match")
+        return bool(etag and header) and parse_etags(header.decode("latin-1")).contains(etag)
+
+    def json(self) -> Any:
+        '''Same rules as @enforce_JSON followed by request.get_json()'''
+        mimetype = self.headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+        checkJSONMimetype(mimetype, self.method, self.rootPath)
+        try:
+            return orjson.loads(self.body)
+        except orjson.JSONDecodeError:
+            raise BadRequest("Failed to decode JSON object")
+
+Response = tuple[int, Any] | tuple[int, Any, list[tuple[bytes, bytes]]]     # (status, body[, headers]), bytes bodies are sent as they are
+
+def _etagHeaders(etag : str | None) -> list[tuple[bytes, bytes]]:
+    '''responses.withETag's headers'''
+    return [(b"etag", f'"{etag}"'.encode()), (b"cache-control", b"no-cache")] if etag else []
+
+async def _readVersion(room_id : int | None, slotDate : date | None = None) -> int | None:
+    return parseVersionRead(await aredis.safe_pipeline(slotsVersionReadCommands(room_id, slotDate))) if aredis else None
+
+async def _cacheGet(key : str) -> bytes | None:
+    '''CacheManager.get with the Redis half awaited. L1 is shared with the Flask half of this process.'''
+    if not (cacheManager and aredis) or aredis.breaker.isOpen:
+        return None
+
+    value = cacheManager.getFromCache(key)
+    if value is not None:
+        cacheManager.hits += 1
+        return value
+
+    value = await aredis.safe_execute_command("GET", True, key)
+    if value is None:
+        cacheManager.misses += 1
+        return None
+
+    cacheManager.l2Hits += 1
+    try:
+        cacheManager.addToCache(key, value)
+    except (ValueError, MemoryError):
+        pass
+    return value
+
+async def _cacheSet(key : str, value : bytes, ttl : int) -> None:
+    if not (cacheManager and aredis):
+        return
+    if await aredis.safe_execute_command("SETEX", True, key, ttl, value) is None:
+        return
+    try:
+        cacheManager.addToCache(key, value, min(ttl, cacheManager.defaultTTL))
+    except (ValueError, MemoryError):
+        pass
+
+async def _mirrorSlot(room : int, slotDate : date, slotTime : time, booked : bool, qLen : int, holder : str | None, positions : list[Position]) -> None:
+    '''routes._mirrorSlot, the pipeline sent through aredis'''
+    events = _queueEvents(room, slotDate, slotTime, booked, qLen, holder, positions)
+    publish = eventBroker.commands(events) if aredis else []
+    results = []
+    if aredis:
+        results = await aredis.safe_pipeline(slotsBumpCommands(room, slotDate)
+                                             + bookingsBumpCommands(*(identity for email, phone, _ in positions for identity in (email, phone)))
+                                             + publish)
+    eventBroker.published(events, results[len(results) - len(publish):])
+    if availabilityIndex:
+        availabilityIndex.applySlot(room, slotDate, slotTime, booked, qLen, holder, results[1] if results else None)
+
+async def _refreshAvailability(today : date, room_id : int) -> None:
+    '''routes' availabilityIndex.ensureFresh call, the rows fetched on the event loop first'''
+    version = await _readVersion(room_id)        # Before the rows, same as routes
+    if not (availabilityIndex.isStale(today) or availabilityIndex.roomIsStale(room_id, version)):
+        return
+    async with _indexReload:
+        rebuild = availabilityIndex.isStale(today)
+        if rebuild or availabilityIndex.roomIsStale(room_id, version):
+            query = _availabilityQuery(today, today + timedelta(days=availabilityIndex.windowSize), None if rebuild else room_id)
+            async with engine.connect() as conn:
+                rows = (await conn.execute(query)).all()
+            # A rebuild marks room_id loaded at `version`, so the loader only ever gets asked for what was fetched
+            availabilityIndex.ensureFresh(today, lambda *_: rows, room_id, version)
+
+async def _lockWithRetry(session : AsyncSession, query) -> Any:
+    '''routes._lockWithRetry, sleeping on the event loop instead of the thread'''
+    firstConflict = None
+    for attempt in range(app.config["LOCK_RETRIES"] + 1):
+        try:
+            result = (await session.execute(query)).scalar_one_or_none()
+            if firstConflict is not None:
+                contentionStats.recordWait(perf_counter() - firstConflict)
+            return result
+        except OperationalError as e:
+            await session.rollback()
+            if not isLockConflict(e):
+                raise
+            firstConflict = firstConflict or perf_counter()
+            retrying = attempt < app.config["LOCK_RETRIES"]
+            contentionStats.recordConflict(retrying)
+            if retrying:
+                await asyncio.sleep(backoffDelay(attempt, app.config["LOCK_RETRY_BASE"], app.config["LOCK_RETRY_CAP"]))
+
+    contentionStats.recordWait(perf_counter() - firstConflict)
+    raise _lockUnavailable()
+
+async def _readSlot(session : AsyncSession, query) -> Slot | None:
+    '''routes._readSlot'''
+    if _optimistic():
+        return (await session.execute(query)).scalar_one_or_none()
+    return await _lockWithRetry(session, query.with_for_update(nowait=True))
+
+async def _casAttempts(session : AsyncSession):
+    '''routes._casAttempts, backing off on the event loop'''
+    retries = app.config["OPTIMISTIC_RETRIES"] if _optimistic() else 0
+    for attempt in range(retries + 1):
+        yield attempt
+        await session.rollback()
+        retrying = attempt < retries
+        contentionStats.recordVersionConflict(retrying)
+        if retrying:
+            await asyncio.sleep(backoffDelay(attempt, app.config["LOCK_RETRY_BASE"], app.config["LOCK_RETRY_CAP"]))
+    raise _lockUnavailable()
+
+async def _suggestAlternatives(room_id : int, booking_date : date, booking_time : time) -> list[dict]:
+    if not app.config["SUGGESTIONS"]:
+        return []
+    try:
+        async with Session() as session:
+            rows = (await session.execute(_alternativesQuery(room_id, booking_date, booking_time, app.config["SUGGESTIONS"]))).all()
+            await session.rollback()
+    except SQLAlchemyError as e:
+        app.logger.error(f"Failed to look up alternative slots: {e}")
+        return []
+    if rows:
+        contentionStats.recordSuggestion()
+    return _alternativePayload(rows)
+
+### ENDPOINTS ###
+async def getRoomDetails(request : Request, room_id : int) -> Response:
+    req_date = request.arg("date")
+    req_time = request.arg("time")
+
+    today = datetime.date(datetime.now())
+    if availabilityIndex and not (req_date or req_time):
+        await _refreshAvailability(today, room_id)
+        snapshot = availabilityIndex.snapshot(room_id)
+        if snapshot is not None:
+            version, indexed = snapshot
+            etag = slotsETag(room_id, version, None, None, today)
+            if request.matches(etag):
+                metrics.recordCacheLookup("getRoomDetails", "not_modified")
+                return 304, b"", _etagHeaders(etag)
+            metrics.recordCacheLookup("getRoomDetails", "index")
+            return (200, indexed, _etagHeaders(etag)) if indexed else (404, [])
+
+    req_date, req_time = parseSlotFilters(req_date, req_time, app.config)
+
+    version = await _readVersion(room_id, req_date)
+    etag = slotsETag(room_id, version, req_date, req_time, today) if version is not None else None
+    if request.matches(etag):
+        metrics.recordCacheLookup("getRoomDetails", "not_modified")
+        return 304, b"", _etagHeaders(etag)
+
+    cacheKey = slotsKey(room_id, version or 0, req_date, req_time)
+    cached = await _cacheGet(cacheKey)
+    if cacheManager and aredis:
+        metrics.recordCacheLookup("getRoomDetails", "hit" if cached else "miss")
+    if cached:
+        return 200, cached, _etagHeaders(etag)
+
+    async with Session() as session:
+        results = (await session.execute(_slotsQuery(room_id, req_date, req_time))).all()
+    if not results:
+        return 404, []
+
+    payload = dumpJSON(_slotListing(results))
+    await _cacheSet(cacheKey, payload, SLOTS_TTL)
+    return 200, payload, _etagHeaders(etag)
+
+async def bookRoom(request : Request, room_id : int) -> Response:
+    booking_date, booking_time, holder_num, holder_email, holder_name, holder_passkey = parseBookingDetails(request.json(), app.config, request.rootPath)
+
+    async with _writes, Session() as session:
+        try:
+            query = _claimQuery(room_id, booking_date, booking_time, holder_name, holder_num, holder_email, holder_passkey, dialect)
+            if dialect == "postgresql":
+                outcome = (await session.execute(query)).one()
+                claimed, isHolder = (outcome if outcome.id is not None else None), outcome.conflict
+            else:
+                claimed, isHolder = (await session.execute(query)).one_or_none(), False
+                if claimed:
+                    await session.execute(_partyInsert(claimed, holder_name, holder_num, holder_email, holder_passkey))
+                    await session.execute(_occupancyInsert([_occupancyDelta(claimed.room, claimed.date, claimed.time_slot, **_BOOKED)]))
+                else:
+                    isHolder = (await session.execute(_conflictQuery(room_id, booking_date, booking_time, holder_email, holder_num))).scalar()
+
+            if claimed:
+                await session.commit()
+            else:
+                await session.rollback()
+        except Exception as e:
+            await session.rollback()
+            app.logger.error(f"Error occurred while booking slot: {e}")
+            raise
+
+    if not claimed:
+        if isHolder:
+            raise _holderConflictError()
+        return 404, {"message" : "Slot Unavailable",
+                     "alternatives" : await _suggestAlternatives(room_id, booking_date, booking_time)}
+
+    await _mirrorSlot(claimed.room, claimed.date, claimed.time_slot, claimed.booked, claimed.queue_length, claimed.holder, [(holder_email, holder_num, 1)])
+    return 201, _slotPayload(claimed)
+
+async def enqueueToRoom(request : Request, room_id : int) -> Response:
+    booking_date, booking_time, holder_num, holder_email, holder_name, holder_passkey = parseBookingDetails(request.json(), app.config, request.rootPath)
+
+    async with _writes, Session() as session:
+        if (await session.execute(_alreadyQueuedQuery(room_id, booking_date, booking_time, holder_email, holder_num))).scalar():
+            raise Conflict("Credentials already in queue for this time slot")
+
+        try:
+            async with aclosing(_casAttempts(session)) as attempts:
+                async for _ in attempts:
+                    slot : Slot | None = await _readSlot(session, _slotAt(room_id, booking_date, booking_time))
+
+                    rejection = _enqueueRejection(slot, f"{request.rootPath}/book/{room_id}")
+                    if rejection:
+                        body, status, suggest = rejection
+                        await session.rollback()
+                        if suggest:
+                            body["alternatives"] = await _suggestAlternatives(room_id, booking_date, booking_time)
+                        return status, body
+
+                    # Queue positions are 1-based, the holder sits at 1 and a newcomer goes to the back. The holder doesn't change.
+                    newQLen = slot.queue_length + 1
+                    if (await session.execute(_versionedUpdate(slot, queue_length=newQLen))).rowcount:
+                        break
+
+            session.add(QueuedParty(hName=holder_name,
+                                    hMail=holder_email,
+                                    hPhone=holder_num,
+                                    room_id=room_id,
+                                    tBooked=datetime.now(),
+                                    index=newQLen,
+                                    slot_id=slot.id,
+                                    slot_time=slot.time_slot,
+                                    slot_date=slot.date,
+                                    passkey=holder_passkey))
+            await session.execute(_occupancyInsert([_occupancyDelta(room_id, slot.date, slot.time_slot, parties=1, peak_queue=newQLen)]))
+
+            body = slot.__CustomDict__()
+            currentHolder = slot.holder
+            await session.commit()
+        except HTTPException:
+            raise
+        except Exception as e:
+            await session.rollback()
+            app.logger.error(f"Error occurred while booking slot: {e}")
+            raise
+
+    await _mirrorSlot(room_id, booking_date, booking_time, True, newQLen, currentHolder, [(holder_email, holder_num, newQLen)])
+    return 201, body
+
+class EventStream(NamedTuple):
+    '''Body of a streaming response, see _stream'''
+    subscription : Subscription
+    event : str
+    snapshot : bytes
+
+async def _subscribed(channel : str, query) -> tuple[Subscription, list]:
+    '''Subscribe, then read the snapshot rows, so no event falls in between'''
+    subscription = eventBroker.subscribe([channel], asyncio.get_running_loop())
+    try:
+        async with Session() as session:
+            return subscription, (await session.execute(query)).all()
+    except SQLAlchemyError:
+        eventBroker.unsubscribe(subscription)
+        raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+
+async def streamBookings(request : Request, identity : str) -> Response:
+    subscription, rows = await _subscribed(identityChannel(identity), _bookingsQuery(_identityClause(identity)))
+    return 200, EventStream(subscription, "position", dumpJSON(_bookingListing(rows)))
+
+async def streamSlot(request : Request, room_id : int) -> Response:
+    req_date, req_time = parseSlotFilters(request.arg("date"), request.arg("time"), app.config)
+    if not (req_date and req_time):
+        raise BadRequest("date and time are both required to follow a slot")
+    subscription, rows = await _subscribed(slotChannel(room_id, req_date, req_time), _slotsQuery(room_id, req_date, req_time))
+    if not rows:
+        eventBroker.unsubscribe(subscription)
+        raise NotFound(f"Room {room_id} has no slot at that date and time")
+    return 200, EventStream(subscription, "slot", dumpJSON(_slotListing(rows)[0]))
+
+ROUTES : list[tuple[str, re.Pattern, Callable[..., Awaitable[Response]], Callable[[str], Any]]] = [
+    ("GET", re.compile(r"/rooms/(\d+)/slots"), getRoomDetails, int),
+    ("POST", re.compile(r"/book/(\d+)"), bookRoom, int),
+    ("POST", re.compile(r"/enqueue/(\d+)"), enqueueToRoom, int),
+    ("GET", re.compile(r"/bookings/([^/]+)/events"), streamBookings, str),
+    ("GET", re.compile(r"/rooms/(\d+)/slots/events"), streamSlot, int),
+]
+
+### APPLICATION ###
+async def _send(send : Callable, status : int, body : Any, headers : list[tuple[bytes, bytes]] = []) -> None:
+    if status == 304:           # Headers only, no body to describe
+        await send({"type" : "http.response.start", "status" : status, "headers" : headers})
+        return await send({"type" : "http.response.body", "body" : b""})
+    if not isinstance(body, bytes):
+        body = dumpJSON(body)
+    await send({"type" : "http.response.start",
+                "status" : status,
+                "headers" : [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + headers})
+    await send({"type" : "http.response.body", "body" : body})
+
+async def _stream(receive : Callable, send : Callable, stream : EventStream) -> None:
+    '''routes._eventStream on the event loop. uvicorn drops sends to a gone client without a word, so the
+    disconnect is watched on receive instead.'''
+    gone = asyncio.ensure_future(receive())        # The request body was read already, the next message is http.disconnect
+    heartbeat, lifetime = app.config["SSE_HEARTBEAT"], app.config["SSE_MAX_SECONDS"]
+    try:
+        await send({"type" : "http.response.start",
+                    "status" : 200,
+                    "headers" : [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]})
+        await send({"type" : "http.response.body", "body" : b"retry: 3000\n" + sseFrame("snapshot", stream.snapshot), "more_body" : True})
+        deadline = monotonic() + lifetime
+        while not gone.done() and (left := deadline - monotonic()) > 0:
+            received = await stream.subscription.aget(min(heartbeat, left))
+            if received is None:
+                chunk = b": keepalive\n\n"
+            elif received is RESYNC:
+                chunk = sseFrame("resync", b"{}")
+            else:
+                chunk = sseFrame(stream.event, received[1])
+            await send({"type" : "http.response.body", "body" : chunk, "more_body" : True})
+        if not gone.done():
+            await send({"type" : "http.response.body", "body" : b""})
+    finally:
+        gone.cancel()
+        eventBroker.unsubscribe(stream.subscription)
+
+async def _readBody(receive : Callable) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+async def _lifespan(receive : Callable, send : Callable) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Each worker checks for itself, after the fork, nothing connected before it
+            if aredis and app.config["REQUIRE_REDIS"] and not await aredis.ping():
+                await send({"type" : "lifespan.startup.failed", "message" : "REQUIRE_REDIS set to True, but encountered failure in establishing connection to Redis"})
+                return
+            await send({"type" : "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await engine.dispose()
+            if aredis:
+                await aredis.close()
+            await send({"type" : "lifespan.shutdown.complete"})
+            return
+
+flaskApp = WSGIMiddleware(app)
+
+async def application(scope : dict, receive : Callable, send : Callable) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    if scope["type"] == "http":
+        path = scope["path"][len(scope.get("root_path", "")):] if scope["path"].startswith(scope.get("root_path", "")) else scope["path"]
+        for method, pattern, handler, convert in ROUTES:
+            match = pattern.fullmatch(path)
+            if match and scope["method"] == method:
+                break
+        else:
+            return await flaskApp(scope, receive, send)
+        if handler is getRoomDetails and _LARGE_LISTING_ARGS & parse_qs(scope["query_string"].decode("latin-1")).keys():
+            return await flaskApp(scope, receive, send)         # Keyset pages and streamed listings are routes.py's
+
+        headers = []
+        metrics.startRequest()
+        try:
+            with app.app_context():         # The routes.py helpers read current_app.config
+                status, body, *extra = await handler(Request(scope, await _readBody(receive)), convert(match.group(1)))
+            if extra:
+                headers.extend(extra[0])
+        except HTTPException as e:
+            # Same body as routes.err_generic
+            body = {"message" : e.description}
+            if hasattr(e, "additional_info"):
+                body["info"] = e.additional_info
+            status = e.code
+            if getattr(e, "retry_after", None):
+                headers.append((b"retry-after", str(e.retry_after).encode()))
+        except Exception as e:
+            print(format_exc())
+            body = {"message" : "There seems to be an error at our server, We apologise :3"}
+            status = 500
+        tally = metrics.finishRequest(handler.__name__, method, status)
+        if isinstance(body, EventStream):
+            return await _stream(receive, send, body)
+        if tally and app.config["SERVER_TIMING"]:
+            headers.append((b"server-timing", tally.serverTiming().encode()))
+        return await _send(send, status, body, headers)
+
+    return await flaskApp(scope, receive, send)
@@ -3,6 +3,8 @@ from functools import wraps
 from traceback import format_exc
 from flask import request
 from werkzeug.exceptions import BadRequest
+from datetime import datetime, date, time, timedelta
+from typing import Any, Mapping
 import re
 
 # Helper Methods
@@ -17,14 +19,150 @@ def validateDetails(number : str, email : str, passkey : str, emailRegex : str =
         return True
     except:
         return False
-        
+
+# Request parsing, shared by the Flask routes and the ASGI handlers so both accept and reject exactly the same things.
+# `config` is app.config, `path` only goes into error messages.
+def parseSlotTime(value : Any, config : Mapping) -> time:
+    '''HHMM integer (or numeric string) within opening hours to a time, raises ValueError otherwise'''
+    value = int(value)
+    if value < config["OPENING_TIME"] or value > config["CLOSING_TIME"]:
+        raise ValueError()
+    return time(value // 100, 0)
+
+def checkBookableDate(value : date, config : Mapping) -> date:
+    currentDate = datetime.date(datetime.now())
+    if value > currentDate + timedelta(days=config["FUTURE_WINDOW_SIZE"]):
+        raise BadRequest(f"You can only book rooms til {(currentDate + timedelta(days=config['FUTURE_WINDOW_SIZE'])).strftime('%d%m%y')}")
+    return value
+
+def parseSlotFilters(req_date : str | None, req_time : str | None, config : Mapping) -> tuple[date | None, time | None]:
+    '''?date=ddmmyy&time=HHMM of GET /rooms/<room_id>/slots, either can be missing'''
+    if req_time:
+        try:
+            req_time = parseSlotTime(req_time, config)
+        except ValueError:
+            raise BadRequest(f"Time specified must be between {config['OPENING_TIME']} to {config['CLOSING_TIME']}, and be an integer")
+
+    if req_date:
+        try:
+            req_date = checkBookableDate(datetime.strptime(req_date, "%d%m%y").date(), config)
+        except ValueError:
+            e = BadRequest("Date must be formatted as `ddmmyy`, no alphabets or special characters allowed")
+            e.__setattr__("additional_info", f"For example, today's date would be formatted as: {datetime.now().strftime('%d%m%y')}")
+            raise e
+
+    return req_date or None, req_time or None
+
+def parseGridFilters(rooms : str | None, start : str | None, days : str | None, config : Mapping) -> tuple[list[int] | None, date, date]:
+    '''?rooms=1,2,3&date=ddmmyy&days=n of GET /rooms/availability to (rooms or None for all of them, start, exclusive end).
+    Defaults to every room over the whole booking window, the end is clipped to the window.'''
+    rooms = parseRooms(rooms)
+
+    currentDate = datetime.date(datetime.now())
+    windowEnd = currentDate + timedelta(days=config["FUTURE_WINDOW_SIZE"] + 1)      # checkBookableDate lets the last day through
+    start = parseSlotFilters(start, None, config)[0] or currentDate
+
+    try:
+        days = int(days) if days else config["FUTURE_WINDOW_SIZE"]
+    except ValueError:
+        raise BadRequest("days must be an integer")
+    if not (1 <= days <= config["FUTURE_WINDOW_SIZE"]):
+        raise BadRequest(f"days must be between 1 and {config['FUTURE_WINDOW_SIZE']}")
+
+    return rooms, start, min(start + timedelta(days=days), windowEnd)
+
+def parseRooms(rooms : str | None) -> list[int] | None:
+    '''?rooms=1,2,3 to sorted distinct room numbers, None (every room) when not given'''
+    if not rooms:
+        return None
+    try:
+        return sorted({int(room) for room in rooms.split(",")})
+    except ValueError:
+        raise BadRequest("rooms must be a comma separated list of room numbers")
+
+def parsePage(limit : str | None, after : str | None, keys : int, config : Mapping) -> tuple[int, tuple | None] | None:
+    '''?limit=n&after=cursor of a keyset paginated listing to (limit, keyset values after which the page starts).
+    Cursors are ddmmyy:HHMM followed by `keys` - 2 integers. None when the listing isn't paginated.'''
+    if not (limit or after):
+        return None
+    try:
+        limit = int(limit) if limit else config["MAX_PAGE_SIZE"]
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+    if not (1 <= limit <= config["MAX_PAGE_SIZE"]):
+        raise BadRequest(f"limit must be between 1 and {config['MAX_PAGE_SIZE']}")
+
+    if after:
+        parts = after.split(":")
+        try:
+            if len(parts) != keys:
+                raise ValueError
+            after = (datetime.strptime(parts[0], "%d%m%y").date(), datetime.strptime(parts[1], "%H%M").time(), *map(int, parts[2:]))
+        except ValueError:
+            raise BadRequest("Invalid cursor, pass on the one from the previous page's Link header as it is")
+    return limit, after or None
+
+def parseBookingDetails(bookingData : Any, config : Mapping, path : str) -> tuple[date, time, str, str, str, str]:
+    '''JSON body of POST /book and /enqueue to (date, time, number, email, name, passkey)'''
+    try:
+        booking_date = bookingData["date"]
+        booking_time = bookingData["time"]
+        holder_num = bookingData["number"]
+        holder_email = bookingData["email"]
+        holder_name = bookingData["name"]
+        holder_passkey = bookingData["passkey"]
+
+        if not validateDetails(holder_num, holder_email, holder_passkey):
+            raise BadRequest("Invalid formaat for holder details")
+
+        booking_time = parseSlotTime(booking_time, config)
+        booking_date = checkBookableDate(datetime.strptime(booking_date, "%d%m%y").date(), config)
+
+    except (KeyError, TypeError) as e:
+        raise BadRequest(f"Mandatory field missing in JSON body of request sent to {path}")
+    except ValueError as e:
+        raise BadRequest(f"Invalid data sent to POST {path}")
+
+    return booking_date, booking_time, holder_num, holder_email, holder_name, holder_passkey
+
+def parseBatchBooking(bookingData : Any, config : Mapping, path : str) -> tuple[list[tuple[int, date, time]], str, str, str, str]:
+    '''JSON body of POST /book/batch to ([(room, date, time), ...], number, email, name, passkey).
+    Items come back in the order they were sent, the response lists them in that order too.'''
+    try:
+        items = bookingData["items"]
+        holder_num = bookingData["number"]
+        holder_email = bookingData["email"]
+        holder_name = bookingData["name"]
+        holder_passkey = bookingData["passkey"]
+
+        if not validateDetails(holder_num, holder_email, holder_passkey):
+            raise BadRequest("Invalid formaat for holder details")
+        if not isinstance(items, list) or not (1 <= len(items) <= config["MAX_BATCH_SIZE"]):
+            raise BadRequest(f"items must be a list of 1 to {config['MAX_BATCH_SIZE']} slots")
+
+        slots = [(int(item["room"]),
+                  checkBookableDate(datetime.strptime(item["date"], "%d%m%y").date(), config),
+                  parseSlotTime(item["time"], config)) for item in items]
+        if len(set(slots)) != len(slots):
+            raise BadRequest("Each slot can only appear once in a batch")
+
+    except (KeyError, TypeError) as e:
+        raise BadRequest(f"Mandatory field missing in JSON body of request sent to {path}")
+    except ValueError as e:
+        raise BadRequest(f"Invalid data sent to POST {path}")
+
+    return slots, holder_num, holder_email, holder_name, holder_passkey
+
+
+def checkJSONMimetype(mimetype : str, method : str, path : str) -> None:
+    if mimetype.split("/")[-1].lower() != "json":
+        raise BadRequest(f"{method} {path} expects JSON body")
 
 ### Decorators ###
 def enforce_JSON(endpoint):
     @wraps(endpoint)
     def decorated(*args, **kwargs):
-        if request.mimetype.split("/")[-1].lower() != "json":
-            raise BadRequest(f"{request.method} {request.root_path} expects JSON body")
+        checkJSONMimetype(request.mimetype, request.method, request.root_path)
         return endpoint(*args, **kwargs)
     return decorated
 
@@ -0,0 +1,216 @@
+'''In-process availability index, answers the no-filter `/rooms/<room_id>/slots` query without touching the database'''
+from array import array
+from datetime import date, time, timedelta
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic
+from typing import Callable, Iterable
+
+SlotRow = tuple[int, date, time, bool, int, str | None]     # (room, date, time_slot, booked, queue_length, holder)
+
+class AvailabilityIndex:
+    '''Bitsets of slot existence and bookings per (room, day), one byte of queue length per (room, day, hour).
+
+    Covers `windowSize` days starting today, the same window getRoomDetails uses when no filters are given. It is
+    built on the first read that needs it, not when the app starts, and rebuilt when the date rolls over.
+
+    Every read brings the room's slotver:<room> counter (one Redis round trip) and the room's rows get reloaded when
+    it differs from the one they were loaded under, so writes by other workers show up on the next read. Writes made
+    by this process are applied in place after they commit, along with the counter value their bump returned.
+    Without a counter (no Redis, or it's down) a room is reloaded once its rows are older than `maxAge` seconds.
+
+    Answers are tagged with a hash of what the index holds for the room, so workers holding the same rows hand out
+    the same tag and ones holding different rows never do.
+    '''
+    HOURS = 24
+
+    def __init__(self, windowSize : int, maxAge : float = 30):
+        self.windowSize = windowSize
+        self.maxAge = maxAge
+
+        self._lock = Lock()
+        self._windowStart : date | None = None
+        self._loadedAt : float = 0
+        self._roomIndex : dict[int, int] = {}
+        self._exists : array = array('L')         # bit h set => slot at hour h exists
+        self._booked : array = array('L')         # bit h set => slot at hour h is booked
+        self._queue : array = array('B')          # queue length per hour, clamped to 255
+        self._holders : dict[int, str] = {}       # sparse, only booked slots have holders
+        self._versions : dict[int, int] = {}      # slotver:<room> each room's rows are known to be as new as
+        self._roomLoadedAt : dict[int, float] = {}
+        self._rendered : dict[int, tuple[str, list[dict]]] = {}     # snapshot() per room, dropped when the room changes
+
+    def isStale(self, today : date) -> bool:
+        '''The whole index needs (re)building'''
+        return self._windowStart != today or not self._loadedAt
+
+    def roomIsStale(self, room_id : int, version : int | None) -> bool:
+        '''room_id's rows need reloading, `version` is its slotver:<room> counter or None if that couldn't be read'''
+        if version is None:
+            return (monotonic() - self._roomLoadedAt.get(room_id, self._loadedAt)) > self.maxAge
+        return self._versions.get(room_id) != version
+
+    def ensureFresh(self, today : date, loader : Callable[..., Iterable[SlotRow]], room_id : int | None = None, version : int | None = None) -> None:
+        '''Rebuild from `loader(windowStart, windowEnd)` if the index is stale, then reload room_id's rows from
+        `loader(windowStart, windowEnd, room_id)` if they are. windowEnd is exclusive. Read `version` before calling,
+        so it is never newer than the rows loaded under it.'''
+        windowEnd = today + timedelta(days=self.windowSize)
+        if self.isStale(today):
+            with self._lock:
+                if self.isStale(today):            # Another thread may have beaten us to it
+                    self._load(today, loader(today, windowEnd))
+                    if room_id is not None and version is not None:
+                        self._versions[room_id] = version
+        if room_id is not None and self.roomIsStale(room_id, version):
+            with self._lock:
+                if self.roomIsStale(room_id, version):
+                    self._loadRoom(room_id, version, loader(today, windowEnd, room_id))
+
+    def _load(self, today : date, rows : Iterable[SlotRow]) -> None:
+        rows = list(rows)
+        roomIndex = {room : i for i, room in enumerate(sorted({row[0] for row in rows}))}
+
+        cells = len(roomIndex) * self.windowSize
+        exists = array('L', bytes(array('L').itemsize * cells))
+        booked = array('L', bytes(array('L').itemsize * cells))
+        queue = array('B', bytes(cells * self.HOURS))
+        holders = {}
+
+        for room, slotDate, slotTime, isBooked, qLen, holder in rows:
+            day = (slotDate - today).days
+            if not (0 <= day < self.windowSize):
+                continue
+            cell = roomIndex[room] * self.windowSize + day
+            bit = 1 << slotTime.hour
+            exists[cell] |= bit
+            if isBooked:
+                booked[cell] |= bit
+            queue[cell * self.HOURS + slotTime.hour] = min(qLen or 0, 255)
+            if holder is not None:
+                holders[cell * self.HOURS + slotTime.hour] = holder
+
+        self._roomIndex, self._exists, self._booked, self._queue, self._holders = roomIndex, exists, booked, queue, holders
+        self._windowStart = today
+        self._loadedAt = monotonic()
+        self._versions, self._roomLoadedAt, self._rendered = {}, {}, {}
+
+    def _loadRoom(self, room_id : int, version : int | None, rows : Iterable[SlotRow]) -> None:
+        rows = list(rows)
+        roomPos = self._roomIndex.get(room_id)
+        if roomPos is None:
+            if rows:
+                self._loadedAt = 0          # A room with its first slots, it needs a place in the arrays: rebuild next read
+            return
+
+        self._rendered.pop(room_id, None)
+        first, last = roomPos * self.windowSize, (roomPos + 1) * self.windowSize
+        for cell in range(first, last):
+            self._exists[cell] = self._booked[cell] = 0
+        for position in range(first * self.HOURS, last * self.HOURS):
+            self._queue[position] = 0
+            self._holders.pop(position, None)
+
+        for room, slotDate, slotTime, isBooked, qLen, holder in rows:
+            day = (slotDate - self._windowStart).days
+            if room != room_id or not (0 <= day < self.windowSize):
+                continue
+            cell = first + day
+            bit = 1 << slotTime.hour
+            self._exists[cell] |= bit
+            if isBooked:
+                self._booked[cell] |= bit
+            self._queue[cell * self.HOURS + slotTime.hour] = min(qLen or 0, 255)
+            if holder is not None:
+                self._holders[cell * self.HOURS + slotTime.hour] = holder
+
+        if version is not None:
+            self._versions[room_id] = version
+        self._roomLoadedAt[room_id] = monotonic()
+
+    def snapshot(self, room_id : int) -> tuple[str, list[dict]] | None:
+        '''(etag, getRoom) for room_id, read together. None if the room is not indexed. The rows are shared between
+        callers until the room changes, don't modify them.'''
+        with self._lock:
+            roomPos = self._roomIndex.get(room_id)
+            if roomPos is None or self._windowStart is None:
+                return None
+            rendered = self._rendered.get(room_id)
+            if rendered is None:
+                rendered = self._rendered[room_id] = (self._digest(roomPos), self._rows(roomPos))
+            return rendered
+
+    def getRoom(self, room_id : int) -> list[dict] | None:
+        '''Slots for room_id in the window, shaped like Slot.__CustomDict__(). None if the room is not indexed.'''
+        snapshot = self.snapshot(room_id)
+        return snapshot[1] if snapshot else None
+
+    def etag(self, room_id : int) -> str | None:
+        '''Version part of getRoom(room_id)'s ETag, a digest of the room's cells. None if the room isn't indexed.'''
+        snapshot = self.snapshot(room_id)
+        return snapshot[0] if snapshot else None
+
+    def _rows(self, roomPos : int) -> list[dict]:
+        result = []
+        for day in range(self.windowSize):
+            cell = roomPos * self.windowSize + day
+            exists = self._exists[cell]
+            if not exists:
+                continue
+            dateStr = (self._windowStart + timedelta(days=day)).strftime("%d%m%Y")
+            booked = self._booked[cell]
+            for hour in range(self.HOURS):
+                bit = 1 << hour
+                if not exists & bit:
+                    continue
+                result.append({"time" : f"{hour:02d}:00",
+                               "date" : dateStr,
+                               "booked" : bool(booked & bit),
+                               "qLen" : self._queue[cell * self.HOURS + hour],
+                               "holder" : self._holders.get(cell * self.HOURS + hour)})
+        return result
+
+    def applySlot(self, room : int, slotDate : date, slotTime : time, isBooked : bool, qLen : int, holder : str | None, version : int | None = None) -> None:
+        '''Mirror a committed write to a slot, `version` is what bumping slotver:<room> for it returned. Slots outside
+        the window or for unknown rooms are ignored, the next reload picks them up.'''
+        with self._lock:
+            roomPos = self._roomIndex.get(room)
+            if roomPos is None or self._windowStart is None:
+                return
+            day = (slotDate - self._windowStart).days
+            if not (0 <= day < self.windowSize):
+                return
+
+            cell = roomPos * self.windowSize + day
+            bit = 1 << slotTime.hour
+            self._rendered.pop(room, None)
+            self._exists[cell] |= bit
+            if isBooked:
+                self._booked[cell] |= bit
+            else:
+                self._booked[cell] &= ~bit
+            self._queue[cell * self.HOURS + slotTime.hour] = min(qLen, 255)
+            if holder is None:
+                self._holders.pop(cell * self.HOURS + slotTime.hour, None)
+            else:
+                self._holders[cell * self.HOURS + slotTime.hour] = holder
+            # Only a bump straight after the version the rows are at makes them current, anything else means
+            # another worker wrote in between and the next read reloads the room
+            if version is not None and self._versions.get(room) == version - 1:
+                self._versions[room] = version
+
+    def _digest(self, roomPos : int) -> str:
+        '''Hash of the room's cells, the same rows give the same tag in every worker'''
+        first, last = roomPos * self.windowSize, (roomPos + 1) * self.windowSize
+        digest = blake2b(digest_size=12)
+        digest.update(self._exists[first:last].tobytes())
+        digest.update(self._booked[first:last].tobytes())
+        digest.update(self._queue[first * self.HOURS:last * self.HOURS].tobytes())
+        for position in range(first * self.HOURS, last * self.HOURS):
+            holder = self._holders.get(position)
+            if holder is not None:
+                digest.update(f"{position}={holder}\0".encode())
+        return "i" + digest.hexdigest()
+
+    def invalidate(self) -> None:
+        '''Force a reload on next use'''
+        self._loadedAt = 0
@@ -0,0 +1,118 @@
+'''Cache key formats and version counters, shared by routes.py and the automations so they agree on what goes where'''
+from datetime import date, time
+from hashlib import blake2b
+from time import time as epoch
+
+from service.auxillary_modules.redismanager import RedisManager
+
+SLOTS_TTL = 300                     # Slot listings, safe to keep long since writes bump the version
+VERSION_TTL = 14 * 24 * 60 * 60     # Per-date version counters, long after every listing cached under them has expired
+
+SLOTS_GENERATION_KEY = "slotver"      # Bumped with every slot write anywhere, grids and occupancy are cached under it
+
+def slotsVersionKey(room_id : int, slotDate : date | None = None) -> str:
+    '''Per-room counter for listings without a date filter, per-(room, date) counter for the rest'''
+    if slotDate is None:
+        return f"slotver:{room_id}"
+    return f"slotver:{room_id}:{slotDate.strftime('%d%m%y')}"
+
+def slotsKey(room_id : int, version : int, slotDate : date | None, slotTime : time | None) -> str:
+    '''Key for a getRoomDetails result. Dates and times are normalised so every spelling of a query shares one entry.'''
+    return "{room}:v{version}:{date}:{time}".format(room=room_id,
+                                                    version=version,
+                                                    date=slotDate.strftime("%d%m%y") if slotDate else None,
+                                                    time=slotTime.strftime("%H%M") if slotTime else None)
+
+def parseVersion(version : bytes | None) -> int:
+    return int(version) if version else 0
+
+def slotsVersionReadCommands(room_id : int | None, slotDate : date | None = None) -> list[tuple]:
+    '''Read a version counter (the global generation for room_id None), creating it at 0 if it doesn't exist yet.
+    The GET then only comes back empty when Redis failed, see parseVersionRead.'''
+    key = slotsVersionKey(room_id, slotDate) if room_id is not None else SLOTS_GENERATION_KEY
+    create = ("SET", key, 0, "NX", "EX", VERSION_TTL) if slotDate else ("SET", key, 0, "NX")
+    return [create, ("GET", key)]
+
+def parseVersionRead(results : list) -> int | None:
+    '''Version out of the slotsVersionReadCommands (or bookingsVersionReadCommands) results, None if it couldn't be read'''
+    return int(results[-1]) if results and results[-1] is not None else None
+
+def readSlotsVersion(manager : RedisManager | None, room_id : int | None, slotDate : date | None = None) -> int | None:
+    if not manager:
+        return None
+    return parseVersionRead(manager.safe_pipeline(slotsVersionReadCommands(room_id, slotDate)))
+
+def slotsETag(room_id : int, version : int | str, slotDate : date | None, slotTime : time | None, windowStart : date) -> str:
+    '''Strong validator for a getRoomDetails answer, unquoted. The window listing moves with the date, so its start
+    is part of it. Rolling over every SLOTS_TTL seconds means a bump lost to a Redis hiccup can't pin stale
+    content on a client for longer than it could stay in the cache.'''
+    return "{room}-{version}-{date}-{time}-{bucket}".format(room=room_id,
+                                                            version=version,
+                                                            date=slotDate.strftime("%d%m%y") if slotDate else "w" + windowStart.strftime("%d%m%y"),
+                                                            time=slotTime.strftime("%H%M") if slotTime else "all",
+                                                            bucket=int(epoch() // SLOTS_TTL))
+
+def _roomsTag(rooms : list[int] | None) -> str:
+    '''"all", or a short hash of a room subset, a long id list would blow past CACHE_MAX_KEY_BYTES'''
+    if rooms is None:
+        return "all"
+    return blake2b(",".join(map(str, sorted(set(rooms)))).encode(), digest_size=8).hexdigest()
+
+def gridKey(generation : int, start : date, end : date, rooms : list[int] | None) -> str:
+    '''Key for a getAvailability grid. Any slot write anywhere bumps the generation, so grids are invalidated as a unit.'''
+    return f"grid:v{generation}:{start.strftime('%d%m%y')}:{end.strftime('%d%m%y')}:{_roomsTag(rooms)}"
+
+def gridETag(generation : int, start : date, end : date, rooms : list[int] | None) -> str:
+    '''Validator for a getAvailability grid, rolls over with the same SLOTS_TTL bucket as slotsETag'''
+    return f"grid-{generation}-{start.strftime('%d%m%y')}-{end.strftime('%d%m%y')}-{_roomsTag(rooms)}-{int(epoch() // SLOTS_TTL)}"
+
+def occupancyWindow(ttl : int) -> int:
+    '''Number of the current `ttl` second window, getOccupancy answers are cached and tagged per window'''
+    return int(epoch() // ttl)
+
+def occupancyKey(window : int, rooms : list[int] | None) -> str:
+    '''Key for a getOccupancy answer. Not under the global generation: every booking anywhere bumps that, so under
+    load the entry would hardly ever be read before it moved on.'''
+    return f"occ:w{window}:{_roomsTag(rooms)}"
+
+def occupancyETag(window : int, rooms : list[int] | None) -> str:
+    return f"occ-{window}-{_roomsTag(rooms)}"
+
+def slotsBumpCommands(room_id : int, slotDate : date) -> list[tuple]:
+    '''Send after a write to any slot of room_id on slotDate has committed.
+
+    Listings filtered to another date keep their entries, anything that could include slotDate moves to a new key.
+    Entries under the old version are never read again and fall out with their TTL.
+    '''
+    return [("INCR", SLOTS_GENERATION_KEY),
+            ("INCR", slotsVersionKey(room_id)),
+            ("INCR", slotsVersionKey(room_id, slotDate)),
+            ("EXPIRE", slotsVersionKey(room_id, slotDate), VERSION_TTL)]
+
+BOOKINGS_TTL = 300
+BOOKINGS_NEGATIVE_TTL = 60          # "No bookings" is cached too, people poll before they have booked anything
+
+def bookingsVersionKey(identity : str) -> str:
+    return f"bkngver:{identity}"
+
+def bookingsKey(identity : str, version : int) -> str:
+    '''Key for a getBookings result, identity is either the phone number or the email address'''
+    return f"bkng:{identity}:v{version}"
+
+def bookingsVersionReadCommands(identity : str) -> list[tuple]:
+    '''Like slotsVersionReadCommands: created at 0 if missing, so an empty GET means Redis failed, not "never bumped"'''
+    key = bookingsVersionKey(identity)
+    return [("SET", key, 0, "NX", "EX", VERSION_TTL), ("GET", key)]
+
+def readBookingsVersion(manager : RedisManager | None, identity : str) -> int | None:
+    if not manager:
+        return None
+    return parseVersionRead(manager.safe_pipeline(bookingsVersionReadCommands(identity)))
+
+def bookingsBumpCommands(*identities : str) -> list[tuple]:
+    '''Send after a write that changes the bookings of these identities has committed. Pass both phone and email, either can be queried.'''
+    commands = []
+    for identity in set(identities):
+        commands.append(("INCR", bookingsVersionKey(identity)))
+        commands.append(("EXPIRE", bookingsVersionKey(identity), VERSION_TTL))
+    return commands
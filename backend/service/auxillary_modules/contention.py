@@ -0,0 +1,57 @@
+'''Lock contention: spotting lock-not-available errors and stale versions, jittered backoff between retries, and counters for all of it'''
+import random
+from threading import Lock
+
+LOCK_NOT_AVAILABLE = "55P03"        # Postgres SQLSTATE raised by FOR UPDATE NOWAIT
+
+def isLockConflict(e : BaseException) -> bool:
+    '''True for NOWAIT lock failures (Postgres, psycopg2 or asyncpg) and SQLite's busy database'''
+    orig = getattr(e, "orig", e)
+    return getattr(orig, "pgcode", None) == LOCK_NOT_AVAILABLE or "database is locked" in str(orig)
+
+def backoffDelay(attempt : int, base : float, cap : float) -> float:
+    '''Full jitter: anywhere between 0 and base * 2^attempt (at most cap) seconds, so retrying clients spread out'''
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class ContentionStats:
+    '''Process-wide counters, updated by the booking endpoints'''
+    def __init__(self):
+        self.lockConflicts = 0          # Lock attempts that found the row taken
+        self.retries = 0                # Attempts made after a conflict
+        self.retriesExhausted = 0       # Requests that gave up and answered 503
+        self.lockWaitSeconds = 0.0      # Time spent between the first conflict and getting (or giving up on) the lock
+        self.suggestions = 0            # Responses that carried alternative slots
+        self.versionConflicts = 0       # Optimistic writes that found the slot's version had moved on
+        self._lock = Lock()
+
+    def recordConflict(self, retried : bool) -> None:
+        with self._lock:
+            self.lockConflicts += 1
+            if retried:
+                self.retries += 1
+            else:
+                self.retriesExhausted += 1
+
+    def recordVersionConflict(self, retried : bool) -> None:
+        with self._lock:
+            self.versionConflicts += 1
+            if retried:
+                self.retries += 1
+            else:
+                self.retriesExhausted += 1
+
+    def recordWait(self, seconds : float) -> None:
+        with self._lock:
+            self.lockWaitSeconds += seconds
+
+    def recordSuggestion(self) -> None:
+        with self._lock:
+            self.suggestions += 1
+
+    def getStats(self) -> dict:
+        return {"lock_conflicts" : self.lockConflicts,
+                "retries" : self.retries,
+                "retries_exhausted" : self.retriesExhausted,
+                "lock_wait_seconds" : round(self.lockWaitSeconds, 6),
+                "suggestions" : self.suggestions,
+                "version_conflicts" : self.versionConflicts}
@@ -0,0 +1,172 @@
+'''Queue change notifications for the Server-Sent Event streams.
+
+Handlers publish after their commit, every stream subscribed to one of the event's channels gets it. With Redis
+the events go through pub/sub so every worker sees every change (one listener connection per process fans them out
+locally), without Redis they only reach streams served by the same process.
+'''
+import asyncio
+from collections import deque
+from itertools import zip_longest
+from datetime import date, time
+from threading import Condition, Event as Flag, Lock, Thread
+from time import sleep
+from typing import Iterable
+
+from service.auxillary_modules.redismanager import RedisManager
+
+Event = tuple[str, bytes]       # (channel, JSON payload)
+RESYNC : Event = ("", b"")      # Delivered when events may have been lost, streams tell their client to refetch
+
+CHANNEL_PREFIX = "libq:"
+
+def identityChannel(identity : str) -> str:
+    return f"{CHANNEL_PREFIX}party:{identity}"
+
+def slotChannel(room_id : int, slotDate : date, slotTime : time) -> str:
+    return f"{CHANNEL_PREFIX}slot:{room_id}:{slotDate.strftime('%d%m%y')}:{slotTime.strftime('%H%M')}"
+
+def sseFrame(event : str, data : bytes) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+
+class Subscription:
+    '''Mailbox of one stream. Bounded, a reader that falls behind loses its oldest events and never slows a publisher down.
+    Every event carries absolute state (queue position, slot counts), so the newest ones are the ones worth keeping.'''
+    def __init__(self, channels : Iterable[str], maxsize : int, loop : asyncio.AbstractEventLoop | None = None):
+        self.channels = tuple(channels)
+        self.dropped = 0
+        self._events : deque[Event] = deque(maxlen=maxsize)
+        self._ready = Condition()
+        self._loop = loop                                       # Set for streams served by asgi.py
+        self._wakeup = asyncio.Event() if loop else None
+
+    def deliver(self, event : Event) -> None:
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._ready.notify()
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get(self, timeout : float) -> Event | None:
+        '''Next event, None if nothing arrived within timeout'''
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+    async def aget(self, timeout : float) -> Event | None:
+        self._wakeup.clear()            # Cleared before looking, so a delivery in between still wakes us
+        if not self._events:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+        with self._ready:
+            return self._events.popleft() if self._events else None
+
+class EventBroker:
+    '''In-process fan-out, also the local half of RedisEventBroker'''
+    viaRedis = False
+
+    def __init__(self, mailboxSize : int = 64):
+        self.mailboxSize = mailboxSize
+        self._lock = Lock()
+        self._subscribers : dict[str, set[Subscription]] = {}
+
+    def subscribe(self, channels : Iterable[str], loop : asyncio.AbstractEventLoop | None = None) -> Subscription:
+        subscription = Subscription(channels, self.mailboxSize, loop)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription : Subscription) -> None:
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    @property
+    def streams(self) -> int:
+        with self._lock:
+            return len({subscription for subscribers in self._subscribers.values() for subscription in subscribers})
+
+    def deliver(self, events : Iterable[Event]) -> None:
+        '''Hand events to the local subscribers of their channels'''
+        for channel, payload in events:
+            with self._lock:
+                subscribers = tuple(self._subscribers.get(channel, ()))
+            for subscription in subscribers:
+                subscription.deliver((channel, payload))
+
+    def resync(self) -> None:
+        with self._lock:
+            subscribers = {subscription for subscribers in self._subscribers.values() for subscription in subscribers}
+        for subscription in subscribers:
+            subscription.deliver(RESYNC)
+
+    def commands(self, events : list[Event]) -> list[tuple]:
+        '''Redis commands that publish `events`, for handlers that pipeline them with their version bumps'''
+        return []
+
+    def published(self, events : list[Event], results : list) -> None:
+        '''Deliver locally whatever `results` (of commands(events)) shows didn't go out, all of it for the in-process broker'''
+        self.deliver(event for event, result in zip_longest(events, results) if result is None)
+
+    def publish(self, events : list[Event]) -> None:
+        self.deliver(events)
+
+class RedisEventBroker(EventBroker):
+    '''Publishes with PUBLISH (one pipeline per write), a daemon thread PSUBSCRIBEd to every queue channel delivers
+    locally. Anything Redis couldn't take is delivered locally right away, so same-process streams never miss it.'''
+    viaRedis = True
+
+    def __init__(self, manager : RedisManager, mailboxSize : int = 64, pollInterval : float = 1):
+        super().__init__(mailboxSize)
+        self.manager = manager
+        self.pollInterval = pollInterval
+        self._listener : Thread | None = None
+        self._startLock = Lock()
+        self._listening = Flag()
+
+    def subscribe(self, channels : Iterable[str], loop : asyncio.AbstractEventLoop | None = None) -> Subscription:
+        if self._listener is None:
+            with self._startLock:
+                if self._listener is None:          # Processes that never stream never hold a pub/sub connection
+                    self._listener = Thread(target=self._listen, name="queue-events", daemon=True)
+                    self._listener.start()
+        if not self._listening.is_set():
+            self._listening.wait(self.pollInterval)     # Don't hand out a stream that would miss the first events
+        return super().subscribe(channels, loop)
+
+    def commands(self, events : list[Event]) -> list[tuple]:
+        return [("PUBLISH", channel, payload) for channel, payload in events]
+
+    def publish(self, events : list[Event]) -> None:
+        self.published(events, self.manager.safe_pipeline(self.commands(events)))
+
+    def _listen(self) -> None:
+        pubsub = None
+        while True:
+            try:
+                pubsub = self.manager.pubsub()
+                pubsub.psubscribe(CHANNEL_PREFIX + "*")
+                if self._listening.is_set():
+                    self.resync()           # Whatever was published while we were away is gone
+                self._listening.set()
+                while True:
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=self.pollInterval)
+                    if message and message["type"] == "pmessage":
+                        self.deliver([(message["channel"].decode(), message["data"])])
+            except Exception as e:
+                print(f"Queue event listener lost its Redis connection, retrying: {e}")
+                try:
+                    if pubsub:
+                        pubsub.close()
+                except Exception:
+                    pass
+                sleep(self.pollInterval)
@@ -0,0 +1,177 @@
+'''Request, database, Redis and cache instrumentation, rendered in the Prometheus text format'''
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Iterable
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+class Histogram:
+    '''Cumulative-bucket histogram, one per label set'''
+    def __init__(self, buckets : Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value : float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name : str, labels : str) -> list[str]:
+        sep = "," if labels else ""
+        suffix = f"{{{labels}}}" if labels else ""
+        lines, running = [], 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            running += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {running}')
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+class RequestTally:
+    '''What one request spent, filled in by the engine and Redis hooks while it runs'''
+    __slots__ = ("started", "dbStatements", "dbSeconds", "redisCalls", "redisSeconds")
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.dbStatements = 0
+        self.dbSeconds = 0.0
+        self.redisCalls = 0
+        self.redisSeconds = 0.0
+
+    def serverTiming(self) -> str:
+        '''Server-Timing header value, durations in ms'''
+        return (f'db;dur={self.dbSeconds * 1000:.2f};desc="{self.dbStatements} statements", '
+                f'redis;dur={self.redisSeconds * 1000:.2f};desc="{self.redisCalls} calls", '
+                f"total;dur={(perf_counter() - self.started) * 1000:.2f}")
+
+def _labels(**labels : str) -> str:
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for key, value in labels.items())
+
+class Metrics:
+    '''Process-wide. The current request's tally lives in a ContextVar so Flask's threads and the ASGI tasks each see their own.'''
+    def __init__(self):
+        self._lock = Lock()
+        self._current : ContextVar[RequestTally | None] = ContextVar("requestTally", default=None)
+        self.requests : dict[tuple, int] = {}                   # (endpoint, method, status) -> count
+        self.latency : dict[tuple, Histogram] = {}              # (endpoint, method) -> seconds
+        self.requestStatements : dict[str, Histogram] = {}      # endpoint -> SQL statements per request
+        self.requestDbSeconds : dict[str, Histogram] = {}       # endpoint -> DB time per request
+        self.dbStatements = 0
+        self.dbSeconds = 0.0
+        self.redisCalls : dict[str, int] = {}                   # command -> count
+        self.redisLatency = Histogram(LATENCY_BUCKETS)
+        self.cacheLookups : dict[tuple, int] = {}               # (endpoint, hit | miss | index) -> count
+
+    # Hooks
+    def startRequest(self) -> RequestTally:
+        tally = RequestTally()
+        self._current.set(tally)
+        return tally
+
+    def finishRequest(self, endpoint : str, method : str, status : int) -> RequestTally | None:
+        tally = self._current.get()
+        if tally is None:
+            return None
+        self._current.set(None)
+        elapsed = perf_counter() - tally.started
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault((endpoint, method), Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.requestStatements.setdefault(endpoint, Histogram(COUNT_BUCKETS)).observe(tally.dbStatements)
+            self.requestDbSeconds.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(tally.dbSeconds)
+        return tally
+
+    def observeStatement(self, seconds : float) -> None:
+        tally = self._current.get()
+        if tally is not None:
+            tally.dbStatements += 1
+            tally.dbSeconds += seconds
+        with self._lock:
+            self.dbStatements += 1
+            self.dbSeconds += seconds
+
+    def observeRedis(self, command : str, seconds : float) -> None:
+        tally = self._current.get()
+        if tally is not None:
+            tally.redisCalls += 1
+            tally.redisSeconds += seconds
+        with self._lock:
+            self.redisCalls[command] = self.redisCalls.get(command, 0) + 1
+            self.redisLatency.observe(seconds)
+
+    def recordCacheLookup(self, endpoint : str, result : str) -> None:
+        with self._lock:
+            key = (endpoint, result)
+            self.cacheLookups[key] = self.cacheLookups.get(key, 0) + 1
+
+    def cacheHitRatio(self, endpoint : str) -> float:
+        lookups = {result : count for (name, result), count in self.cacheLookups.items() if name == endpoint}
+        total = sum(lookups.values())
+        return (total - lookups.get("miss", 0)) / total if total else 0.0
+
+    def instrumentEngines(self) -> None:
+        '''Count and time every statement of every engine, sync and async (asyncpg/aiosqlite run through a sync Engine too)'''
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        def before(conn, cursor, statement, parameters, context, executemany):
+            context._metricsStart = perf_counter()
+
+        def after(conn, cursor, statement, parameters, context, executemany):
+            self.observeStatement(perf_counter() - context._metricsStart)
+
+        if not event.contains(Engine, "before_cursor_execute", before):
+            event.listen(Engine, "before_cursor_execute", before)
+            event.listen(Engine, "after_cursor_execute", after)
+
+    # Exposition
+    def render(self, counters : dict[str, float] = {}, gauges : dict[str, float] = {}) -> str:
+        '''Prometheus text format. `counters` and `gauges` are extra unlabelled series (contention, cache stats) from the caller.'''
+        out = []
+        with self._lock:
+            out += ["# HELP library_requests_total Requests served, by endpoint, method and status",
+                    "# TYPE library_requests_total counter"]
+            out += [f"library_requests_total{{{_labels(endpoint=e, method=m, status=s)}}} {n}" for (e, m, s), n in sorted(self.requests.items())]
+
+            out += ["# HELP library_request_duration_seconds Request latency",
+                    "# TYPE library_request_duration_seconds histogram"]
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                out += histogram.lines("library_request_duration_seconds", _labels(endpoint=endpoint, method=method))
+
+            out += ["# HELP library_request_db_statements SQL statements per request",
+                    "# TYPE library_request_db_statements histogram"]
+            for endpoint, histogram in sorted(self.requestStatements.items()):
+                out += histogram.lines("library_request_db_statements", _labels(endpoint=endpoint))
+
+            out += ["# HELP library_request_db_seconds Cumulative database time per request",
+                    "# TYPE library_request_db_seconds histogram"]
+            for endpoint, histogram in sorted(self.requestDbSeconds.items()):
+                out += histogram.lines("library_request_db_seconds", _labels(endpoint=endpoint))
+
+            out += ["# TYPE library_db_statements_total counter", f"library_db_statements_total {self.dbStatements}",
+                    "# TYPE library_db_seconds_total counter", f"library_db_seconds_total {self.dbSeconds}"]
+
+            out += ["# HELP library_redis_calls_total Redis round trips, a pipeline counts once",
+                    "# TYPE library_redis_calls_total counter"]
+            out += [f"library_redis_calls_total{{{_labels(command=c)}}} {n}" for c, n in sorted(self.redisCalls.items())]
+            out += ["# TYPE library_redis_call_seconds histogram"]
+            out += self.redisLatency.lines("library_redis_call_seconds", "")
+
+            out += ["# HELP library_cache_lookups_total Listing cache lookups: hit, miss, or answered by the availability index",
+                    "# TYPE library_cache_lookups_total counter"]
+            out += [f"library_cache_lookups_total{{{_labels(endpoint=e, result=r)}}} {n}" for (e, r), n in sorted(self.cacheLookups.items())]
+            out += ["# TYPE library_cache_hit_ratio gauge"]
+            out += [f"library_cache_hit_ratio{{{_labels(endpoint=e)}}} {self.cacheHitRatio(e)}" for e in sorted({e for e, _ in self.cacheLookups})]
+
+        for name, value in counters.items():
+            out += [f"# TYPE {name} counter", f"{name} {value}"]
+        for name, value in gauges.items():
+            out += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(out) + "\n"
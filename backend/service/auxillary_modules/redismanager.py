@@ -1,20 +1,233 @@
-from redis import Redis
+from redis import Redis, ConnectionPool
+from redis.client import PubSub
+from redis.asyncio import Redis as AsyncRedis, ConnectionPool as AsyncConnectionPool
 from redis.typing import ResponseT
 
+from threading import Lock
+from time import monotonic, perf_counter
 from traceback import format_exc
+from typing import Any, Callable, Iterable
+
+class CircuitBreaker:
+    '''Opens after `threshold` consecutive failures and fast-fails everything for `cooldown` seconds.
+    After the cooldown one trial call is let through (half-open), its outcome closes or re-opens the breaker.'''
+    def __init__(self, threshold : int = 3, cooldown : float = 5):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.openedAt : float | None = None
+        self.trips = 0              # Number of times the breaker has opened
+        self.rejected = 0           # Calls fast-failed while open
+        self._lock = Lock()
+
+    @property
+    def isOpen(self) -> bool:
+        return self.openedAt is not None and (monotonic() - self.openedAt) < self.cooldown
+
+    def allow(self) -> bool:
+        if self.openedAt is None:
+            return True
+        with self._lock:
+            if (monotonic() - self.openedAt) < self.cooldown:
+                self.rejected += 1
+                return False
+            self.openedAt = monotonic()         # Half-open: this caller gets the trial, everyone else waits out another cooldown
+            return True
+
+    def recordSuccess(self) -> None:
+        self.failures = 0
+        self.openedAt = None
+
+    def recordFailure(self) -> bool:
+        '''Returns True if this failure tripped the breaker'''
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                tripped = self.openedAt is None
+                self.openedAt = monotonic()
+                self.trips += tripped
+                return tripped
+            return False
 
 class RedisManager:
-    '''Interface for Redis protocol, suppresses all errors, everything else remains the same'''
-    def __init__(self, host : str, port : int, **kwargs):
-        self._interface = Redis(host, port, **kwargs)
+    '''Interface for Redis protocol, suppresses all errors, everything else remains the same.
+
+    Connections come from an explicit pool with short socket timeouts, and a circuit breaker turns a dead Redis
+    into an immediate None instead of a timeout per call.
+    '''
+    observer : Callable[[str, float], None] | None = None      # Called with (command, seconds) after every round trip, see metrics.py
+
+    def __init__(self, host : str, port : int, maxConnections : int = 32, socketTimeout : float = 0.5,
+                 breakerThreshold : int = 3, breakerCooldown : float = 5, **kwargs):
+        self._pool = ConnectionPool(host=host, port=port,
+                                    max_connections=maxConnections,
+                                    socket_timeout=socketTimeout,
+                                    socket_connect_timeout=socketTimeout,
+                                    **kwargs)
+        self._interface = Redis(connection_pool=self._pool)
+        self.breaker = CircuitBreaker(breakerThreshold, breakerCooldown)
+
+    def _failed(self, e : Exception, what : str) -> None:
+        if self.breaker.recordFailure():
+            print(f"Redis circuit breaker opened for {self.breaker.cooldown}s after {self.breaker.failures} consecutive failures, last error: {e}")
+        else:
+            print(f"Silencing exception raied in Redis execution ({what}), details: {e}\n.{format_exc()}")
+
+    def ping(self) -> bool:
+        return bool(self.safe_execute_command("PING"))
+
+    def disconnect(self) -> None:
+        '''Close every pooled connection, the next command opens a fresh one'''
+        self._pool.disconnect()
 
     def safe_execute_command(self, command : str, returnBytes : bool = True, *args, **kwargs) -> ResponseT | bytes | None:
+        if not self.breaker.allow():
+            return None
+        start = perf_counter()
         try:
             _result : bytes | str | None = self._interface.execute_command(command, *args, **kwargs)
+            self.breaker.recordSuccess()
+            if isinstance(_result, str) and returnBytes:
+                return _result.encode('utf-8')
+            return _result
+
+        except Exception as e:
+            self._failed(e, command)
+            return None
+        finally:
+            if self.observer:
+                self.observer(command, perf_counter() - start)
+
+    def safe_pipeline(self, commands : Iterable[tuple], transaction : bool = False) -> list[Any]:
+        '''Send every (command, *args) tuple in one round trip. Returns one result per command, None where it failed.'''
+        commands = list(commands)
+        if not commands or not self.breaker.allow():
+            return [None] * len(commands)
+        start = perf_counter()
+        try:
+            pipe = self._interface.pipeline(transaction=transaction)
+            for command in commands:
+                pipe.execute_command(*command)
+            results = pipe.execute(raise_on_error=False)
+            self.breaker.recordSuccess()
+            return [None if isinstance(result, Exception) else result for result in results]
+
+        except Exception as e:
+            self._failed(e, "pipeline")
+            return [None] * len(commands)
+        finally:
+            if self.observer:
+                self.observer("PIPELINE", perf_counter() - start)
+
+    def pubsub(self) -> PubSub:
+        '''Dedicated pub/sub connection from the same pool. Not error suppressed, long lived listeners handle their own reconnects.'''
+        return self._interface.pubsub()
+
+    def safe_mget(self, *keys : str) -> list[bytes | None]:
+        if not keys:
+            return []
+        result = self.safe_execute_command("MGET", True, *keys)
+        return result if result is not None else [None] * len(keys)
+
+    def safe_setex_many(self, items : Iterable[tuple[str, int, bytes]]) -> int:
+        '''SETEX every (key, ttl, value) in one round trip, returns how many were written'''
+        results = self.safe_pipeline(("SETEX", key, ttl, value) for key, ttl, value in items)
+        return sum(1 for result in results if result)
+
+    def __bool__(self) -> bool:
+        return True
+
+class NullRedisManager(RedisManager):
+    '''Stand-in for when Redis is disabled. Every call is a no-op that looks like a miss, and the instance is falsy
+    so `if redisManager:` guards skip work entirely.'''
+    def __init__(self, *args, **kwargs):
+        self.breaker = CircuitBreaker()
+
+    def ping(self) -> bool:
+        return False
+
+    def disconnect(self) -> None:
+        pass
+
+    def safe_execute_command(self, command : str, returnBytes : bool = True, *args, **kwargs) -> None:
+        return None
+
+    def safe_pipeline(self, commands : Iterable[tuple], transaction : bool = False) -> list[None]:
+        return [None] * len(list(commands))
+
+    def safe_mget(self, *keys : str) -> list[None]:
+        return [None] * len(keys)
+
+    def safe_setex_many(self, items : Iterable[tuple[str, int, bytes]]) -> int:
+        return 0
+
+    def __bool__(self) -> bool:
+        return False
+
+class AsyncRedisManager:
+    '''redis.asyncio counterpart of RedisManager for the ASGI handlers: same pool limits, timeouts and
+    circuit breaker, same suppress-everything contract, every call awaited.'''
+    observer : Callable[[str, float], None] | None = None
+
+    def __init__(self, host : str, port : int, maxConnections : int = 32, socketTimeout : float = 0.5,
+                 breakerThreshold : int = 3, breakerCooldown : float = 5, **kwargs):
+        self._pool = AsyncConnectionPool(host=host, port=port,
+                                         max_connections=maxConnections,
+                                         socket_timeout=socketTimeout,
+                                         socket_connect_timeout=socketTimeout,
+                                         **kwargs)
+        self._interface = AsyncRedis(connection_pool=self._pool)
+        self.breaker = CircuitBreaker(breakerThreshold, breakerCooldown)
+
+    _failed = RedisManager._failed
+
+    async def ping(self) -> bool:
+        return bool(await self.safe_execute_command("PING"))
+
+    async def safe_execute_command(self, command : str, returnBytes : bool = True, *args, **kwargs) -> ResponseT | bytes | None:
+        if not self.breaker.allow():
+            return None
+        start = perf_counter()
+        try:
+            _result : bytes | str | None = await self._interface.execute_command(command, *args, **kwargs)
+            self.breaker.recordSuccess()
             if isinstance(_result, str) and returnBytes:
-                return _result.decode('utf-8')
+                return _result.encode('utf-8')
             return _result
 
         except Exception as e:
-            print(f"Silencing exception raied in Redis execution, details: {e}\n.{format_exc()}")
-            return None
\ No newline at end of file
+            self._failed(e, command)
+            return None
+        finally:
+            if self.observer:
+                self.observer(command, perf_counter() - start)
+
+    async def safe_pipeline(self, commands : Iterable[tuple], transaction : bool = False) -> list[Any]:
+        commands = list(commands)
+        if not commands or not self.breaker.allow():
+            return [None] * len(commands)
+        start = perf_counter()
+        try:
+            pipe = self._interface.pipeline(transaction=transaction)
+            for command in commands:
+                pipe.execute_command(*command)
+            results = await pipe.execute(raise_on_error=False)
+            self.breaker.recordSuccess()
+            return [None if isinstance(result, Exception) else result for result in results]
+
+        except Exception as e:
+            self._failed(e, "pipeline")
+            return [None] * len(commands)
+        finally:
+            if self.observer:
+                self.observer("PIPELINE", perf_counter() - start)
+
+    async def safe_mget(self, *keys : str) -> list[bytes | None]:
+        if not keys:
+            return []
+        result = await self.safe_execute_command("MGET", True, *keys)
+        return result if result is not None else [None] * len(keys)
+
+    async def close(self) -> None:
+        await self._interface.aclose()
+        await self._pool.aclose()
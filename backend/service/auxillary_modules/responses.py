@@ -0,0 +1,41 @@
+'''JSON in and out through orjson: a Flask JSON provider, and responses built straight from already-serialized bytes'''
+from typing import Any
+
+import orjson
+from flask import Response, current_app
+from flask.json.provider import JSONProvider
+
+JSON_MIMETYPE = "application/json"
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS       # The stdlib encoder turned int keys into strings too
+
+class ORJSONProvider(JSONProvider):
+    '''Backs jsonify, request.get_json and the error handlers with orjson. Output is compact and keeps insertion
+    order, the default provider sorted keys and pretty printed in debug mode.'''
+    def dumps(self, obj : Any, **kwargs : Any) -> str:
+        return orjson.dumps(obj, default=kwargs.get("default"), option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s : str | bytes, **kwargs : Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args : Any, **kwargs : Any) -> Response:
+        '''jsonify without the bytes -> str -> bytes round trip dumps() would need'''
+        return rawJSON(orjson.dumps(self._prepare_response_obj(args, kwargs), option=ORJSON_OPTIONS))
+
+def rawJSON(body : bytes, status : int = 200) -> Response:
+    '''Bytes that already are JSON (a cache hit, or the buffer just written to the cache) sent as they are, no parse, no re-encode'''
+    return current_app.response_class(body, status=status, mimetype=JSON_MIMETYPE)
+
+def withETag(response : Response, etag : str | None) -> Response:
+    '''Strong ETag plus no-cache, so clients keep the body but revalidate it with If-None-Match every time'''
+    if etag:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def notModified(etag : str) -> Response:
+    '''The answer to a matching If-None-Match, nothing read, nothing serialized'''
+    return withETag(current_app.response_class(status=304), etag)
+
+def dumpJSON(obj : Any) -> bytes:
+    '''The one serialization a cache miss pays for: the same buffer goes to Redis and to the client'''
+    return orjson.dumps(obj, option=ORJSON_OPTIONS)
@@ -1,91 +1,230 @@
-import os, sys
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
 from dotenv import load_dotenv
-from auxillary_modules.redismanager import RedisManager
+from service.auxillary_modules.redismanager import RedisManager
+import orjson
 
 from typing import Any
 
 CWD = os.path.dirname(__file__)
-
-
-output = load_dotenv(dotenv_path=os.path.join(os.path.dirname(CWD), '.env'),
-                verbose=True,
-                override=True)
-
-if not output:
-    print(f"ERROR: Failed to parse .env file at: {os.path.join(os.path.dirname(CWD), '.env')}. Make sure path is entered correctly, and that a file actually exists there.")
-    raise FileNotFoundError()
+ENV_PATH = os.path.join(os.path.dirname(CWD), '.env')
+
+def loadEnv() -> bool:
+    '''Load the .env file at LIB_ENV_FILE (default backend/.env) into the environment, its values win over ones already
+    set. Without one, or with LIB_ENV_FILE set to nothing, the environment is all there is.'''
+    path = os.environ.get("LIB_ENV_FILE", ENV_PATH)
+    if not path:
+        return False
+    if load_dotenv(dotenv_path=path, verbose=True, override=True):
+        return True
+    print(f"WARNING: No .env file at {path}, configuring from the environment alone")
+    return False
 
 class AppConfig:
-    try:
-        SECRET_KEY = os.environ["APP_SECRET_KEY"]
-
-        PORT = int(os.environ["APP_PORT"])
-        HOST = os.environ["APP_HOST"]
-
-        SQLALCHEMY_DATABASE_URI = "postgresql://{user}:{password}@{url}/{db}".format(user=os.environ["DB_USERNAME"],
-                                                                                     password=os.environ["DB_PASSWORD"],
-                                                                                     url=os.environ["DB_URI"],
-                                                                                     db=os.environ["DB_NAME"])
-        SQLALCHEMY_TRACK_MODIFICATIONS = os.environ.get("DB_TRACK_MODIFICATIONS", False)
-
-        REQUIRE_REDIS = bool(int(os.environ["REQUIRE_REDIS"]))
-        REDIS_HOST = os.environ.get("REDIS_HOST")
-        REDIS_PORT = int(os.environ.get("REDIS_PORT"))
-
-        if REQUIRE_REDIS and not (REDIS_HOST and REDIS_PORT):
-            raise ValueError("REQUIRE_REDIS set to True, but mandatory args not found")
-
-        OPENING_TIME = int(os.environ["LIB_OPENING_TIME"])
-        CLOSING_TIME = int(os.environ["LIB_CLOSING_TIME"])
-        FUTURE_WINDOW_SIZE = int(os.environ["LIB_FUTURE_WINDOW_SIZE"])
-        MAX_QLEN = int(os.environ["LIB_MAX_QUEUE_SIZE"])
-
-    except KeyError as e:
-        print(f"ERROR: Missing configuration in {os.path.dirname(CWD), '.env'}, check .env file, Original Error: {e}")
-        raise e
-    except ValueError as e:
-        print(f"ERROR: Invalid configuration in {os.path.dirname(CWD), '.env'}. Original Error: {e}")
-        raise e
-    
+    '''Everything the app reads from the environment, read when an instance is made (create_app does, after loadEnv)'''
+    def __init__(self):
+        try:
+            self.SECRET_KEY = os.environ["APP_SECRET_KEY"]
+
+            self.PORT = int(os.environ["APP_PORT"])
+            self.HOST = os.environ["APP_HOST"]
+
+            self.SQLALCHEMY_DATABASE_URI = os.environ.get("DB_URL") or "postgresql://{user}:{password}@{url}/{db}".format(user=os.environ["DB_USERNAME"],
+                                                                                                                          password=os.environ["DB_PASSWORD"],
+                                                                                                                          url=os.environ["DB_URI"],
+                                                                                                                          db=os.environ["DB_NAME"])
+            self.SQLALCHEMY_TRACK_MODIFICATIONS = os.environ.get("DB_TRACK_MODIFICATIONS", False)
+            # Async driver URL for service/asgi.py, derived from SQLALCHEMY_DATABASE_URI (asyncpg / aiosqlite) when not set
+            self.ASYNC_DATABASE_URI = os.environ.get("DB_ASYNC_URL")
+
+            self.REQUIRE_REDIS = bool(int(os.environ["REQUIRE_REDIS"]))
+            self.REDIS_HOST = os.environ.get("REDIS_HOST")
+            self.REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+            self.REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 32))
+            self.REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 0.5))
+            self.REDIS_BREAKER_THRESHOLD = int(os.environ.get("REDIS_BREAKER_THRESHOLD", 3))
+            self.REDIS_BREAKER_COOLDOWN = float(os.environ.get("REDIS_BREAKER_COOLDOWN", 5))
+
+            if self.REQUIRE_REDIS and not (self.REDIS_HOST and self.REDIS_PORT):
+                raise ValueError("REQUIRE_REDIS set to True, but mandatory args not found")
+
+            self.OPENING_TIME = int(os.environ["LIB_OPENING_TIME"])
+            self.CLOSING_TIME = int(os.environ["LIB_CLOSING_TIME"])
+            self.FUTURE_WINDOW_SIZE = int(os.environ["LIB_FUTURE_WINDOW_SIZE"])
+            self.MAX_QLEN = int(os.environ["LIB_MAX_QUEUE_SIZE"])
+            self.MAX_BATCH_SIZE = int(os.environ.get("LIB_MAX_BATCH_SIZE", 6))         # Slots per POST /book/batch
+
+            self.LOCK_RETRIES = int(os.environ.get("LIB_LOCK_RETRIES", 3))                       # Extra attempts after a NOWAIT lock conflict, then 503
+            self.LOCK_RETRY_BASE = float(os.environ.get("LIB_LOCK_RETRY_BASE_MS", 20)) / 1000    # Backoff doubles per attempt from here, fully jittered
+            self.LOCK_RETRY_CAP = float(os.environ.get("LIB_LOCK_RETRY_CAP_MS", 200)) / 1000
+            self.CONCURRENCY_MODE = os.environ.get("LIB_CONCURRENCY_MODE", "pessimistic").lower()     # pessimistic: NOWAIT row locks, optimistic: version compare-and-swap
+            self.OPTIMISTIC_RETRIES = int(os.environ.get("LIB_OPTIMISTIC_RETRIES", 5))             # Extra attempts after the version moved underneath a write, then 503
+            if self.CONCURRENCY_MODE not in ("pessimistic", "optimistic"):
+                raise ValueError(f"LIB_CONCURRENCY_MODE must be pessimistic or optimistic, got {self.CONCURRENCY_MODE}")
+            self.SUGGESTIONS = int(os.environ.get("LIB_SUGGESTIONS", 3))                          # Free alternatives offered when a slot is taken, 0 turns it off
+
+            self.CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 32 * 1024 * 1024))
+            self.CACHE_MAX_KEY_BYTES = int(os.environ.get("CACHE_MAX_KEY_BYTES", 256))
+            self.CACHE_MAX_VALUE_BYTES = int(os.environ.get("CACHE_MAX_VALUE_BYTES", 1024 * 1024))
+            self.CACHE_L1_TTL = float(os.environ.get("CACHE_L1_TTL", 5))
+
+            self.SERVER_TIMING = bool(int(os.environ.get("LIB_SERVER_TIMING", 0)))      # Debugging aid, adds a Server-Timing header (db, redis, total) to every response
+
+            self.AVAILABILITY_INDEX = bool(int(os.environ.get("LIB_AVAILABILITY_INDEX", 1)))
+            self.AVAILABILITY_INDEX_MAX_AGE = float(os.environ.get("LIB_AVAILABILITY_INDEX_MAX_AGE", 30))
+            self.OCCUPANCY_TTL = int(os.environ.get("LIB_OCCUPANCY_TTL", 60))          # GET /stats/occupancy is cached per window this long, and at most this far behind
+
+            self.MAX_PAGE_SIZE = int(os.environ.get("LIB_MAX_PAGE_SIZE", 500))          # ?limit= cap for keyset paginated listings
+            self.STREAM_BATCH = int(os.environ.get("LIB_STREAM_BATCH", 1000))           # Rows per server side cursor fetch for ?stream=1 listings
+
+            self.SSE_HEARTBEAT = float(os.environ.get("LIB_SSE_HEARTBEAT", 15))         # Seconds between keepalive comments, also how fast a gone client is noticed
+            self.SSE_MAX_SECONDS = float(os.environ.get("LIB_SSE_MAX_SECONDS", 300))    # Streams end after this, clients reconnect by themselves and get a fresh snapshot
+            self.SSE_MAILBOX = int(os.environ.get("LIB_SSE_MAILBOX", 64))               # Undelivered events kept per stream, oldest dropped first
+            self.SSE_MAX_SYNC_STREAMS = int(os.environ.get("LIB_SSE_MAX_SYNC_STREAMS", 8))     # Open streams per process on the Flask app, each holds a worker thread. asgi.py has no cap
+
+        except KeyError as e:
+            print(f"ERROR: Missing configuration, check the environment or {ENV_PATH}, Original Error: {e}")
+            raise e
+        except ValueError as e:
+            print(f"ERROR: Invalid configuration in the environment or {ENV_PATH}. Original Error: {e}")
+            raise e
+
 class CacheManager(RedisManager):
-    '''This class seems so useless but hey less network calls at least'''
-    def __init__(self, maxSize : int, maxKeySize: int, maxValSize : int, host : str, port : int, **options):
-        self._nanoCache : dict = {}
+    '''Local L1 cache in front of Redis (L2). Values are stored serialized, so sizes are real byte counts.
+
+    Entries expire after their own TTL and the least recently used ones are evicted once `maxSize` bytes are in use.
+    Reads fall through to Redis and populate L1 on the way back, writes go to both.
+    '''
+    def __init__(self, maxSize : int, maxKeySize: int, maxValSize : int, host : str, port : int, defaultTTL : float = 5, **options):
+        self._nanoCache : OrderedDict[str, tuple[float, bytes]] = OrderedDict()     # key -> (expiry on monotonic clock, value)
+        self._lock = Lock()
+        self._bytesUsed : int = 0
         self.maxSize = maxSize
         self.maxKeySize = maxKeySize
         self.maxValSize = maxValSize
+        self.defaultTTL = defaultTTL
+
+        self.hits = 0           # Served from L1
+        self.l2Hits = 0         # Missed L1, served from Redis
+        self.misses = 0         # Missed both
+        self.evictions = 0      # LRU evictions, expiries not included
+        self.expirations = 0
         super().__init__(host, port, **options)
 
+    @staticmethod
+    def _entrySize(key : str, value : bytes) -> int:
+        return len(key.encode()) + len(value)
+
     def getSpaceData(self) -> str:
-        return f"Mmeory occupied: {sys.getsizeof(self._nanoCache)}\nEntries{len(self._nanoCache)}"
-    
-    def addToCache(self, key : str, value : Any) -> str | None:
-        if sys.getsizeof(self._nanoCache) > self.maxSize:
-            print("Permissible memory exhausted, insertion denied")
-            return
-        
-        if sys.getsizeof(value) > self.maxValSize:
+        return f"Memory occupied: {self._bytesUsed}/{self.maxSize} bytes\nEntries: {len(self._nanoCache)}"
+
+    def getStats(self) -> dict:
+        lookups = self.hits + self.l2Hits + self.misses
+        return {"hits" : self.hits,
+                "l2_hits" : self.l2Hits,
+                "misses" : self.misses,
+                "evictions" : self.evictions,
+                "expirations" : self.expirations,
+                "entries" : len(self._nanoCache),
+                "bytes" : self._bytesUsed,
+                "hit_ratio" : (self.hits + self.l2Hits) / lookups if lookups else 0.0}
+
+    def _drop(self, key : str) -> bytes | None:
+        entry = self._nanoCache.pop(key, None)
+        if entry is None:
+            return None
+        self._bytesUsed -= self._entrySize(key, entry[1])
+        return entry[1]
+
+    def addToCache(self, key : str, value : Any, ttl : float | None = None) -> None:
+        '''Insert into L1 only, evicting least recently used entries to make room. Non-bytes values are serialized with orjson.'''
+        if not isinstance(value, bytes):
+            value = orjson.dumps(value)
+
+        if len(value) > self.maxValSize:
             raise ValueError("Value exceeds maximum permissible size")
-        
-        if sys.getsizeof(key) > self.maxKeySize:
+
+        if len(key.encode()) > self.maxKeySize:
             raise ValueError("Key exceeds maximum permissible size")
-        
-        self._nanoCache[key] = value
-        if sys.getsizeof(self._nanoCache) > self.maxSize:
-            raise MemoryError("Permissible memory exhausted, future insertions will now be denied")
-    
-    def popFromCache(self, key) -> Any:
-        return self._nanoCache.pop(key, None)
+
+        size = self._entrySize(key, value)
+        if size > self.maxSize:
+            raise MemoryError("Entry is larger than the whole cache")
+
+        with self._lock:
+            self._drop(key)
+            while self._bytesUsed + size > self.maxSize:
+                oldKey, (_, oldValue) = self._nanoCache.popitem(last=False)
+                self._bytesUsed -= self._entrySize(oldKey, oldValue)
+                self.evictions += 1
+
+            self._nanoCache[key] = (monotonic() + (self.defaultTTL if ttl is None else ttl), value)
+            self._bytesUsed += size
+
+    def getFromCache(self, key : str) -> bytes | None:
+        '''L1 lookup only, refreshes recency on hit'''
+        with self._lock:
+            entry = self._nanoCache.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= monotonic():
+                self._drop(key)
+                self.expirations += 1
+                return None
+            self._nanoCache.move_to_end(key)
+            return entry[1]
+
+    def get(self, key : str) -> bytes | None:
+        '''Read through L1 then Redis. While the breaker is open L1 is bypassed too, invalidations can't reach it.'''
+        if self.breaker.isOpen:
+            self.misses += 1
+            return None
+
+        value = self.getFromCache(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        value = self.safe_execute_command("GET", True, key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.l2Hits += 1
+        try:
+            self.addToCache(key, value)
+        except (ValueError, MemoryError):
+            pass                # Too big for L1, Redis still has it
+        return value
+
+    def set(self, key : str, value : Any, ttl : int) -> None:
+        '''Write to Redis with SETEX and keep a copy in L1 for at most `defaultTTL` seconds. Nothing is kept locally if Redis didn't take it.'''
+        if not isinstance(value, bytes):
+            value = orjson.dumps(value)
+
+        if self.safe_execute_command("SETEX", True, key, ttl, value) is None:
+            return
+        try:
+            self.addToCache(key, value, min(ttl, self.defaultTTL))
+        except (ValueError, MemoryError):
+            pass
+
+    def popFromCache(self, key) -> bytes | None:
+        with self._lock:
+            return self._drop(key)
 
     def clearCache(self) -> None:
-        self._nanoCache = {}
+        with self._lock:
+            self._nanoCache = OrderedDict()
+            self._bytesUsed = 0
 
     def checkExistence(self, key) -> bool:
-        # return self._nanoCache.get(key)
-        return key in self._nanoCache          # peak example of Python "programming"
-            
+        return self.getFromCache(key) is not None
+
     def updateConstraints(self, **kwargs) -> None:
-        '''Update memory contraints of _nanoCache.
+        '''Update memory contraints of _nanoCache. Shrinking maxSize evicts immediately.
         
         params: Same as constructor, just without the Redis signature and additional kwargs
         '''
@@ -93,10 +232,14 @@ class CacheManager(RedisManager):
         self.maxSize = kwargs.get("maxSize", self.maxSize)
         self.maxKeySize = kwargs.get("maxKeySize", self.maxKeySize)
         self.maxValSize = kwargs.get("maxValSize", self.maxValSize)
+        self.defaultTTL = kwargs.get("defaultTTL", self.defaultTTL)
+
+        with self._lock:
+            while self._nanoCache and self._bytesUsed > self.maxSize:
+                oldKey, (_, oldValue) = self._nanoCache.popitem(last=False)
+                self._bytesUsed -= self._entrySize(oldKey, oldValue)
+                self.evictions += 1
 
 
     def persistToFile(self) -> None:
         ...
-        
-    
-configObj = AppConfig()
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""slot lookup indexes
+
+Revision ID: 7c3e5a1f9d42
+Revises: b4ffbcfbe7f4
+Create Date: 2026-10-18 19:20:11.402316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e5a1f9d42'
+down_revision = 'b4ffbcfbe7f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Re-running shift_window.py used to insert the same (room, date, time_slot) more than once,
+    # so collapse duplicates before the unique index goes in. The row with the most activity survives
+    # and any parties queued on the losers are moved over to it.
+    op.execute("""
+        CREATE TEMPORARY TABLE slot_merges AS
+        SELECT id, keep_id
+        FROM (SELECT id,
+                     first_value(id) OVER (PARTITION BY room, date, time_slot
+                                           ORDER BY booked DESC, queue_length DESC, id) AS keep_id
+              FROM slots) ranked
+        WHERE id <> keep_id
+    """)
+    op.execute("""
+        UPDATE queued_parties qp
+        SET slot_id = slot_merges.keep_id
+        FROM slot_merges
+        WHERE qp.slot_id = slot_merges.id
+    """)
+    # Someone queued on two copies of the same slot keeps their earlier place only (Rule 2)
+    op.execute("""
+        DELETE FROM queued_parties qp
+        USING queued_parties earlier
+        WHERE qp.slot_id IN (SELECT keep_id FROM slot_merges)
+          AND earlier.slot_id = qp.slot_id
+          AND (earlier.holder_email = qp.holder_email OR earlier.holder_phone = qp.holder_phone)
+          AND (earlier.time_booked, earlier.id) < (qp.time_booked, qp.id)
+    """)
+    # One queue per surviving slot again: first come first served, the earliest party holds it
+    op.execute("""
+        WITH numbered AS (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY slot_id ORDER BY time_booked, id) AS position
+            FROM queued_parties
+            WHERE slot_id IN (SELECT keep_id FROM slot_merges)
+        )
+        UPDATE queued_parties qp
+        SET queue_position = numbered.position
+        FROM numbered
+        WHERE qp.id = numbered.id
+    """)
+    op.execute("""
+        UPDATE slots
+        SET queue_length = queue.length,
+            booked = queue.length > 0,
+            holder = queue.holder
+        FROM (SELECT survivors.keep_id AS slot_id,
+                     count(qp.id) AS length,
+                     max(qp.holder_email) FILTER (WHERE qp.queue_position = 1) AS holder
+              FROM (SELECT DISTINCT keep_id FROM slot_merges) survivors
+              LEFT JOIN queued_parties qp ON qp.slot_id = survivors.keep_id
+              GROUP BY survivors.keep_id) queue
+        WHERE slots.id = queue.slot_id
+    """)
+    op.execute("DELETE FROM slots USING slot_merges WHERE slots.id = slot_merges.id")
+    op.execute("DROP TABLE slot_merges")
+
+    with op.batch_alter_table('slots', schema=None) as batch_op:
+        batch_op.create_index('uq_slots_room_date_time_slot', ['room', 'date', 'time_slot'], unique=True)
+
+    with op.batch_alter_table('queued_parties', schema=None) as batch_op:
+        batch_op.create_index('ix_queued_parties_slot_id_queue_position', ['slot_id', 'queue_position'], unique=False)
+        batch_op.create_index('ix_queued_parties_slot_date_slot_time_room_id', ['slot_date', 'slot_time', 'room_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('queued_parties', schema=None) as batch_op:
+        batch_op.drop_index('ix_queued_parties_slot_date_slot_time_room_id')
+        batch_op.drop_index('ix_queued_parties_slot_id_queue_position')
+
+    with op.batch_alter_table('slots', schema=None) as batch_op:
+        batch_op.drop_index('uq_slots_room_date_time_slot')
@@ -0,0 +1,27 @@
+"""slot version column
+
+Revision ID: d81f2a6c4b07
+Revises: 7c3e5a1f9d42
+Create Date: 2026-10-18 21:04:37.118530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81f2a6c4b07'
+down_revision = '7c3e5a1f9d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows start at 0, the server default keeps INSERTs that don't know about it (shift_window.py) working
+    with op.batch_alter_table('slots', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.INTEGER(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('slots', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,65 @@
+"""archive tables
+
+Revision ID: e5b19c0d7a31
+Revises: d81f2a6c4b07
+Create Date: 2026-10-18 22:41:09.520417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b19c0d7a31'
+down_revision = 'd81f2a6c4b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by automations/archive_expired.py, ids are carried over from the hot tables
+    op.create_table('slots_archive',
+    sa.Column('id', sa.INTEGER(), autoincrement=False, nullable=False),
+    sa.Column('time_slot', postgresql.TIME(), nullable=False),
+    sa.Column('date', sa.DATE(), nullable=False),
+    sa.Column('room', sa.SMALLINT(), nullable=False),
+    sa.Column('booked', sa.BOOLEAN(), nullable=False),
+    sa.Column('queue_length', sa.SMALLINT(), nullable=False),
+    sa.Column('holder', sa.VARCHAR(length=64), nullable=True),
+    sa.Column('version', sa.INTEGER(), nullable=False),
+    sa.Column('archived_at', postgresql.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('queued_parties_archive',
+    sa.Column('id', sa.INTEGER(), autoincrement=False, nullable=False),
+    sa.Column('holder_name', sa.VARCHAR(length=64), nullable=False),
+    sa.Column('holder_phone', sa.VARCHAR(length=10), nullable=False),
+    sa.Column('holder_email', sa.VARCHAR(length=64), nullable=False),
+    sa.Column('time_booked', postgresql.TIMESTAMP(), nullable=False),
+    sa.Column('queue_position', sa.SMALLINT(), nullable=False),
+    sa.Column('room_id', sa.SMALLINT(), nullable=False),
+    sa.Column('slot_id', sa.INTEGER(), nullable=False),
+    sa.Column('slot_time', postgresql.TIME(), nullable=False),
+    sa.Column('slot_date', sa.DATE(), nullable=False),
+    sa.Column('passkey', sa.VARCHAR(length=4), nullable=False),
+    sa.Column('archived_at', postgresql.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('slots_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_slots_archive_date'), ['date'], unique=False)
+    with op.batch_alter_table('queued_parties_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_queued_parties_archive_holder_email'), ['holder_email'], unique=False)
+        batch_op.create_index(batch_op.f('ix_queued_parties_archive_holder_phone'), ['holder_phone'], unique=False)
+        batch_op.create_index(batch_op.f('ix_queued_parties_archive_slot_date'), ['slot_date'], unique=False)
+
+    # The archiver finds expired slots by date, without this every batch scans the whole table
+    with op.batch_alter_table('slots', schema=None) as batch_op:
+        batch_op.create_index('ix_slots_date', ['date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('slots', schema=None) as batch_op:
+        batch_op.drop_index('ix_slots_date')
+    op.drop_table('queued_parties_archive')
+    op.drop_table('slots_archive')
@@ -0,0 +1,49 @@
+"""occupancy summary
+
+Revision ID: f27a4d8e6b15
+Revises: e5b19c0d7a31
+Create Date: 2026-10-18 23:37:52.804116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f27a4d8e6b15'
+down_revision = 'e5b19c0d7a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Starts empty, automations/backfill_occupancy.py fills it from the existing slots. Deltas default to 0 so
+    # shift_window.py's raw INSERTs only name what they change.
+    op.create_table('occupancy',
+    sa.Column('room', sa.SMALLINT(), autoincrement=False, nullable=False),
+    sa.Column('weekday', sa.SMALLINT(), autoincrement=False, nullable=False),
+    sa.Column('hour', sa.SMALLINT(), autoincrement=False, nullable=False),
+    sa.Column('slots', sa.INTEGER(), nullable=False),
+    sa.Column('booked', sa.INTEGER(), nullable=False),
+    sa.Column('parties', sa.INTEGER(), nullable=False),
+    sa.Column('peak_queue', sa.SMALLINT(), nullable=False),
+    sa.Column('cancellations', sa.INTEGER(), nullable=False),
+    sa.PrimaryKeyConstraint('room', 'weekday', 'hour')
+    )
+    op.create_table('occupancy_deltas',
+    sa.Column('id', sa.INTEGER(), nullable=False),
+    sa.Column('room', sa.SMALLINT(), nullable=False),
+    sa.Column('weekday', sa.SMALLINT(), nullable=False),
+    sa.Column('hour', sa.SMALLINT(), nullable=False),
+    sa.Column('slots', sa.INTEGER(), server_default='0', nullable=False),
+    sa.Column('booked', sa.SMALLINT(), server_default='0', nullable=False),
+    sa.Column('parties', sa.SMALLINT(), server_default='0', nullable=False),
+    sa.Column('peak_queue', sa.SMALLINT(), server_default='0', nullable=False),
+    sa.Column('cancellations', sa.SMALLINT(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('occupancy_deltas')
+    op.drop_table('occupancy')
@@ -5,6 +5,10 @@ import datetime as dt
 
 class QueuedParty(db.Model):
     __tablename__ = "queued_parties"
+    __table_args__ = (
+        db.Index("ix_queued_parties_slot_id_queue_position", "slot_id", "queue_position"),
+        db.Index("ix_queued_parties_slot_date_slot_time_room_id", "slot_date", "slot_time", "room_id"),
+    )
     
     id = db.Column(INTEGER, primary_key=True)
 
@@ -13,7 +17,7 @@ class QueuedParty(db.Model):
     holder_email = db.Column(VARCHAR(64), nullable=False, index=True)
 
     time_booked = db.Column(TIMESTAMP, nullable=False)
-    queue_position = db.Column(SMALLINT, nullable=False, default=0)
+    queued_index = db.Column("queue_position", SMALLINT, nullable=False, default=0)   # Column got renamed in b4ffbcfbe7f4, attribute did not
 
     room_id = db.Column(SMALLINT, nullable=False)
     slot_id = db.Column(INTEGER, db.ForeignKey("slots.id"), nullable=False)
@@ -46,10 +50,14 @@ class QueuedParty(db.Model):
                 "queue_index" : self.queued_index,
                 "room_id" : self.room_id,
                 "slot_date" : self.slot_date.strftime("%d%m%y"),
-                "slot_time" : self.slot_time.strftime("%H%m")}
+                "slot_time" : self.slot_time.strftime("%H%M")}
     
 class Slot(db.Model):
     __tablename__ = "slots"
+    __table_args__ = (
+        db.Index("uq_slots_room_date_time_slot", "room", "date", "time_slot", unique=True),     # Natural key, every hot lookup goes through this
+        db.Index("ix_slots_date", "date"),          # automations/archive_expired.py finds expired slots by date alone
+    )
 
     id = db.Column(INTEGER, primary_key=True)
 
@@ -62,6 +70,8 @@ class Slot(db.Model):
 
     holder = db.Column(VARCHAR(64), nullable=True)
 
+    version = db.Column(INTEGER, nullable=False, default=0, server_default="0")    # Bumped by every write, optimistic mode compares-and-swaps on it
+
     def __init__(self, time : dt.time, date : dt.date, booked : bool, qLen : int, holder : str):
         self.time_slot = time,
         self.date = date,
@@ -78,4 +88,64 @@ class Slot(db.Model):
                 "date" : self.date.strftime("%d%m%Y"),
                 "booked" : self.booked,
                 "qLen" : self.queue_length,
-                "holder" : self.holder}
\ No newline at end of file
+                "holder" : self.holder}
+
+# Rows automations/archive_expired.py moved out of the hot tables. Same columns and ids, no foreign key between
+# them (slots and their parties get archived in separate batches), plus when the move happened.
+class ArchivedParty(db.Model):
+    __tablename__ = "queued_parties_archive"
+
+    id = db.Column(INTEGER, primary_key=True, autoincrement=False)
+    holder_name = db.Column(VARCHAR(64), nullable=False)
+    holder_phone = db.Column(VARCHAR(10), nullable=False, index=True)
+    holder_email = db.Column(VARCHAR(64), nullable=False, index=True)
+    time_booked = db.Column(TIMESTAMP, nullable=False)
+    queued_index = db.Column("queue_position", SMALLINT, nullable=False)
+    room_id = db.Column(SMALLINT, nullable=False)
+    slot_id = db.Column(INTEGER, nullable=False)
+    slot_time = db.Column(TIME, nullable=False)
+    slot_date = db.Column(DATE, nullable=False, index=True)
+    passkey = db.Column(VARCHAR(4), nullable=False)
+    archived_at = db.Column(TIMESTAMP, nullable=False, server_default=db.func.now())
+
+class ArchivedSlot(db.Model):
+    __tablename__ = "slots_archive"
+
+    id = db.Column(INTEGER, primary_key=True, autoincrement=False)
+    time_slot = db.Column(TIME, nullable=False)
+    date = db.Column(DATE, nullable=False, index=True)
+    room = db.Column(SMALLINT, nullable=False)
+    booked = db.Column(BOOLEAN, nullable=False)
+    queue_length = db.Column(SMALLINT, nullable=False)
+    holder = db.Column(VARCHAR(64), nullable=True)
+    version = db.Column(INTEGER, nullable=False)
+    archived_at = db.Column(TIMESTAMP, nullable=False, server_default=db.func.now())
+
+# Utilisation per (room, weekday, hour). Writes append their change to occupancy_deltas in their own transaction
+# (appends never wait on each other, a shared counter row would), automations/archive_expired.py folds the deltas
+# into occupancy and automations/backfill_occupancy.py rebuilds it from the slots. The true figures are always
+# occupancy plus whatever deltas are still pending. Weekday is date.weekday(), Monday is 0.
+class Occupancy(db.Model):
+    __tablename__ = "occupancy"
+
+    room = db.Column(SMALLINT, primary_key=True, autoincrement=False)
+    weekday = db.Column(SMALLINT, primary_key=True, autoincrement=False)
+    hour = db.Column(SMALLINT, primary_key=True, autoincrement=False)
+    slots = db.Column(INTEGER, nullable=False, default=0)            # Slots that existed
+    booked = db.Column(INTEGER, nullable=False, default=0)           # Of those, held by someone
+    parties = db.Column(INTEGER, nullable=False, default=0)          # Holders and waiting parties, summed over the slots
+    peak_queue = db.Column(SMALLINT, nullable=False, default=0)
+    cancellations = db.Column(INTEGER, nullable=False, default=0)
+
+class OccupancyDelta(db.Model):
+    __tablename__ = "occupancy_deltas"
+
+    id = db.Column(INTEGER, primary_key=True)
+    room = db.Column(SMALLINT, nullable=False)
+    weekday = db.Column(SMALLINT, nullable=False)
+    hour = db.Column(SMALLINT, nullable=False)
+    slots = db.Column(INTEGER, nullable=False, default=0, server_default="0")
+    booked = db.Column(SMALLINT, nullable=False, default=0, server_default="0")
+    parties = db.Column(SMALLINT, nullable=False, default=0, server_default="0")
+    peak_queue = db.Column(SMALLINT, nullable=False, default=0, server_default="0")       # Queue length right after the write
+    cancellations = db.Column(SMALLINT, nullable=False, default=0, server_default="0")
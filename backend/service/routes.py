@@ -1,289 +1,884 @@
-from service import app, db, redisManager
-from service.models import Slot, QueuedParty
-from service.auxillary_modules.auxillary import enforce_JSON, validateDetails
-
-from flask import request, Response, jsonify, abort, url_for
-from werkzeug.exceptions import BadRequest, Unauthorized, NotFound, InternalServerError, HTTPException, Conflict
+from service import db, contentionStats, metrics, extension
+from service.models import Slot, QueuedParty, Occupancy, OccupancyDelta
+from service.auxillary_modules.auxillary import enforce_JSON, parseBookingDetails, parseSlotFilters, parseGridFilters, parseRooms, parsePage, parseBatchBooking
+from service.auxillary_modules.contention import isLockConflict, backoffDelay
+from service.auxillary_modules.responses import rawJSON, dumpJSON, withETag, notModified
+from service.auxillary_modules.cachekeys import SLOTS_TTL, slotsKey, readSlotsVersion, slotsETag, slotsBumpCommands, gridKey, gridETag, occupancyWindow, occupancyKey, occupancyETag, \
+                                                BOOKINGS_TTL, BOOKINGS_NEGATIVE_TTL, bookingsKey, readBookingsVersion, bookingsBumpCommands
+from service.auxillary_modules.events import Event, Subscription, RESYNC, identityChannel, slotChannel, sseFrame
+
+from flask import Blueprint, request, Response, jsonify, abort, url_for, current_app
+from werkzeug.exceptions import BadRequest, Unauthorized, NotFound, InternalServerError, HTTPException, Conflict, ServiceUnavailable
+
+from sqlalchemy import select, update, delete, insert, exists, literal, true, tuple_, and_, or_, func, extract, case, cast, union_all, Integer, Row
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+from datetime import datetime, timedelta, time, date
+from traceback import format_exc
+from typing import Any, Callable, Iterable
+from time import sleep, perf_counter, monotonic
+from threading import Lock, Event as Flag
 
-from sqlalchemy import select, update, delete, and_, or_
-from sqlalchemy.exc import SQLAlchemyError
+bp = Blueprint("library", __name__)
 
-from datetime import datetime, timedelta, time
-import orjson
-from traceback import format_exc
+# Of the app serving the request
+redisManager = extension("redisManager")
+cacheManager = extension("cacheManager")
+availabilityIndex = extension("availabilityIndex")
+eventBroker = extension("eventBroker")
 
 ### ERROR HANDLERS ###
-@app.errorhandler(Exception)
+@bp.app_errorhandler(Exception)
 def err_generic(e : Exception | HTTPException | SQLAlchemyError) -> Response:
-    # app.logger.error("An error occurred: %s", str(e), exc_info=True)
+    # current_app.logger.error("An error occurred: %s", str(e), exc_info=True)
     print(format_exc())
     body = {"message" : getattr(e, "description", "There seems to be an error at our server, We apologise :3")}
     if hasattr(e, "additional_info"):
         body["info"] = e.additional_info
     response = jsonify(body)
     response.headers["Content-Type"] = "application/json"
+    if getattr(e, "retry_after", None):
+        response.headers["Retry-After"] = str(e.retry_after)
 
     return response, getattr(e, "code", 500)
 
+### HELPERS ###
+# Query builders are kept apart from their execution so service/asgi.py runs exactly the same SQL
+def _availabilityQuery(windowStart : date, windowEnd : date, room_id : int | None = None):
+    query = (select(Slot.room, Slot.date, Slot.time_slot, Slot.booked, Slot.queue_length, Slot.holder)
+             .where(Slot.date >= windowStart, Slot.date < windowEnd))
+    return query.where(Slot.room == room_id) if room_id is not None else query
+
+def _availabilityRows(windowStart : date, windowEnd : date, room_id : int | None = None) -> list[tuple]:
+    '''Loader for availabilityIndex, every slot in [windowStart, windowEnd), of room_id only if given'''
+    return db.session.execute(_availabilityQuery(windowStart, windowEnd, room_id)).all()
+
+# Listings select bare columns instead of entities: no identity map, no attribute instrumentation, rows stay tuples
+_SLOT_COLUMNS = (Slot.time_slot, Slot.date, Slot.booked, Slot.queue_length, Slot.holder)
+_BOOKING_COLUMNS = (QueuedParty.holder_name, QueuedParty.holder_email, QueuedParty.holder_phone, QueuedParty.time_booked,
+                    QueuedParty.queued_index, QueuedParty.room_id, QueuedParty.slot_date, QueuedParty.slot_time)
+
+class _Formatted(dict):
+    '''strftime memo. A listing only holds a handful of distinct dates and hours, each gets formatted once.'''
+    def __init__(self, fmt : str):
+        self.fmt = fmt
+
+    def __missing__(self, value : date | time) -> str:
+        text = self[value] = value.strftime(self.fmt)
+        return text
+
+def _slotListing(rows : Iterable[tuple]) -> list[dict]:
+    '''_SLOT_COLUMNS rows to dicts shaped like Slot.__CustomDict__()'''
+    times, dates = _Formatted("%H:%M"), _Formatted("%d%m%Y")
+    return [{"time" : times[slotTime], "date" : dates[slotDate], "booked" : booked, "qLen" : qLen, "holder" : holder}
+            for slotTime, slotDate, booked, qLen, holder in rows]
+
+def _bookingListing(rows : Iterable[tuple]) -> list[dict]:
+    '''_BOOKING_COLUMNS rows to dicts shaped like QueuedParty.__CustomDict__()'''
+    dates, times = _Formatted("%d%m%y"), _Formatted("%H%M")
+    return [{"name" : name,
+             "email" : email,
+             "phone" : phone,
+             "time_booked" : booked.isoformat(" ", "minutes"),      # %Y-%m-%d %H:%M, without going through strftime
+             "queue_index" : index,
+             "room_id" : room_id,
+             "slot_date" : dates[slotDate],
+             "slot_time" : times[slotTime]}
+            for name, email, phone, booked, index, room_id, slotDate, slotTime in rows]
+
+def _slotsQuery(room_id : int, req_date : date | None, req_time : time | None):
+    '''_SLOT_COLUMNS behind a getRoomDetails listing, the whole booking window when neither filter is given.
+    Ordered like the availability index answers, the unique (room, date, time_slot) index hands them over sorted.'''
+    clauses = [Slot.room==room_id]
+    if not (req_date or req_time):
+        currentDate = datetime.date(datetime.now())
+        clauses.append((Slot.date >= currentDate) & (Slot.date < (currentDate + timedelta(days=current_app.config["FUTURE_WINDOW_SIZE"]))))
+    if req_time:
+        clauses.append(Slot.time_slot == req_time)
+    if req_date:
+        clauses.append(Slot.date == req_date)
+    return select(*_SLOT_COLUMNS).where(and_(*clauses)).order_by(Slot.date, Slot.time_slot)
+
+def _gridQuery(rooms : list[int] | None, start : date, end : date, maxQueue : int):
+    '''One row per (room, day) for getAvailability, hours folded into bitmasks: every slot, the booked ones, the ones
+    whose queue is full. Summing distinct powers of two is a bitwise OR that SQLite can do too, (room, date, time_slot) is unique.'''
+    hourBit = literal(1).op("<<")(cast(extract("hour", Slot.time_slot), Integer))
+    query = (select(Slot.room,
+                    Slot.date,
+                    func.sum(hourBit),
+                    func.sum(case((Slot.booked, hourBit), else_=0)),
+                    func.sum(case((Slot.queue_length >= maxQueue, hourBit), else_=0)))
+             .where(Slot.date >= start, Slot.date < end)
+             .group_by(Slot.room, Slot.date)
+             .order_by(Slot.room, Slot.date))
+    if rooms is not None:
+        query = query.where(Slot.room.in_(rooms))
+    return query
+
+_HOURS = [[hour for hour in range(24) if mask >> hour & 1] for mask in range(256)]      # Hours set in each byte of a mask
+
+def _hours(mask : int) -> list[int]:
+    return _HOURS[mask & 0xFF] + [hour + 8 for hour in _HOURS[mask >> 8 & 0xFF]] + [hour + 16 for hour in _HOURS[mask >> 16 & 0xFF]]
+
+def _gridPayload(rows : Iterable[tuple], start : date, end : date) -> dict:
+    '''{"from", "to", "rooms" : {room : {ddmmyy : {"hours", "booked", "full"}}}}, hours as lists of opening hours.
+    "to" is inclusive. Free is hours minus booked, and a booked hour that isn't full can still be queued for.'''
+    dates = _Formatted("%d%m%y")
+    rooms = {}
+    for room, slotDate, hours, booked, full in rows:
+        rooms.setdefault(room, {})[dates[slotDate]] = {"hours" : _hours(int(hours)), "booked" : _hours(int(booked)), "full" : _hours(int(full))}
+    return {"from" : start.strftime("%d%m%y"), "to" : (end - timedelta(days=1)).strftime("%d%m%y"), "rooms" : rooms}
+
+_OCCUPANCY_COUNTS = ("slots", "booked", "parties", "peak_queue", "cancellations")
+
+def _occupancyQuery(rooms : list[int] | None):
+    '''(room, weekday, hour, *_OCCUPANCY_COUNTS) for getOccupancy: the summary with the deltas not compacted into it yet
+    folded in, so a fresh answer is exact whether or not they were compacted. Never touches slots or queued_parties.'''
+    parts = []
+    for table in (Occupancy, OccupancyDelta):
+        part = select(table.room, table.weekday, table.hour, *[getattr(table, count) for count in _OCCUPANCY_COUNTS])
+        parts.append(part.where(table.room.in_(rooms)) if rooms is not None else part)
+    combined = union_all(*parts).subquery()
+    bucket = (combined.c.room, combined.c.weekday, combined.c.hour)
+    return (select(*bucket, *[func.max(combined.c[count]) if count == "peak_queue" else cast(func.sum(combined.c[count]), Integer) for count in _OCCUPANCY_COUNTS])
+            .group_by(*bucket)
+            .order_by(*bucket))
+
+_WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+def _occupancyFigures(slots : int, booked : int, parties : int, peakQueue : int, cancellations : int) -> dict:
+    '''utilisation: share of slots that were held. avg_queue: parties per held slot, the holder included.'''
+    return {"slots" : slots, "booked" : booked,
+            "utilisation" : round(booked / slots, 4) if slots else 0.0,
+            "avg_queue" : round(parties / booked, 2) if booked else 0.0,
+            "peak_queue" : peakQueue, "cancellations" : cancellations}
+
+def _occupancyPayload(rows : Iterable[tuple]) -> dict:
+    '''{"rooms" : {room : {"total" : figures, "weekdays" : {"mon" : {hour : figures}}}}}, see _occupancyFigures'''
+    rooms, totals = {}, {}
+    for room, weekday, hour, *counts in rows:
+        rooms.setdefault(room, {"weekdays" : {}})["weekdays"].setdefault(_WEEKDAYS[weekday], {})[hour] = _occupancyFigures(*counts)
+        total = totals.get(room, [0] * len(_OCCUPANCY_COUNTS))
+        totals[room] = [max(kept, count) if name == "peak_queue" else kept + count for name, kept, count in zip(_OCCUPANCY_COUNTS, total, counts)]
+    for room, total in totals.items():
+        rooms[room]["total"] = _occupancyFigures(*total)
+    return {"rooms" : rooms}
+
+def _slotPayload(slot : Slot | Row) -> dict:
+    '''Same shape as Slot.__CustomDict__, for RETURNING rows'''
+    return {"time" : slot.time_slot.strftime("%H:%M"),
+            "date" : slot.date.strftime("%d%m%Y"),
+            "booked" : slot.booked,
+            "qLen" : slot.queue_length,
+            "holder" : slot.holder}
+
+Position = tuple[str, str, int | None]      # (email, phone, queue position) of a party whose place changed, None once it left
+
+def _queueEvents(room : int, slotDate : date, slotTime : time, booked : bool, qLen : int, holder : str | None, positions : Iterable[Position]) -> list[Event]:
+    '''What a committed queue change publishes for the SSE streams: the slot's new state on its channel, every
+    moved party's position on both its identity channels, keyed like a _bookingListing row so clients can patch it'''
+    events = [(slotChannel(room, slotDate, slotTime), dumpJSON({"room_id" : room, "time" : slotTime.strftime("%H:%M"), "date" : slotDate.strftime("%d%m%Y"),
+                                                                "booked" : booked, "qLen" : qLen, "holder" : holder}))]
+    slotKey = {"room_id" : room, "slot_date" : slotDate.strftime("%d%m%y"), "slot_time" : slotTime.strftime("%H%M")}
+    for email, phone, position in positions:
+        payload = dumpJSON(slotKey | {"queue_index" : position})
+        events += [(identityChannel(email), payload), (identityChannel(phone), payload)]
+    return events
+
+def _mirrorSlot(room : int, slotDate : date, slotTime : time, booked : bool, qLen : int, holder : str | None, positions : Iterable[Position] = ()) -> None:
+    '''Propagate a committed slot write: invalidate cached listings for that room and date and the bookings of every
+    party in `positions`, publish the queue events, update availabilityIndex. One Redis round trip for all of it.'''
+    positions = list(positions)
+    events = _queueEvents(room, slotDate, slotTime, booked, qLen, holder, positions)
+    publish = eventBroker.commands(events)
+    results = redisManager.safe_pipeline(slotsBumpCommands(room, slotDate)
+                                         + bookingsBumpCommands(*(identity for email, phone, _ in positions for identity in (email, phone)))
+                                         + publish)
+    eventBroker.published(events, results[len(results) - len(publish):])
+    if availabilityIndex:
+        availabilityIndex.applySlot(room, slotDate, slotTime, booked, qLen, holder, results[1])     # INCR slotver:<room>
+
+def _mirrorBatch(items : list[tuple[int, date, time]], holder_email : str, holder_num : str) -> None:
+    '''_mirrorSlot for a committed batch booking, every version bump and event in one pipeline'''
+    commands = [command for room, slotDate in {(room, slotDate) for room, slotDate, _ in items} for command in slotsBumpCommands(room, slotDate)]
+    events = [event for room, slotDate, slotTime in items for event in _queueEvents(room, slotDate, slotTime, True, 1, holder_email, [(holder_email, holder_num, 1)])]
+    publish = eventBroker.commands(events)
+    results = redisManager.safe_pipeline(commands + bookingsBumpCommands(holder_email, holder_num) + publish)
+    eventBroker.published(events, results[len(results) - len(publish):])
+    if availabilityIndex:
+        # No versions: a room gets one bump per date of the batch, the next read of it reloads it instead
+        for room, slotDate, slotTime in items:
+            availabilityIndex.applySlot(room, slotDate, slotTime, True, 1, holder_email)
+
+# SSE streams open in this process. On the Flask app each holds a worker thread until it ends, so they're capped to
+# leave threads for the booking endpoints. asgi.py serves them without a thread each and counts nothing.
+_syncStreams = 0
+_syncStreamsLock = Lock()
+
+def _claimSyncStream() -> Callable[[], None]:
+    '''Counts a stream against SSE_MAX_SYNC_STREAMS, 503 once they're all taken. Returns its release, safe to call more than once'''
+    global _syncStreams
+    with _syncStreamsLock:
+        if _syncStreams >= current_app.config["SSE_MAX_SYNC_STREAMS"]:
+            raise ServiceUnavailable("Too many live updates open right now, poll instead or try again shortly", retry_after=5)
+        _syncStreams += 1
+    released = Flag()
+
+    def release() -> None:
+        global _syncStreams
+        with _syncStreamsLock:
+            if not released.is_set():
+                released.set()
+                _syncStreams -= 1
+    return release
+
+def _eventStream(channels : list[str], event : str, loadSnapshot : Callable[[], bytes]) -> Response:
+    '''text/event-stream: loadSnapshot() first, then every event on `channels` as `event`, keepalive comments in
+    between. Ends after SSE_MAX_SECONDS, `retry` tells the client when to come back for a fresh snapshot.
+    A `resync` event means some events may have been lost, clients should refetch.'''
+    release = _claimSyncStream()
+    subscription = eventBroker.subscribe(channels)      # Before the snapshot, so nothing falls in between
+    try:
+        snapshot = loadSnapshot()
+    except BaseException:
+        eventBroker.unsubscribe(subscription)
+        release()
+        raise
+    db.session.remove()         # The stream outlives the request by minutes, it must not sit on a pooled connection
+    heartbeat, lifetime = current_app.config["SSE_HEARTBEAT"], current_app.config["SSE_MAX_SECONDS"]
+    unsubscribe = eventBroker.unsubscribe       # Bound now, the app context is gone by the time the stream ends
+
+    def stream():
+        try:
+            yield b"retry: 3000\n" + sseFrame("snapshot", snapshot)
+            deadline = monotonic() + lifetime
+            while (left := deadline - monotonic()) > 0:
+                received = subscription.get(min(heartbeat, left))
+                if received is None:
+                    yield b": keepalive\n\n"        # Also how a gone client gets noticed, the write fails
+                elif received is RESYNC:
+                    yield sseFrame("resync", b"{}")
+                else:
+                    yield sseFrame(event, received[1])
+        finally:
+            unsubscribe(subscription)
+            release()
+
+    response = Response(stream(), mimetype="text/event-stream", headers={"Cache-Control" : "no-cache", "X-Accel-Buffering" : "no"})
+    # A response that is closed without ever being iterated never runs the finally above
+    response.call_on_close(lambda: (unsubscribe(subscription), release()))
+    return response
+
+def _identityClause(identity : str):
+    if identity.isnumeric() and len(identity) == 10:
+        return QueuedParty.holder_phone == identity
+    if "@" in identity:
+        return QueuedParty.holder_email == identity
+    raise BadRequest(f"Parameter {identity} must be either a 10-digit phone number or an email address")
+
+def _bookingsQuery(whereClause):
+    return select(*_BOOKING_COLUMNS).where(whereClause).order_by(*_BOOKING_KEYSET)
+
+# Keyset pagination: listings are ordered by these, a cursor holds the last row's values
+_SLOT_KEYSET = (Slot.date, Slot.time_slot)
+_BOOKING_KEYSET = (QueuedParty.slot_date, QueuedParty.slot_time, QueuedParty.room_id)      # One party per slot per identity
+
+def _slotCursor(row : Row) -> str:
+    return f"{row.date.strftime('%d%m%y')}:{row.time_slot.strftime('%H%M')}"
+
+def _bookingCursor(row : Row) -> str:
+    return f"{row.slot_date.strftime('%d%m%y')}:{row.slot_time.strftime('%H%M')}:{row.room_id}"
+
+def _pagedListing(query, keyset : tuple, cursor : Callable[[Row], str], listing : Callable[[Iterable[tuple]], list[dict]], page : tuple[int, tuple | None] | None) -> Response | None:
+    '''One ?limit=&after= page of a listing, with a Link to the next one when the page came back full. An index seek
+    past the cursor instead of an OFFSET scan. Pages aren't cached, they're for listings too long to cache whole.
+    None (nothing found) only for a first page, past the end is an empty page.'''
+    limit, after = page
+    if after is not None:
+        query = query.where(tuple_(*keyset) > after)
+    rows = db.session.execute(query.limit(limit)).all()
+    if not rows and after is None:
+        return None
+    response = rawJSON(dumpJSON(listing(rows)))
+    if len(rows) == limit:
+        # View args win over a query arg of the same name (?room_id=), passing both to url_for would be a TypeError
+        nextPage = url_for(request.endpoint, **(request.args.to_dict() | request.view_args | {"after" : cursor(rows[-1])}))
+        response.headers["Link"] = f'<{nextPage}>; rel="next"'
+    return response
+
+def _streamedListing(query, listing : Callable[[Iterable[tuple]], list[dict]]) -> Response | None:
+    '''?stream=1: the JSON array is written as rows come off a server side cursor, STREAM_BATCH of them at a time,
+    so memory stays flat however long the listing gets. Holds its own connection until the server closes the response,
+    whether it was sent in full, the client went away or it was never iterated at all. None if there is nothing to send.'''
+    connection = db.engine.connect()
+    try:
+        partitions = connection.execution_options(yield_per=current_app.config["STREAM_BATCH"]).execute(query).partitions()
+        first = next(partitions, None)
+    except SQLAlchemyError:
+        connection.close()
+        raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+    if not first:
+        connection.close()
+        return None
+
+    def generate():
+        try:
+            yield b"[" + dumpJSON(listing(first))[1:-1]
+            for partition in partitions:
+                yield b"," + dumpJSON(listing(partition))[1:-1]
+            yield b"]"
+        finally:
+            connection.close()
+
+    # The finally only runs once the generator has started, a response that is closed unread needs this too
+    response = Response(generate(), mimetype="application/json")
+    response.call_on_close(connection.close)
+    return response
+
+_LARGE_LISTING_ARGS = {"limit", "after", "stream"}       # Any of these takes a listing off the cached path
+
+def _largeListing(query, keyset : tuple, cursor : Callable[[Row], str], listing : Callable[[Iterable[tuple]], list[dict]]) -> Response | None:
+    '''?limit/?after or ?stream=1 for getRoomDetails and getBookings'''
+    stream = request.args.get("stream") in ("1", "true")
+    page = parsePage(request.args.get("limit"), request.args.get("after"), len(keyset), current_app.config)
+    if stream and page:
+        raise BadRequest("stream and limit/after don't mix, a streamed listing is complete")
+    if stream:
+        return _streamedListing(query, listing)
+    if page:
+        return _pagedListing(query, keyset, cursor, listing, page)
+    raise BadRequest("stream must be 1 or true")
+
+def _holderConflict(room_id : int, booking_date : date, booking_time : time, holder_email : str, holder_num : str):
+    '''Rule 1: If a person already has a room reserved, they can't enqueue/book anywhere else'''
+    return and_(or_(QueuedParty.holder_email == holder_email,
+                    QueuedParty.holder_phone == holder_num),
+                QueuedParty.slot_time == booking_time,
+                QueuedParty.slot_date == booking_date,
+                QueuedParty.queued_index == 1,       # Holder's position
+                QueuedParty.room_id == room_id)
+
+def _occupancyDelta(room : int, slotDate : date, slotTime : time, **changes : int) -> dict:
+    '''occupancy_deltas row for one write to a slot, `changes` being what it did to the slot's (room, weekday, hour)'''
+    return {"room" : room, "weekday" : slotDate.weekday(), "hour" : slotTime.hour,
+            "slots" : 0, "booked" : 0, "parties" : 0, "peak_queue" : 0, "cancellations" : 0} | changes
+
+def _occupancyInsert(deltas : list[dict]):
+    '''Appended in the write's own transaction, so the summary can't count a write that rolled back'''
+    return insert(OccupancyDelta).values(deltas)
+
+_BOOKED = {"booked" : 1, "parties" : 1, "peak_queue" : 1}      # What claiming a free slot does to its bucket
+
+_PARTY_COLUMNS = ["holder_name", "holder_phone", "holder_email", "time_booked", "queue_position", "room_id", "slot_id", "slot_time", "slot_date", "passkey"]
+
+def _claimQuery(room_id : int, booking_date : date, booking_time : time, holder_name : str, holder_num : str, holder_email : str, holder_passkey : str, dialect : str):
+    '''The statement _claimSlot runs first. On Postgres it is the whole booking, anywhere else it is only the claim
+    and the party row follows with _partyInsert. Built separately so the ASGI handlers run exactly the same SQL.'''
+    conflict = exists().where(_holderConflict(room_id, booking_date, booking_time, holder_email, holder_num))
+    claim = (update(Slot)
+             .where(Slot.room == room_id,
+                    Slot.date == booking_date,
+                    Slot.time_slot == booking_time,
+                    Slot.booked == False,
+                    ~conflict)
+             .values(booked=True, queue_length=1, holder=holder_email, version=Slot.version + 1)
+             .returning(Slot.id, Slot.room, Slot.date, Slot.time_slot, Slot.booked, Slot.queue_length, Slot.holder))
+
+    if dialect != "postgresql":
+        return claim.execution_options(synchronize_session=False)
+
+    claimed = claim.cte("claimed")
+    partyInsert = (insert(QueuedParty)
+                   .from_select(_PARTY_COLUMNS,
+                                select(*[literal(value) for value in (holder_name, holder_num, holder_email, datetime.now(), 1)],
+                                       claimed.c.room, claimed.c.id, claimed.c.time_slot, claimed.c.date,
+                                       literal(holder_passkey)))
+                   .cte("party"))
+    occupancy = (insert(OccupancyDelta)
+                 .from_select(["room", "weekday", "hour", *_BOOKED],
+                              select(claimed.c.room, literal(booking_date.weekday()), literal(booking_time.hour), *map(literal, _BOOKED.values())))
+                 .cte("occupancy"))
+    # Always exactly one row back: the claimed columns (NULL when lost) next to the Rule 1 flag
+    anchor = select(literal(1).label("anchor")).subquery()
+    return (select(claimed, conflict.label("conflict"))
+            .select_from(anchor.outerjoin(claimed, true()))
+            .add_cte(partyInsert, occupancy))
+
+def _partyInsert(claimed : Row, holder_name : str, holder_num : str, holder_email : str, holder_passkey : str):
+    return insert(QueuedParty).values(dict(zip(_PARTY_COLUMNS, [holder_name, holder_num, holder_email, datetime.now(), 1,
+                                                               claimed.room, claimed.id, claimed.time_slot, claimed.date, holder_passkey])))
+
+def _conflictQuery(room_id : int, booking_date : date, booking_time : time, holder_email : str, holder_num : str):
+    return select(exists().where(_holderConflict(room_id, booking_date, booking_time, holder_email, holder_num)))
+
+def _holderConflictError() -> Conflict:
+    conflict = Conflict("A reserved room already exists under the provided email address/phone number")
+    conflict.__setattr__("additional_info", "Since there is already a room booked under these credentials, enqueuing to or booking another room is NOT allowed.")
+    return conflict
+
+def _claimSlot(room_id : int, booking_date : date, booking_time : time, holder_name : str, holder_num : str, holder_email : str, holder_passkey : str) -> tuple[Row | None, bool]:
+    '''Book a free slot and add its holder. Returns (claimed slot row or None, whether Rule 1 is what stopped it).
+
+    The claim is a conditional UPDATE, so two racing bookings can't both win and nothing needs locking explicitly.
+    On Postgres the party INSERT, the occupancy delta and the Rule 1 check for the loser's error message ride along
+    in the same statement as data-modifying CTEs, so winners and losers both make exactly one round trip.
+    '''
+    dialect = db.engine.dialect.name
+    query = _claimQuery(room_id, booking_date, booking_time, holder_name, holder_num, holder_email, holder_passkey, dialect)
+    if dialect == "postgresql":
+        outcome = db.session.execute(query).one()
+        return (outcome if outcome.id is not None else None), outcome.conflict
+
+    # SQLite and friends can't put DML in a CTE, same claim followed by the insert
+    row = db.session.execute(query).one_or_none()
+    if row:
+        db.session.execute(_partyInsert(row, holder_name, holder_num, holder_email, holder_passkey))
+        db.session.execute(_occupancyInsert([_occupancyDelta(row.room, row.date, row.time_slot, **_BOOKED)]))
+        return row, False
+    return None, db.session.execute(_conflictQuery(room_id, booking_date, booking_time, holder_email, holder_num)).scalar()
+
+
+def _batchForUpdate(items : list[tuple[int, date, time]]):
+    '''Lock every slot of a batch. Rows are locked in (room, date, time_slot) order whatever order the batch came in,
+    so two overlapping batches queue up behind each other instead of each holding a row the other one wants.'''
+    return (select(Slot)
+            .where(tuple_(Slot.room, Slot.date, Slot.time_slot).in_(items))
+            .order_by(Slot.room, Slot.date, Slot.time_slot)
+            .with_for_update())
+
+def _alreadyQueuedQuery(room_id : int, booking_date : date, booking_time : time, holder_email : str, holder_num : str):
+    '''Rule 2: If a person has enqueued themselves to a room (either holding or waiting status), they cannot enqueue again.'''
+    return select(exists().where(or_(QueuedParty.holder_email == holder_email,
+                                     QueuedParty.holder_phone == holder_num),
+                                 QueuedParty.room_id == room_id,
+                                 QueuedParty.slot_time == booking_time,
+                                 QueuedParty.slot_date == booking_date))
+
+def _slotAt(room_id : int, booking_date : date, booking_time : time):
+    return select(Slot).where(Slot.room == room_id, Slot.date == booking_date, Slot.time_slot == booking_time)
+
+def _optimistic() -> bool:
+    return current_app.config["CONCURRENCY_MODE"] == "optimistic"
+
+def _versionedUpdate(slot : Slot, **values):
+    '''UPDATE of one slot that moves its version on. In optimistic mode it only lands if nobody has written the slot
+    since `slot` was read, a rowcount of 0 (or no row returned) means somebody has and the attempt starts over.'''
+    query = update(Slot).where(Slot.id == slot.id)
+    if _optimistic():
+        query = query.where(Slot.version == slot.version)
+    return query.values(version=Slot.version + 1, **values)
+
+def _enqueueRejection(slot : Slot | None, bookEndpoint : str) -> tuple[dict, int, bool] | None:
+    '''(body, status, worth suggesting alternatives) when the locked slot can't take another party, None when it can'''
+    if not slot:
+        return {"message" : "Slot Unavailable"}, 404, True
+    if not slot.booked:
+        return {"redir" : True,
+                "redir_endpoint" : bookEndpoint,
+                "message" : "This room slot does not have any reservations. Would you like to reserve it first?"}, 409, False
+    if slot.queue_length >= current_app.config["MAX_QLEN"]:
+        return {"redir" : False,
+                "redir_endpoint" : None,
+                "message" : f"Queue length exceeds maximum allowed parties, which is {current_app.config['MAX_QLEN']}"}, 409, True
+    return None
+
+def _lockUnavailable() -> ServiceUnavailable:
+    return ServiceUnavailable("This slot is busy with other requests right now, please try again", retry_after=1)
+
+def _lockWithRetry(query) -> Any:
+    '''Run a FOR UPDATE NOWAIT query, the first statement of its transaction. A lock conflict rolls back and
+    retries after a jittered backoff, LOCK_RETRIES times at most, then gives up with a 503 instead of a 500.'''
+    firstConflict = None
+    for attempt in range(current_app.config["LOCK_RETRIES"] + 1):
+        try:
+            result = db.session.execute(query).scalar_one_or_none()
+            if firstConflict is not None:
+                contentionStats.recordWait(perf_counter() - firstConflict)
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if not isLockConflict(e):
+                raise
+            firstConflict = firstConflict or perf_counter()
+            retrying = attempt < current_app.config["LOCK_RETRIES"]
+            contentionStats.recordConflict(retrying)
+            if retrying:
+                sleep(backoffDelay(attempt, current_app.config["LOCK_RETRY_BASE"], current_app.config["LOCK_RETRY_CAP"]))
+
+    contentionStats.recordWait(perf_counter() - firstConflict)
+    raise _lockUnavailable()
+
+def _readSlot(query) -> Slot | None:
+    '''The slot a queue change starts from: locked NOWAIT in pessimistic mode, a plain read in optimistic mode'''
+    if _optimistic():
+        return db.session.execute(query).scalar_one_or_none()
+    return _lockWithRetry(query.with_for_update(nowait=True))
+
+def _casAttempts():
+    '''Attempts at a read-then-_versionedUpdate. Every attempt the caller doesn't break out of (its swap lost) rolls back
+    and waits a jittered backoff before the next, OPTIMISTIC_RETRIES times at most, then 503. Pessimistic mode gets
+    a single attempt, the row lock means the swap can't lose.'''
+    retries = current_app.config["OPTIMISTIC_RETRIES"] if _optimistic() else 0
+    for attempt in range(retries + 1):
+        yield attempt
+        db.session.rollback()
+        retrying = attempt < retries
+        contentionStats.recordVersionConflict(retrying)
+        if retrying:
+            sleep(backoffDelay(attempt, current_app.config["LOCK_RETRY_BASE"], current_app.config["LOCK_RETRY_CAP"]))
+    raise _lockUnavailable()
+
+def _alternativesQuery(room_id : int, booking_date : date, booking_time : time, limit : int):
+    '''Free slots closest to the one asked for: the same hour in other rooms, then neighbouring hours, nearest room first.
+    SKIP LOCKED passes over slots someone is claiming right now, they're about to stop being free.'''
+    clauses = [Slot.date == booking_date,
+               Slot.booked == False,
+               or_(Slot.room == room_id, Slot.time_slot == booking_time),
+               ~and_(Slot.room == room_id, Slot.time_slot == booking_time)]
+    if booking_date == datetime.date(datetime.now()):
+        clauses.append(Slot.time_slot > datetime.now().time())
+    return (select(Slot.room, Slot.date, Slot.time_slot)
+            .where(*clauses)
+            .order_by(func.abs(extract("hour", Slot.time_slot) - booking_time.hour), func.abs(Slot.room - room_id))
+            .limit(limit)
+            .with_for_update(skip_locked=True))
+
+def _alternativePayload(rows : list[Row]) -> list[dict]:
+    '''In the shape POST /book takes, so a client can go straight for one'''
+    return [{"room" : row.room, "date" : row.date.strftime("%d%m%y"), "time" : row.time_slot.strftime("%H%M")} for row in rows]
+
+def _suggestAlternatives(room_id : int, booking_date : date, booking_time : time) -> list[dict]:
+    '''Best effort, in a transaction of its own that only holds its row locks for the length of the query'''
+    if not current_app.config["SUGGESTIONS"]:
+        return []
+    try:
+        rows = db.session.execute(_alternativesQuery(room_id, booking_date, booking_time, current_app.config["SUGGESTIONS"])).all()
+        db.session.rollback()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to look up alternative slots: {e}")
+        return []
+    if rows:
+        contentionStats.recordSuggestion()
+    return _alternativePayload(rows)
+
 
 ### ENDPOINTS ###
-@app.route("/rooms/<int:room_id>/slots", methods=["GET"])
+@bp.route("/rooms/<int:room_id>/slots", methods=["GET"])
 def getRoomDetails(room_id) -> Response:
     req_date = request.args.get("date")
     req_time = request.args.get("time")
 
+    today = datetime.date(datetime.now())
+    if availabilityIndex and not (req_date or req_time or request.args.keys() & _LARGE_LISTING_ARGS):
+        availabilityIndex.ensureFresh(today, _availabilityRows, room_id, readSlotsVersion(redisManager, room_id))
+        snapshot = availabilityIndex.snapshot(room_id)
+        if snapshot is not None:
+            version, indexed = snapshot
+            etag = slotsETag(room_id, version, None, None, today)
+            if request.if_none_match.contains(etag):
+                metrics.recordCacheLookup("getRoomDetails", "not_modified")
+                return notModified(etag)
+            metrics.recordCacheLookup("getRoomDetails", "index")
+            return (withETag(jsonify(indexed), etag), 200) if indexed else (jsonify([]), 404)
+
+    req_date, req_time = parseSlotFilters(req_date, req_time, current_app.config)
+
+    if request.args.keys() & _LARGE_LISTING_ARGS:
+        try:
+            large = _largeListing(_slotsQuery(room_id, req_date, req_time), _SLOT_KEYSET, _slotCursor, _slotListing)
+        except SQLAlchemyError:
+            raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+        return large if large is not None else (jsonify([]), 404)
+
+    # Version is read before the DB so a listing built from pre-commit data lands under a key nobody reads anymore
+    # No version (Redis down) => no ETag either, a 0 that writes can't bump would validate stale listings forever
+    version = readSlotsVersion(redisManager, room_id, req_date)
+    etag = slotsETag(room_id, version, req_date, req_time, today) if version is not None else None
+    if etag and request.if_none_match.contains(etag):
+        metrics.recordCacheLookup("getRoomDetails", "not_modified")
+        return notModified(etag)
+
+    cacheKey = slotsKey(room_id, version or 0, req_date, req_time)
     try:
-        _result : bytes | None = redisManager.safe_execute_command("GET", True, f"{room_id}:{req_date}:{req_time}")
+        _result : bytes | None = cacheManager.get(cacheKey) if cacheManager else None
+        if cacheManager:
+            metrics.recordCacheLookup("getRoomDetails", "hit" if _result else "miss")
         if _result:
-            return jsonify(orjson.loads(_result)), 200
+            return withETag(rawJSON(_result), etag)
     except Exception as e:
         print("Failed cache lookup")
-
-    clauses = [Slot.room==room_id]
-    currentDate = datetime.date(datetime.now())
-
-    if not (req_date or req_time):
-        clauses.append((Slot.date >= currentDate) & (Slot.date < (currentDate + timedelta(days=app.config["FUTURE_WINDOW_SIZE"]))))
-
-    if req_time:
-        try:
-            req_time = int(req_time)
-            if req_time < app.config["OPENING_TIME"] or req_time > app.config["CLOSING_TIME"]:
-                raise ValueError()
-            
-            req_time = time(req_time // 100, 0)
-
-            clauses.append(Slot.time_slot == req_time)
-
-        except ValueError:
-            raise BadRequest(f"Time specified must be between {app.config['OPENING_TIME']} to {app.config['CLOSING_TIME']}, and be an integer")
-    
-    if req_date:
-        try:
-            req_date = datetime.strptime(req_date, "%d%m%y").date()
-            if req_date > currentDate + timedelta(days=app.config["FUTURE_WINDOW_SIZE"]):
-                raise BadRequest(f"You can only book rooms til {(currentDate + timedelta(days=app.config['FUTURE_WINDOW_SIZE'])).strftime('%d%m%y')}")
-            
-            clauses.append(Slot.date == req_date)
-
-        except ValueError:
-            e = BadRequest("Date must be formatted as `ddmmyy`, no alphabets or special characters allowed")
-            e.__setattr__("additional_info", f"For example, today's date would be formatted as: {currentDate.strftime('%d%m%y')}")
-            raise e
     
     try:
-        results = db.session.execute(select(Slot).where(and_(*clauses))).scalars().all()
+        results = db.session.execute(_slotsQuery(room_id, req_date, req_time)).all()
         if not results:
             return jsonify([]), 404
         
-        pyReadableResult = [result.__CustomDict__() for result in results]
-        redisManager.safe_execute_command("SETEX", True, f"{room_id}:{req_date}:{req_time}", 300, orjson.dumps(pyReadableResult))
-        return jsonify(pyReadableResult), 200
+        payload = dumpJSON(_slotListing(results))
+        if cacheManager:
+            cacheManager.set(cacheKey, payload, SLOTS_TTL)
+        return withETag(rawJSON(payload), etag)
     except SQLAlchemyError as e:
         raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
-    except AttributeError:
-        print("Invalid objects fetched, check Slot.__CustomDict__() and Slot schema")
+    except (AttributeError, ValueError):
+        print("Invalid rows fetched, check _SLOT_COLUMNS against _slotListing() and the Slot schema")
         raise InternalServerError() #NOTE: Generic decriptions are handled by @app.errorhandler(InternalServerError), no need to set description manually
 
-@app.route("/bookings/<string:identity>", methods=["GET"])
+@bp.route("/rooms/availability", methods=["GET"])
+def getAvailability() -> Response:
+    '''Every room (or ?rooms=1,2,3) over a date range in one query and one cache entry, instead of one
+    getRoomDetails call per room. Cached under the global slot generation, any write invalidates it as a whole.'''
+    rooms, start, end = parseGridFilters(request.args.get("rooms"), request.args.get("date"), request.args.get("days"), current_app.config)
+
+    generation = readSlotsVersion(redisManager, None)
+    etag = gridETag(generation, start, end, rooms) if generation is not None else None
+    if etag and request.if_none_match.contains(etag):
+        metrics.recordCacheLookup("getAvailability", "not_modified")
+        return notModified(etag)
+
+    cacheKey = gridKey(generation or 0, start, end, rooms)
+    _result : bytes | None = cacheManager.get(cacheKey) if cacheManager else None
+    if cacheManager:
+        metrics.recordCacheLookup("getAvailability", "hit" if _result else "miss")
+    if _result:
+        return withETag(rawJSON(_result), etag)
+
+    try:
+        rows = db.session.execute(_gridQuery(rooms, start, end, current_app.config["MAX_QLEN"])).all()
+    except SQLAlchemyError as e:
+        raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+    if not rows:
+        return jsonify(_gridPayload(rows, start, end)), 404
+
+    payload = dumpJSON(_gridPayload(rows, start, end))
+    if cacheManager:
+        cacheManager.set(cacheKey, payload, SLOTS_TTL)
+    return withETag(rawJSON(payload), etag)
+
+@bp.route("/stats/occupancy", methods=["GET"])
+def getOccupancy() -> Response:
+    '''Utilisation and queue lengths per room (or ?rooms=1,2,3), weekday and hour, past and future slots alike. Read
+    from the occupancy summary, at most a few hundred rows per room however much history there is. Statistics, not
+    availability: one answer is cached and tagged per OCCUPANCY_TTL window, so it can be that far behind the writes.'''
+    rooms = parseRooms(request.args.get("rooms"))
+
+    window = occupancyWindow(current_app.config["OCCUPANCY_TTL"])
+    etag = occupancyETag(window, rooms)
+    if request.if_none_match.contains(etag):
+        metrics.recordCacheLookup("getOccupancy", "not_modified")
+        return notModified(etag)
+
+    cacheKey = occupancyKey(window, rooms)
+    _result : bytes | None = cacheManager.get(cacheKey) if cacheManager else None
+    if cacheManager:
+        metrics.recordCacheLookup("getOccupancy", "hit" if _result else "miss")
+    if _result:
+        return withETag(rawJSON(_result), etag)
+
+    try:
+        rows = db.session.execute(_occupancyQuery(rooms)).all()
+    except SQLAlchemyError as e:
+        raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+    if not rows:
+        return jsonify(_occupancyPayload(rows)), 404
+
+    payload = dumpJSON(_occupancyPayload(rows))
+    if cacheManager:
+        cacheManager.set(cacheKey, payload, current_app.config["OCCUPANCY_TTL"])
+    return withETag(rawJSON(payload), etag)
+
+@bp.route("/bookings/<string:identity>", methods=["GET"])
 def getBookings(identity : str) -> Response:
-    if identity.isnumeric() and len(identity) == 10:
-        whereClause = QueuedParty.holder_phone == identity
-    elif "@" in identity:
-        whereClause = QueuedParty.holder_email == identity
-    else:
-        raise BadRequest(f"Parameter {identity} must be either a 10-digit phone number or an email address")
+    whereClause = _identityClause(identity)
+
+    if request.args.keys() & _LARGE_LISTING_ARGS:
+        try:
+            large = _largeListing(_bookingsQuery(whereClause), _BOOKING_KEYSET, _bookingCursor, _bookingListing)
+        except SQLAlchemyError:
+            raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+        if large is None:
+            raise NotFound(f"No bookings found with identity {identity}. If you believe that this is a mistake, please contact support")
+        return large
+
+    # No version (Redis down) => no cache at all, v0 may still hold what was there before the last bump
+    version = readBookingsVersion(redisManager, identity)
+    cache = cacheManager if version is not None else None
+    cacheKey = bookingsKey(identity, version)
+    _result : bytes | None = cache.get(cacheKey) if cache else None
+    if cache:
+        metrics.recordCacheLookup("getBookings", "hit" if _result else "miss")
+    if _result == b"[]":
+        raise NotFound(f"No bookings found with identity {identity}. If you believe that this is a mistake, please contact support")
+    if _result:
+        return rawJSON(_result)
     
     try:
-        _results : list[QueuedParty]= db.session.execute(select(QueuedParty).where(whereClause)).scalars().all()
+        _results : list[Row] = db.session.execute(_bookingsQuery(whereClause)).all()
         if not _results:
+            if cache:
+                cache.set(cacheKey, b"[]", BOOKINGS_NEGATIVE_TTL)
             raise NotFound(f"No bookings found with identity {identity}. If you believe that this is a mistake, please contact support")
 
-        pyReadableResult = [result.__CustomDict__() for result in _results]
-        redisManager.safe_execute_command("SETEX", False, f"bkng:{identity}", 300, orjson.dumps(pyReadableResult))
-        return jsonify(pyReadableResult), 200
+        payload = dumpJSON(_bookingListing(_results))
+        if cache:
+            cache.set(cacheKey, payload, BOOKINGS_TTL)
+        return rawJSON(payload)
     
     except SQLAlchemyError as e:
         raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
-    except AttributeError:
-        print("Invalid objects fetched, check Slot.__CustomDict__() and Slot schema")
+    except (AttributeError, ValueError):
+        print("Invalid rows fetched, check _BOOKING_COLUMNS against _bookingListing() and the QueuedParty schema")
         raise InternalServerError()
 
-@app.route("/book/<int:room_id>", methods=["POST"])
+@bp.route("/book/<int:room_id>", methods=["POST"])
 @enforce_JSON
 def bookRoom(room_id) -> Response:
     bookingData = request.get_json(force=True, silent=False)
 
+    booking_date, booking_time, holder_num, holder_email, holder_name, holder_passkey = parseBookingDetails(bookingData, current_app.config, request.root_path)
+    
     try:
-        booking_date = bookingData["date"]
-        booking_time = bookingData["time"]
-        holder_num = bookingData["number"]
-        holder_email = bookingData["email"]
-        holder_name = bookingData["name"]
-        holder_passkey = bookingData["passkey"]
-
-        if not validateDetails(holder_num, holder_email, holder_passkey):
-            raise BadRequest("Invalid formaat for holder details")
-
-        booking_time = int(booking_time)
-        if booking_time < app.config["OPENING_TIME"] or booking_time > app.config["CLOSING_TIME"]:
-            raise ValueError()
-                
-        booking_time = time(booking_time // 100, 0)
+        claimed, isHolder = _claimSlot(room_id, booking_date, booking_time, holder_name, holder_num, holder_email, holder_passkey)
+        if claimed:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error occurred while booking slot: {e}")
+        abort(500)
 
-        currentDate = datetime.date(datetime.now())
-        booking_date = datetime.strptime(booking_date, "%d%m%y").date()
-        if booking_date > currentDate + timedelta(days=app.config["FUTURE_WINDOW_SIZE"]):
-            raise BadRequest(f"You can only book rooms til {(currentDate + timedelta(days=app.config['FUTURE_WINDOW_SIZE'])).strftime('%d%m%y')}")
-
-    except KeyError as e:
-        raise BadRequest(f"Mandatory field missing in JSON body of request sent to {request.root_path}")
-    except ValueError as e:
-        raise BadRequest(f"Invalid data sent to POST {request.root_path}")
-    
-    # Rule 1: If a person already has a room reserved, they can't enqueue/book anywhere else
-    currentHolders : list[QueuedParty] = db.session.execute(select(QueuedParty).where(and_
-                                                                                      (or_(QueuedParty.holder_email == holder_email,
-                                                                                           QueuedParty.holder_phone == holder_num)
-                                                                                           ),
-                                                                                           QueuedParty.slot_time == booking_time,
-                                                                                            QueuedParty.slot_date == booking_date,
-                                                                                            QueuedParty.queued_index == 0,
-                                                                                            QueuedParty.room_id == room_id)).scalars().all()
-    if currentHolders:
-        conflict = Conflict("A reserved room already exists under the provided email address/phone number")
-        conflict.__setattr__("additional_info", "Since there is already a room booked under these credentials, enqueuing to or booking another room is NOT allowed.")
-        raise conflict
+    if not claimed:
+        if isHolder:
+            raise _holderConflictError()
+        return jsonify({"message" : "Slot Unavailable",
+                        "alternatives" : _suggestAlternatives(room_id, booking_date, booking_time)}), 404
 
-    try:
-        temp = {}
-        slot : Slot | None = db.session.execute(select(Slot)
-                                        .where(Slot.room == room_id,
-                                                Slot.booked == False,
-                                                Slot.date == booking_date,
-                                                Slot.time_slot == booking_time)
-                                        .with_for_update(nowait=True)   # Hehe this slot is ours now >:D
-                                        ).scalar_one_or_none()
-
-        if not slot:
-            return jsonify("Slot Unavailable"), 404
-        db.session.execute(update(Slot)
-                            .where(Slot.id == slot.id)
-                            .values(booked=True, 
-                                    queue_length=1,
-                                    holder=holder_email))
+    _mirrorSlot(claimed.room, claimed.date, claimed.time_slot, claimed.booked, claimed.queue_length, claimed.holder, [(holder_email, holder_num, 1)])
 
-        newParty = QueuedParty(hName=holder_name,
-                                hPhone=holder_num,
-                                hMail=holder_email,
-                                tBooked=datetime.now(),
-                                index=1,
-                                room_id=room_id,
-                                slot_id=slot.id,
-                                slot_date=slot.date,
-                                slot_time=slot.time_slot,
-                                passkey=holder_passkey)
-        db.session.add(newParty)
-        # Using the ORM and the SQL interface in the same scope needs should be haram I am so sorry
-        temp.update(slot.__CustomDict__())
-        db.session.commit()
+    return jsonify(_slotPayload(claimed)), 201
+
+@bp.route("/book/batch", methods=["POST"])
+@enforce_JSON
+def bookBatch() -> Response:
+    '''All-or-nothing booking of several slots (consecutive hours, a fallback room) in one transaction'''
+    bookingData = request.get_json(force=True, silent=False)
+
+    items, holder_num, holder_email, holder_name, holder_passkey = parseBatchBooking(bookingData, current_app.config, request.root_path)
 
-        return jsonify(temp), 201   
+    try:
+        slots : dict[tuple, Slot] = {(slot.room, slot.date, slot.time_slot) : slot for slot in db.session.execute(_batchForUpdate(items)).scalars()}
+        taken = [slot.id for slot in slots.values() if slot.booked]
+        # Rule 1, for the slots that are taken: is it this person holding them?
+        heldByCaller : set[int] = set(db.session.execute(select(QueuedParty.slot_id)
+                                                         .where(QueuedParty.slot_id.in_(taken),
+                                                                QueuedParty.queued_index == 1,
+                                                                or_(QueuedParty.holder_email == holder_email,
+                                                                    QueuedParty.holder_phone == holder_num))).scalars()) if taken else set()
+
+        results = []
+        for room_id, slotDate, slotTime in items:
+            slot = slots.get((room_id, slotDate, slotTime))
+            result = {"room" : room_id, "date" : slotDate.strftime("%d%m%y"), "time" : slotTime.strftime("%H%M")}
+            if slot is not None and slot.id in heldByCaller:
+                result.update(status=409, message=_holderConflictError().description)
+            elif slot is None or slot.booked:
+                result.update(status=404, message="Slot Unavailable")
+            results.append(result)
+
+        if any("status" in result for result in results):
+            db.session.rollback()
+            for result in results:
+                result.setdefault("status", 424)
+                result.setdefault("message", "Not booked, another slot in this batch is unavailable")
+            return jsonify({"booked" : False, "items" : results}), 409
+
+        claimed = [slots[item] for item in items]
+        # Guarded like _claimQuery: where FOR UPDATE locks nothing (SQLite) another batch can claim a slot since the read
+        won : set[int] = set(db.session.execute(update(Slot)
+                                                .where(Slot.id.in_([slot.id for slot in claimed]), Slot.booked == False)
+                                                .values(booked=True, queue_length=1, holder=holder_email, version=Slot.version + 1)
+                                                .returning(Slot.id)).scalars())
+        if len(won) != len(claimed):
+            db.session.rollback()
+            for result, slot in zip(results, claimed):
+                if slot.id in won:
+                    result.update(status=424, message="Not booked, another slot in this batch is unavailable")
+                else:
+                    result.update(status=404, message="Slot Unavailable")
+            return jsonify({"booked" : False, "items" : results}), 409
+        bookedAt = datetime.now()
+        db.session.execute(insert(QueuedParty.__table__), [dict(zip(_PARTY_COLUMNS, [holder_name, holder_num, holder_email, bookedAt, 1,
+                                                                                     slot.room, slot.id, slot.time_slot, slot.date, holder_passkey]))
+                                                           for slot in claimed])
+        db.session.execute(_occupancyInsert([_occupancyDelta(slot.room, slot.date, slot.time_slot, **_BOOKED) for slot in claimed]))
+        for result, slot in zip(results, claimed):
+            result.update(status=201, slot=_slotPayload(slot))
+        db.session.commit()
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Error occurred while booking slot: {e}")
+        current_app.logger.error(f"Error occurred while booking batch: {e}")
         abort(500)
 
-@app.route("/enqueue/<int:room_id>", methods=["POST"])
+    _mirrorBatch(items, holder_email, holder_num)
+    return jsonify({"booked" : True, "items" : results}), 201
+
+@bp.route("/enqueue/<int:room_id>", methods=["POST"])
 @enforce_JSON
 def enqueueToRoom(room_id) -> Response:
     bookingData = request.get_json(force=True, silent=False)
 
-    try:
-        booking_date = bookingData["date"]
-        booking_time = bookingData["time"]
-        holder_num = bookingData["number"]
-        holder_email = bookingData["email"]
-        holder_name = bookingData["name"]
-        holder_passkey = bookingData["passkey"]
-
-        if not validateDetails(holder_num, holder_email, holder_passkey):
-            raise BadRequest("Invalid formaat for holder details")
-
-        booking_time = int(booking_time)
-        if booking_time < app.config["OPENING_TIME"] or booking_time > app.config["CLOSING_TIME"]:
-            raise ValueError()
-                
-        booking_time = time(booking_time // 100, 0)
-
-        currentDate = datetime.date(datetime.now())
-        booking_date = datetime.strptime(booking_date, "%d%m%y").date()
-        if booking_date > currentDate + timedelta(days=app.config["FUTURE_WINDOW_SIZE"]):
-            raise BadRequest(f"You can only book rooms til {(currentDate + timedelta(days=app.config['FUTURE_WINDOW_SIZE'])).strftime('%d%m%y')}")
-
-    except KeyError as e:
-        raise BadRequest(f"Mandatory field missing in JSON body of request sent to {request.root_path}")
-    except ValueError as e:
-        raise BadRequest(f"Invalid data sent to POST {request.root_path}")
-    
-    # Rule 2: If a person has enqueued themselves to a room (either holding or waiting status), they cannot enqueue again.
-    partyQueued : list[QueuedParty] = db.session.execute(select(QueuedParty).where(and_
-                                                                                   (or_(QueuedParty.holder_email == holder_email,
-                                                                                        QueuedParty.holder_phone == holder_num
-                                                                                        ),
-                                                                                         QueuedParty.room_id == room_id,
-                                                                                         QueuedParty.slot_time == booking_time,
-                                                                                         QueuedParty.slot_date == booking_date
-                                                                                        ))).scalars().all()
+    booking_date, booking_time, holder_num, holder_email, holder_name, holder_passkey = parseBookingDetails(bookingData, current_app.config, request.root_path)
     
+    partyQueued : bool = db.session.execute(_alreadyQueuedQuery(room_id, booking_date, booking_time, holder_email, holder_num)).scalar()
     if partyQueued:
         raise Conflict("Credentials already in queue for this time slot")
     
     try:
         temp = {}
-        slot : Slot | None = db.session.execute(select(Slot)
-                                        .where(Slot.room == room_id, Slot.date == booking_date, Slot.time_slot == booking_time)
-                                        .with_for_update(nowait=True)
-                                        ).scalar_one_or_none()
-
-        if not slot:
-            return jsonify("Slot Unavailable"), 404
-        if not slot.booked:
-            return jsonify({"redir" : True,
-                            "redir_endpoint" : url_for("bookRoom", room_id=room_id),
-                            "message" : "This room slot does not have any reservations. Would you like to reserve it first?"}), 409
-        if slot.queue_length >= app.config["MAX_QLEN"]:
-            return jsonify({"redir" : False,
-                            "redir_endpoint" : None,
-                            "message" : f"Queue length exceeds maximum allowed parties, which is {app.config['MAX_QLEN']}"}), 409
-
-        db.session.execute(update(Slot)
-                        .where(Slot.id == slot.id)
-                        .values(queue_length=slot.queue_length+1,
-                                holder=holder_email))
+        for _ in _casAttempts():
+            slot : Slot | None = _readSlot(_slotAt(room_id, booking_date, booking_time))
+
+            rejection = _enqueueRejection(slot, url_for(".bookRoom", room_id=room_id))
+            if rejection:
+                body, status, suggest = rejection
+                db.session.rollback()
+                if suggest:
+                    body["alternatives"] = _suggestAlternatives(room_id, booking_date, booking_time)
+                return jsonify(body), status
+
+            # Queue positions are 1-based, the holder sits at 1 and a newcomer goes to the back. The holder doesn't change.
+            newQLen = slot.queue_length + 1
+            if db.session.execute(_versionedUpdate(slot, queue_length=newQLen)).rowcount:
+                break
 
         newParty = QueuedParty(hName=holder_name,
                                 hMail=holder_email,
                                 hPhone=holder_num,
                                 room_id=room_id,
                                 tBooked=datetime.now(),
-                                index=slot.queue_length,
+                                index=newQLen,
                                 slot_id=slot.id,
                                 slot_time=slot.time_slot,
                                 slot_date=slot.date,
                                 passkey=holder_passkey)
         db.session.add(newParty)
+        db.session.execute(_occupancyInsert([_occupancyDelta(room_id, slot.date, slot.time_slot, parties=1, peak_queue=newQLen)]))
 
         temp.update(slot.__CustomDict__())
+        currentHolder = slot.holder
         db.session.commit()
+        _mirrorSlot(room_id, booking_date, booking_time, True, newQLen, currentHolder, [(holder_email, holder_num, newQLen)])
 
         return jsonify(temp), 201
+    except HTTPException:
+        raise
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Error occurred while booking slot: {e}")
+        current_app.logger.error(f"Error occurred while booking slot: {e}")
         abort(500)
 
-@app.route("/cancel/<int:slot_id>", methods=["DELETE"])
+@bp.route("/cancel/<int:slot_id>", methods=["DELETE"])
 @enforce_JSON
 def cancelBooking(slot_id) -> Response:
     details : dict = request.get_json(force=True, silent=False)
@@ -305,48 +900,104 @@ def cancelBooking(slot_id) -> Response:
         holderClauses.append(QueuedParty.holder_email == identity)
 
     try:
-        with db.session.begin():
-            slot : Slot = db.session.execute(select(Slot)
-                                             .where(Slot.id == slot_id)
-                                             .with_for_update(nowait=True)).scalar_one_or_none() # Lock that mf
+        for _ in _casAttempts():
+            # Every queue change for this slot goes through its row: the lock, or the version swap in optimistic mode
+            slot : Slot = _readSlot(select(Slot).where(Slot.id == slot_id))
             if not slot:
                 raise BadRequest("Slot does not exist")
 
             party : QueuedParty = db.session.execute(select(QueuedParty)
-                                                     .where(and_(*holderClauses))
-                                                     .with_for_update(nowait=True)).scalar_one_or_none() # Lock this mf too
+                                                     .where(and_(*holderClauses))).scalar_one_or_none()
 
             if not party:
                 raise NotFound(f"No reservation exists for slot {slot_id} under {identity}")
             
             if party.passkey != passkey:
-                app.logger.warning(f"Unauthorized attempt to cancel slot {slot_id} with invalid passkey")
+                current_app.logger.warning(f"Unauthorized attempt to cancel slot {slot_id} with invalid passkey")
                 raise Unauthorized("Invalid passkey")
-            
-            if slot.queue_length > 1:
-                queue : list[QueuedParty] = db.session.execute(select(QueuedParty)
-                                                               .where(QueuedParty.slot_id == slot_id)).scalars().all()
-                queue.sort(key = QueuedParty.queued_index)
-                queue = queue[queue.index(party)+1:]
 
-                for i in queue:
-                    i.queued_index -= 1
+            cancelledIndex = party.queued_index
+
+            # The slot goes first so a lost swap hasn't touched the queue yet. Whoever ends up at position 1 holds it
+            # (the party behind a cancelling holder), an empty queue frees it. SET sees the pre-update queue_length.
+            newHolder = (select(QueuedParty.holder_email)
+                         .where(QueuedParty.slot_id == slot_id, QueuedParty.queued_index == (2 if cancelledIndex == 1 else 1))
+                         .scalar_subquery())
+            slotState = db.session.execute(_versionedUpdate(slot,
+                                                            queue_length=Slot.queue_length - 1,
+                                                            booked=Slot.queue_length > 1,
+                                                            holder=newHolder)
+                                           .returning(Slot.room, Slot.date, Slot.time_slot, Slot.booked, Slot.queue_length, Slot.holder)
+                                           .execution_options(synchronize_session=False)).one_or_none()
+            if slotState:
+                break
+
+        positions : list[Position] = [(party.holder_email, party.holder_phone, None)]     # Everyone behind the party moves up, their bookings change too
+
+        db.session.execute(delete(QueuedParty).where(QueuedParty.id == party.id))
+
+        # Close the gap in one statement instead of loading and decrementing the queue row by row
+        movedUp = db.session.execute(update(QueuedParty)
+                                     .where(QueuedParty.slot_id == slot_id, QueuedParty.queued_index > cancelledIndex)
+                                     .values(queued_index=QueuedParty.queued_index - 1)
+                                     .returning(QueuedParty.holder_email, QueuedParty.holder_phone, QueuedParty.queued_index)
+                                     .execution_options(synchronize_session=False)).all()
+        positions.extend(movedUp)
+        db.session.execute(_occupancyInsert([_occupancyDelta(slotState.room, slotState.date, slotState.time_slot,
+                                                             booked=0 if slotState.booked else -1, parties=-1, cancellations=1)]))
+        #TODO: Add Logic to send email to wheover is up next
 
-                slot.holder = queue[0].holder_name
-                #TODO: Add Logic to send email to wheover is up next
+        db.session.commit()
 
-            else:
-                slot.booked = False
-                slot.holder = None
+    except HTTPException:
+        db.session.rollback()
+        raise
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error occurred while canceling booking for slot {slot_id}: {e}")
+        raise InternalServerError()
 
-            slot.queue_length -= 1
+    _mirrorSlot(*slotState, positions)
 
-            db.session.delete(party)
-            # God bless ORMs
+    return jsonify({"message" : f"Reservation for slot {slot_id} cancelled",
+                    "slot" : {"booked" : slotState.booked, "qLen" : slotState.queue_length, "holder" : slotState.holder}}), 200
 
-            db.session.commit()
-            db.session.close()
+@bp.route("/bookings/<string:identity>/events", methods=["GET"])
+def streamBookings(identity : str) -> Response:
+    '''SSE stream of queue position changes for `identity`, instead of polling /bookings/<identity>.
+    Starts with the same listing getBookings returns (an empty one is fine, the party may not have queued yet).'''
+    whereClause = _identityClause(identity)
 
-    except SQLAlchemyError as e:
-        app.logger.error(f"Error occurred while canceling booking for slot {slot_id}: {e}")
-        raise InternalServerError()
\ No newline at end of file
+    def snapshot() -> bytes:
+        try:
+            rows = db.session.execute(_bookingsQuery(whereClause)).all()
+        except SQLAlchemyError:
+            raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+        return dumpJSON(_bookingListing(rows))
+    return _eventStream([identityChannel(identity)], "position", snapshot)
+
+@bp.route("/rooms/<int:room_id>/slots/events", methods=["GET"])
+def streamSlot(room_id : int) -> Response:
+    '''SSE stream of one slot's booked/qLen/holder changes, `date` and `time` are both required'''
+    req_date, req_time = parseSlotFilters(request.args.get("date"), request.args.get("time"), current_app.config)
+    if not (req_date and req_time):
+        raise BadRequest("date and time are both required to follow a slot")
+
+    def snapshot() -> bytes:
+        try:
+            rows = db.session.execute(_slotsQuery(room_id, req_date, req_time)).all()
+        except SQLAlchemyError:
+            raise InternalServerError("There seems to be an issue with our database service, please try again later :(")
+        if not rows:
+            raise NotFound(f"Room {room_id} has no slot at that date and time")
+        return dumpJSON(_slotListing(rows)[0])
+    return _eventStream([slotChannel(room_id, req_date, req_time)], "slot", snapshot)
+
+@bp.route("/metrics", methods=["GET"])
+def getMetrics() -> Response:
+    '''Prometheus scrape target, numbers are for this worker process only'''
+    counters = {f"library_{key}_total" : value for key, value in contentionStats.getStats().items()}
+    counters["library_redis_breaker_trips_total"] = redisManager.breaker.trips
+    counters["library_redis_breaker_rejected_total"] = redisManager.breaker.rejected
+    gauges = {f"library_l1_cache_{key}" : value for key, value in cacheManager.getStats().items()} if cacheManager else {}
+    return Response(metrics.render(counters, gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
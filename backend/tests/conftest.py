@@ -0,0 +1,72 @@
+'''Fixtures for the service tests. Every test builds its own app with create_app, configured from a clean set of
+variables (never backend/.env), against TEST_DB_URL and the Redis at TEST_REDIS_HOST.
+
+Run from backend/:
+    python -m pytest tests
+    TEST_DB_URL=postgresql://postgres@127.0.0.1/test python -m pytest tests      # Postgres-only cases run too
+TEST_DB_URL defaults to a throwaway SQLite file. Tests that need Redis skip when it doesn't answer.
+'''
+import os
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from service import create_app, db
+from service.config import AppConfig
+from service.models import Slot
+from service.auxillary_modules.cachekeys import slotsBumpCommands
+
+OPEN_HOUR, CLOSE_HOUR = 8, 20
+
+BASE_ENV = {"APP_SECRET_KEY" : "test", "APP_PORT" : "5000", "APP_HOST" : "127.0.0.1",
+            "REQUIRE_REDIS" : "0", "REDIS_PORT" : os.environ.get("TEST_REDIS_PORT", "6379"),
+            "LIB_OPENING_TIME" : f"{OPEN_HOUR:02d}00", "LIB_CLOSING_TIME" : f"{CLOSE_HOUR:02d}00",
+            "LIB_FUTURE_WINDOW_SIZE" : "3", "LIB_MAX_QUEUE_SIZE" : "10"}
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    '''make_app(redis=False, **env) -> a fresh app on empty tables. `env` overrides BASE_ENV, e.g. LIB_AVAILABILITY_INDEX="0".
+    With redis=True the app gets the Redis at TEST_REDIS_HOST (default 127.0.0.1), the test skips if there is none.'''
+    def make(redis : bool = False, **env : str):
+        for name in [name for name in os.environ if name.startswith(("LIB_", "DB_", "REDIS_", "CACHE_"))]:
+            monkeypatch.delenv(name)
+        monkeypatch.setenv("DB_URL", os.environ.get("TEST_DB_URL") or "sqlite:///" + str(tmp_path / "test.db"))
+        if redis:
+            monkeypatch.setenv("REDIS_HOST", os.environ.get("TEST_REDIS_HOST", "127.0.0.1"))
+        for name, value in (BASE_ENV | env).items():
+            monkeypatch.setenv(name, value)
+
+        app = create_app(vars(AppConfig()))
+        if redis and not app.extensions["library"]["redisManager"].ping():
+            pytest.skip("needs Redis at TEST_REDIS_HOST")
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        return app
+    return make
+
+
+def is_postgres(app) -> bool:
+    return app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql")
+
+
+def seed_slots(app, rooms : int, days : int) -> None:
+    '''Free slots for rooms 1..rooms, every opening hour of `days` days from today. Bumps their Redis versions too,
+    so nothing an earlier run cached under them can be served.'''
+    today = date.today()
+    rows = [{"room" : room, "date" : today + timedelta(days=day), "time_slot" : time(hour, 0), "booked" : False, "queue_length" : 0}
+            for day in range(days) for room in range(1, rooms + 1) for hour in range(OPEN_HOUR, CLOSE_HOUR + 1)]
+    with app.app_context():
+        db.session.execute(insert(Slot), rows)
+        db.session.commit()
+        db.session.remove()
+    app.extensions["library"]["redisManager"].safe_pipeline([command for day in range(days) for room in range(1, rooms + 1)
+                                                             for command in slotsBumpCommands(room, today + timedelta(days=day))])
+
+
+def booking(n : int, slotDate : date, hour : int) -> dict:
+    '''JSON body for /book and /enqueue, party n'''
+    return {"date" : slotDate.strftime("%d%m%y"), "time" : f"{hour:02d}00", "name" : "Test",
+            "number" : f"9{n:09d}", "email" : f"party{n}@test.in", "passkey" : "1234"}
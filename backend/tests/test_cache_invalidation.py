@@ -0,0 +1,89 @@
+'''Cached slot listings never outlive a write to what they list, and writes leave unrelated listings cached.
+The availability index is off, so the unfiltered listing goes through the cache as well.'''
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from service import db
+from service.models import Slot
+from service.auxillary_modules.cachekeys import bookingsVersionKey, bookingsKey
+from tests.conftest import seed_slots, booking
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(redis=True, LIB_AVAILABILITY_INDEX="0")
+    seed_slots(app, rooms=3, days=3)
+    return app
+
+
+def listings(client, room : int, slotDate : date, hour : int) -> list[list[dict]]:
+    '''Every listing that includes the slot: the window, its date, its date and hour'''
+    day = slotDate.strftime("%d%m%y")
+    return [client.get(path).get_json() for path in (f"/rooms/{room}/slots",
+                                                     f"/rooms/{room}/slots?date={day}",
+                                                     f"/rooms/{room}/slots?date={day}&time={hour:02d}00")]
+
+
+def slot_id(app, room : int, slotDate : date, hour : int) -> int:
+    with app.app_context():
+        return db.session.execute(select(Slot.id).where(Slot.room == room, Slot.date == slotDate, Slot.time_slot == time(hour, 0))).scalar_one()
+
+
+def state(rows : list[dict], slotDate : date, hour : int) -> tuple[bool, int]:
+    (row,) = [row for row in rows if row["date"] == slotDate.strftime("%d%m%Y") and row["time"] == f"{hour:02d}:00"]
+    return row["booked"], row["qLen"]
+
+
+def test_writes_show_on_the_next_read(app):
+    client = app.test_client()
+    slotDate = date.today() + timedelta(days=1)
+    for room, hour in ((1, 9), (2, 14), (3, 20)):
+        assert all(state(rows, slotDate, hour) == (False, 0) for rows in listings(client, room, slotDate, hour))
+        listings(client, room, slotDate, hour)         # Cached now
+
+        assert client.post(f"/book/{room}", json=booking(1, slotDate, hour)).status_code == 201
+        assert all(state(rows, slotDate, hour) == (True, 1) for rows in listings(client, room, slotDate, hour))
+
+        assert client.post(f"/enqueue/{room}", json=booking(2, slotDate, hour)).status_code == 201
+        assert all(state(rows, slotDate, hour) == (True, 2) for rows in listings(client, room, slotDate, hour))
+
+        slotId = slot_id(app, room, slotDate, hour)
+        assert client.delete(f"/cancel/{slotId}", json={"identity" : "party1@test.in", "passkey" : "1234"}).status_code == 200
+        assert all(state(rows, slotDate, hour) == (True, 1) for rows in listings(client, room, slotDate, hour))
+        assert client.delete(f"/cancel/{slotId}", json={"identity" : "party2@test.in", "passkey" : "1234"}).status_code == 200
+        assert all(state(rows, slotDate, hour) == (False, 0) for rows in listings(client, room, slotDate, hour))
+
+
+def test_writes_leave_other_listings_cached(app):
+    client = app.test_client()
+    cacheManager = app.extensions["library"]["cacheManager"]
+    today, tomorrow = date.today(), date.today() + timedelta(days=1)
+    untouched = [f"/rooms/1/slots?date={today.strftime('%d%m%y')}", "/rooms/2/slots", f"/rooms/2/slots?date={tomorrow.strftime('%d%m%y')}"]
+    before = [client.get(path).get_json() for path in untouched]
+
+    assert client.post("/book/1", json=booking(1, tomorrow, 10)).status_code == 201
+
+    hits = cacheManager.hits + cacheManager.l2Hits
+    assert [client.get(path).get_json() for path in untouched] == before
+    assert cacheManager.hits + cacheManager.l2Hits - hits == len(untouched), "a write to room 1 on one date evicted listings it isn't in"
+
+
+def test_bookings_skip_the_cache_when_the_version_cant_be_read(app, monkeypatch):
+    client = app.test_client()
+    cacheManager = app.extensions["library"]["cacheManager"]
+    tomorrow = date.today() + timedelta(days=1)
+    cacheManager.safe_pipeline([("DEL", bookingsVersionKey("party1@test.in"), bookingsKey("party1@test.in", 0))])       # Left by earlier runs
+    assert client.get("/bookings/party1@test.in").status_code == 404        # "No bookings" cached under v0
+    assert client.post("/book/1", json=booking(1, tomorrow, 10)).status_code == 201
+
+    # Redis blips: reads of the version come back empty, the stale v0 entry must not be served
+    versionRead = lambda command: command[0] == "GET" and str(command[-1]).startswith("bkngver:")
+    safePipeline, safeExecute = cacheManager.safe_pipeline, cacheManager.safe_execute_command
+    monkeypatch.setattr(cacheManager, "safe_pipeline", lambda commands, *args, **kwargs:
+                        [None] * len(commands) if any(map(versionRead, commands)) else safePipeline(commands, *args, **kwargs))
+    monkeypatch.setattr(cacheManager, "safe_execute_command", lambda name, *args, **kwargs:
+                        None if versionRead((name, *args)) else safeExecute(name, *args, **kwargs))
+    response = client.get("/bookings/party1@test.in")
+    assert response.status_code == 200 and len(response.get_json()) == 1
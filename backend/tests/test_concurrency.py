@@ -0,0 +1,77 @@
+'''No lost updates: threads churn book/enqueue/cancel on the same few slots, then every slot has to add up.
+queue_length equals the net writes that went through, positions are exactly 1..n, the holder is whoever sits
+at 1 and booked matches. Pessimistic mode takes NOWAIT row locks, so it only runs on Postgres.'''
+import random
+import threading
+from collections import Counter
+from datetime import date, time, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from service import db
+from service.models import Slot, QueuedParty
+from tests.conftest import is_postgres, seed_slots
+
+CLIENTS, ROUNDS = 8, 15
+HOURS = [8, 9, 10]
+
+
+@pytest.mark.parametrize("mode", ["optimistic", "pessimistic"])
+def test_no_lost_updates(make_app, mode):
+    app = make_app(LIB_CONCURRENCY_MODE=mode, LIB_AVAILABILITY_INDEX="0", LIB_MAX_QUEUE_SIZE=str(CLIENTS + 2))
+    if mode == "pessimistic" and not is_postgres(app):
+        pytest.skip("pessimistic mode takes NOWAIT row locks, needs TEST_DB_URL on Postgres")
+    seed_slots(app, rooms=1, days=2)
+    slotDate = date.today() + timedelta(days=1)
+    with app.app_context():
+        slotIds = {hour : db.session.execute(select(Slot.id).where(Slot.room == 1, Slot.date == slotDate, Slot.time_slot == time(hour, 0))).scalar_one()
+                   for hour in HOURS}
+
+    statuses, applied = Counter(), Counter()        # applied: net queue change per hour of every write that went through
+    tally = threading.Lock()
+    barrier = threading.Barrier(CLIENTS)
+
+    def client(n : int) -> None:
+        '''Cancels where it holds a reservation, enqueues elsewhere and books when there is nothing to queue behind'''
+        http = app.test_client()
+        rng = random.Random(n)
+        who = {"number" : f"9{n:09d}", "email" : f"party{n}@test.in", "name" : "Test", "passkey" : "1234"}
+        queued = set()
+        barrier.wait()
+        for _ in range(ROUNDS):
+            for hour in rng.sample(HOURS, len(HOURS)):
+                if hour in queued:
+                    response = http.delete(f"/cancel/{slotIds[hour]}", json={"identity" : who["email"], "passkey" : who["passkey"]})
+                    action, delta = "cancel", -1
+                else:
+                    body = dict(who, date=slotDate.strftime("%d%m%y"), time=f"{hour:02d}00")
+                    response = http.post("/enqueue/1", json=body)
+                    action, delta = "enqueue", 1
+                    if response.status_code == 409 and (response.get_json() or {}).get("redir"):
+                        response = http.post("/book/1", json=body)
+                        action = "book"
+                with tally:
+                    statuses[f"{action} {response.status_code}"] += 1
+                    if response.status_code in (200, 201):
+                        applied[hour] += delta
+                if response.status_code in (200, 201):
+                    queued ^= {hour}
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not any(key.endswith(" 500") for key in statuses), statuses
+    with app.app_context():
+        for hour in HOURS:
+            slot = db.session.get(Slot, slotIds[hour])
+            queue = db.session.execute(select(QueuedParty.queued_index, QueuedParty.holder_email)
+                                       .where(QueuedParty.slot_id == slot.id)
+                                       .order_by(QueuedParty.queued_index)).all()
+            assert slot.queue_length == applied[hour], f"{hour}:00 queue_length {slot.queue_length} but {applied[hour]} net writes went through"
+            assert [position for position, _ in queue] == list(range(1, slot.queue_length + 1)), f"{hour}:00 positions {queue}"
+            assert slot.holder == (queue[0].holder_email if queue else None), f"{hour}:00 holder {slot.holder}, position 1 is {queue[:1]}"
+            assert slot.booked == bool(queue), f"{hour}:00 booked {slot.booked} with {len(queue)} queued"
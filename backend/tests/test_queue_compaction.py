@@ -0,0 +1,58 @@
+'''Cancelling closes the gap in the queue: everyone behind moves up one, in order, and the slot's holder,
+booked and queue_length follow the new front of the queue.'''
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlalchemy import select, insert
+
+from service import db
+from service.models import Slot, QueuedParty
+
+SLOT_DATE = date.today() + timedelta(days=1)
+SLOT_TIME = time(10, 0)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+def make_queue(app, length : int) -> int:
+    '''A booked slot with parties 1..length at positions 1..length, returns the slot id'''
+    with app.app_context():
+        slotId = db.session.execute(insert(Slot).values(room=1, date=SLOT_DATE, time_slot=SLOT_TIME, booked=True,
+                                                        queue_length=length, holder="party1@test.in")
+                                    .returning(Slot.id)).scalar_one()
+        db.session.execute(insert(QueuedParty), [{"holder_name" : "Test", "holder_phone" : f"9{i:09d}", "holder_email" : f"party{i}@test.in",
+                                                  "time_booked" : datetime.now(), "queued_index" : i, "room_id" : 1, "slot_id" : slotId,
+                                                  "slot_time" : SLOT_TIME, "slot_date" : SLOT_DATE, "passkey" : "1234"}
+                                                 for i in range(1, length + 1)])
+        db.session.commit()
+    return slotId
+
+
+def queue_and_slot(app, slotId : int) -> tuple[list[tuple[str, int]], tuple[bool, int, str | None]]:
+    with app.app_context():
+        queue = db.session.execute(select(QueuedParty.holder_email, QueuedParty.queued_index)
+                                   .where(QueuedParty.slot_id == slotId)
+                                   .order_by(QueuedParty.queued_index)).all()
+        slot = db.session.get(Slot, slotId)
+        return [tuple(row) for row in queue], (slot.booked, slot.queue_length, slot.holder)
+
+
+@pytest.mark.parametrize("position", [1, 3, 5], ids=["front", "middle", "tail"])
+def test_cancel_compacts_the_queue(app, position):
+    slotId = make_queue(app, 5)
+    response = app.test_client().delete(f"/cancel/{slotId}", json={"identity" : f"party{position}@test.in", "passkey" : "1234"})
+    assert response.status_code == 200, response.get_data()
+
+    expected = [(f"party{i}@test.in", rank) for rank, i in enumerate([i for i in range(1, 6) if i != position], start=1)]
+    queue, slot = queue_and_slot(app, slotId)
+    assert queue == expected
+    assert slot == (True, 4, expected[0][0])
+
+
+def test_cancelling_the_only_party_frees_the_slot(app):
+    slotId = make_queue(app, 1)
+    assert app.test_client().delete(f"/cancel/{slotId}", json={"identity" : "party1@test.in", "passkey" : "1234"}).status_code == 200
+    assert queue_and_slot(app, slotId) == ([], (False, 0, None))
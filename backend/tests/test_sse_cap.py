@@ -0,0 +1,33 @@
+'''The Flask app keeps at most SSE_MAX_SYNC_STREAMS streams open, each holds a worker thread. Past the cap it
+answers 503 with Retry-After, and every way a stream ends gives its place back.'''
+from datetime import date, timedelta
+
+from tests.conftest import seed_slots
+
+
+def test_streams_past_the_cap_are_turned_away(make_app):
+    app = make_app(LIB_SSE_MAX_SYNC_STREAMS="2")
+    seed_slots(app, rooms=1, days=2)
+    client = app.test_client()
+    day = (date.today() + timedelta(days=1)).strftime("%d%m%y")
+
+    # A failed snapshot holds no place
+    assert client.get(f"/rooms/9/slots/events?date={day}&time=1000").status_code == 404
+
+    first = client.get("/bookings/party1@test.in/events", buffered=False)
+    with app.test_request_context(f"/rooms/1/slots/events?date={day}&time=1000"):
+        second = app.full_dispatch_request()        # Straight from the view, the test client would start reading it
+    assert (first.status_code, second.status_code) == (200, 200)
+
+    turnedAway = client.get("/bookings/party3@test.in/events", buffered=False)
+    assert turnedAway.status_code == 503
+    assert turnedAway.headers["Retry-After"] == "5"
+
+    # One closed after reading, one closed without ever being read, both give their place back
+    assert next(first.response).startswith(b"retry: 3000\n")
+    first.close()
+    second.close()
+    streams = [client.get("/bookings/party3@test.in/events", buffered=False) for _ in range(2)]
+    assert [stream.status_code for stream in streams] == [200, 200]
+    for stream in streams:
+        stream.close()